@@ -0,0 +1,211 @@
+import json
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import extract_hstore_value, snapshot_key, stage_profile
+
+# Input layers
+osm_gpkg = "output-data/gpkg-files/kentucky-filtered-highways.gpkg"
+osm_layer = "lines"
+nbi_gpkg = "output-data/gpkg-files/NBI-Kentucky-Bridge-Data.gpkg"
+
+# Outputs, with the key of the OSM and NBI snapshots the flags were computed from
+cache_dir = "output-data/cache"
+output_bridges_csv = "output-data/csv-files/Parallel-Carriageway-Bridges.csv"
+output_snapshot_json = "output-data/csv-files/Parallel-Carriageway-Bridges.json"
+
+# Metric CRS used for all distance and bearing computations
+metric_crs = "EPSG:32616"
+
+# Highway classes that are mapped as separate oneway carriageways
+parallel_highway_types = [
+    "motorway",
+    "motorway_link",
+    "trunk",
+    "trunk_link",
+    "primary",
+    "primary_link",
+]
+
+# Ways are cut into segments no longer than this before indexing midpoints
+max_segment_length_m = 25.0
+
+# Two segments form a parallel pair when their midpoints are within this distance
+parallel_distance_m = 30.0
+
+# Allowed deviation from a 180 degree bearing difference
+bearing_tolerance_deg = 20.0
+
+# Bridges within this distance of a parallel segment are flagged
+bridge_distance_m = 30.0
+
+
+def load_oneway_ways(gpkg_path, layer):
+    """
+    Function to load oneway major ways without a bridge tag in a metric CRS
+    """
+    ways = gpd.read_file(gpkg_path, layer=layer, columns=["osm_id", "highway", "other_tags"])
+    oneway = extract_hstore_value(ways["other_tags"], "oneway")
+    bridge = extract_hstore_value(ways["other_tags"], "bridge")
+    ways = ways[
+        ways["highway"].isin(parallel_highway_types)
+        & (oneway == "yes")
+        & bridge.isna()
+    ]
+    ways = ways.to_crs(metric_crs)
+    return ways[["osm_id", "geometry"]].reset_index(drop=True)
+
+
+def build_segment_index(ways):
+    """
+    Function to build arrays of segment midpoints and bearings for every way
+    """
+    lines = shapely.segmentize(ways.geometry.values, max_segment_length_m)
+    coords, line_index = shapely.get_coordinates(lines, return_index=True)
+
+    # Consecutive coordinates of the same way form a segment
+    same_way = line_index[:-1] == line_index[1:]
+    start = coords[:-1][same_way]
+    end = coords[1:][same_way]
+    way_index = line_index[:-1][same_way]
+
+    midpoints = (start + end) / 2
+    delta = end - start
+    bearings = np.degrees(np.arctan2(delta[:, 0], delta[:, 1])) % 360
+
+    return pd.DataFrame(
+        {
+            "osm_id": ways["osm_id"].values[way_index],
+            "x": midpoints[:, 0],
+            "y": midpoints[:, 1],
+            "bearing": bearings,
+        }
+    )
+
+
+def find_parallel_segment_pairs(segments):
+    """
+    Function to find segment pairs of different ways running anti-parallel within the distance threshold
+    """
+    points = shapely.points(segments[["x", "y"]].values)
+    tree = shapely.STRtree(points)
+    left, right = tree.query(points, predicate="dwithin", distance=parallel_distance_m)
+
+    osm_ids = segments["osm_id"].values
+    keep = (left < right) & (osm_ids[left] != osm_ids[right])
+    left, right = left[keep], right[keep]
+
+    bearings = segments["bearing"].values
+    difference = np.abs(bearings[left] - bearings[right]) % 360
+    anti_parallel = np.abs(difference - 180) <= bearing_tolerance_deg
+    left, right = left[anti_parallel], right[anti_parallel]
+
+    return pd.DataFrame(
+        {
+            "osm_id": osm_ids[left],
+            "osm_id_2": osm_ids[right],
+            "x": segments["x"].values[left],
+            "y": segments["y"].values[left],
+            "x_2": segments["x"].values[right],
+            "y_2": segments["y"].values[right],
+            "distance_m": shapely.distance(points[left], points[right]),
+        }
+    )
+
+
+def summarize_way_pairs(segment_pairs):
+    """
+    Function to collapse matching segment pairs into one row per pair of ways
+    """
+    return (
+        segment_pairs.groupby(["osm_id", "osm_id_2"])
+        .agg(
+            segment_pairs=("distance_m", "size"),
+            min_distance_m=("distance_m", "min"),
+            mean_distance_m=("distance_m", "mean"),
+        )
+        .reset_index()
+    )
+
+
+def load_parallel_pairs(gpkg_path, layer):
+    """
+    Function to load the parallel segment pairs for an OSM snapshot, computing them once per snapshot
+    """
+    snapshot_dir = os.path.join(cache_dir, f"parallel-carriageways-{snapshot_key(gpkg_path)}")
+    segment_pairs_csv = os.path.join(snapshot_dir, "Parallel-Segment-Pairs.csv")
+    way_pairs_csv = os.path.join(snapshot_dir, "Parallel-Way-Pairs.csv")
+
+    if os.path.exists(segment_pairs_csv):
+        print(f"Reusing cached parallel pairs from {snapshot_dir}")
+        return pd.read_csv(segment_pairs_csv)
+
+    ways = load_oneway_ways(gpkg_path, layer)
+    segments = build_segment_index(ways)
+    segment_pairs = find_parallel_segment_pairs(segments)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    segment_pairs.to_csv(segment_pairs_csv, index=False)
+    summarize_way_pairs(segment_pairs).to_csv(way_pairs_csv, index=False)
+    print(f"Output file: {way_pairs_csv} has been created successfully!")
+
+    return segment_pairs
+
+
+def flag_parallel_bridges(nbi_gpkg_path, segment_pairs):
+    """
+    Function to flag bridges lying near either carriageway of a parallel pair
+    """
+    bridges = gpd.read_file(nbi_gpkg_path, columns=["STRUCTURE_NUMBER_008"]).to_crs(
+        metric_crs
+    )
+
+    # Both sides of every pair are indexed so a bridge on either carriageway is found
+    pair_points = shapely.points(
+        np.concatenate(
+            [segment_pairs[["x", "y"]].values, segment_pairs[["x_2", "y_2"]].values]
+        )
+    )
+    pair_way_ids = np.concatenate(
+        [segment_pairs["osm_id"].values, segment_pairs["osm_id_2"].values]
+    )
+    tree = shapely.STRtree(pair_points)
+    bridge_index, pair_index = tree.query(
+        bridges.geometry.values, predicate="dwithin", distance=bridge_distance_m
+    )
+
+    flagged = pd.DataFrame(
+        {
+            "STRUCTURE_NUMBER_008": bridges["STRUCTURE_NUMBER_008"].values[bridge_index],
+            "osm_id": pair_way_ids[pair_index],
+        }
+    )
+    return flagged.drop_duplicates().sort_values(["STRUCTURE_NUMBER_008", "osm_id"])
+
+
+def main():
+    os.makedirs("output-data/csv-files", exist_ok=True)
+
+    segment_pairs = load_parallel_pairs(osm_gpkg, osm_layer)
+    flagged = flag_parallel_bridges(nbi_gpkg, segment_pairs)
+    flagged.to_csv(output_bridges_csv, index=False)
+    # Read by the tagging step to check that the flags match its OSM and NBI inputs
+    with open(output_snapshot_json, "w") as f:
+        json.dump({"osm": snapshot_key(osm_gpkg), "nbi": snapshot_key(nbi_gpkg)}, f)
+
+    print(
+        f"{flagged['STRUCTURE_NUMBER_008'].nunique()} bridges lie on parallel carriageways"
+    )
+    print(f"Output file: {output_bridges_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    with stage_profile("detect-parallel-carriageways"):
+        main()
@@ -0,0 +1,175 @@
+import json
+import math
+import os
+import sys
+from itertools import product
+
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import snapshot_key, stage_profile
+
+# Path and layer of the full NHD flowline GeoPackage
+input_nhd_gpkg = "input-data/NHD-Kentucky-Streams-Flowline.gpkg"
+input_nhd_layer = "NHD-Kentucky-Flowline"
+
+# Layers whose extent bounds the flowlines that are read
+extent_sources = {
+    "ways": ("output-data/gpkg-files/kentucky-filtered-highways.gpkg", "lines"),
+    "bridges": ("output-data/gpkg-files/NBI-Kentucky-Bridge-Data.gpkg", None),
+}
+extent_source = "ways"
+
+# Output GeoPackage (with its R-tree index) and the key of the inputs it was built from
+output_nhd_gpkg = "output-data/gpkg-files/NHD-Flowline-Subset.gpkg"
+output_nhd_layer = "NHD-Flowline"
+output_snapshot_json = "output-data/gpkg-files/NHD-Flowline-Subset.json"
+
+# Attributes used by the tagging and association stages
+nhd_columns = [
+    "OBJECTID",
+    "permanent_identifier",
+    "gnis_id",
+    "gnis_name",
+    "fcode_description",
+]
+
+# Optional list of NHD FCodes to keep, e.g. [46003, 46006, 55800]; None keeps all
+fcodes = None
+
+# Size of the grid cells used to query the R-tree, and the margin kept around each feature
+cell_size_deg = 0.1
+halo_deg = 0.001
+
+
+def occupied_cells(gpkg_path, layer):
+    """
+    Function to find the grid cells touched by the features of a layer, including a halo
+    """
+    geometries = pyogrio.read_dataframe(gpkg_path, layer=layer, columns=[]).geometry
+    bounds = shapely.bounds(geometries.values)
+    bounds[:, :2] -= halo_deg
+    bounds[:, 2:] += halo_deg
+
+    cells = set()
+    for minx, miny, maxx, maxy in bounds:
+        cells.update(
+            product(
+                range(math.floor(minx / cell_size_deg), math.floor(maxx / cell_size_deg) + 1),
+                range(math.floor(miny / cell_size_deg), math.floor(maxy / cell_size_deg) + 1),
+            )
+        )
+    return cells
+
+
+def cells_to_bboxes(cells):
+    """
+    Function to merge runs of adjacent cells in each grid row into single bounding boxes
+    """
+    bboxes = []
+    rows = {}
+    for ix, iy in cells:
+        rows.setdefault(iy, []).append(ix)
+
+    for iy, columns in sorted(rows.items()):
+        columns.sort()
+        run_start = previous = columns[0]
+        for ix in columns[1:] + [None]:
+            if ix is not None and ix == previous + 1:
+                previous = ix
+                continue
+            bboxes.append(
+                (
+                    run_start * cell_size_deg,
+                    iy * cell_size_deg,
+                    (previous + 1) * cell_size_deg,
+                    (iy + 1) * cell_size_deg,
+                )
+            )
+            if ix is not None:
+                run_start = previous = ix
+    return bboxes
+
+
+def fcode_filter():
+    """
+    Function to build the attribute filter selecting the requested FCodes
+    """
+    if not fcodes:
+        return None
+    return f"fcode IN ({', '.join(str(int(fcode)) for fcode in fcodes)})"
+
+
+def read_flowlines(bboxes):
+    """
+    Function to read the pruned flowline columns inside each bounding box through the R-tree
+    """
+    layer_columns = pyogrio.read_info(input_nhd_gpkg, layer=input_nhd_layer)["fields"]
+    columns = [column for column in nhd_columns if column in layer_columns]
+
+    parts = []
+    for bbox in bboxes:
+        part = pyogrio.read_dataframe(
+            input_nhd_gpkg,
+            layer=input_nhd_layer,
+            columns=columns,
+            bbox=bbox,
+            where=fcode_filter(),
+            fid_as_index=True,
+        )
+        if not part.empty:
+            parts.append(part)
+
+    if not parts:
+        return gpd.GeoDataFrame(columns=nhd_columns + ["geometry"], geometry="geometry")
+
+    flowlines = pd.concat(parts)
+    # Flowlines crossing a box edge are returned by every box they touch
+    flowlines = flowlines[~flowlines.index.duplicated()]
+
+    # OBJECTID is often the GeoPackage feature id rather than a regular column
+    if "OBJECTID" not in flowlines.columns:
+        flowlines["OBJECTID"] = flowlines.index
+    return flowlines.reset_index(drop=True)[nhd_columns + ["geometry"]]
+
+
+def main():
+    extent_gpkg, extent_layer = extent_sources[extent_source]
+    snapshot = {
+        "nhd": snapshot_key(input_nhd_gpkg),
+        "extent": snapshot_key(extent_gpkg),
+        "extent_source": extent_source,
+        "fcodes": fcodes,
+        "cell_size_deg": cell_size_deg,
+        "halo_deg": halo_deg,
+    }
+
+    if os.path.exists(output_nhd_gpkg) and os.path.exists(output_snapshot_json):
+        with open(output_snapshot_json, "r") as f:
+            if json.load(f) == snapshot:
+                print(f"{output_nhd_gpkg} is up to date with its inputs")
+                return
+
+    bboxes = cells_to_bboxes(occupied_cells(extent_gpkg, extent_layer))
+    print(f"Reading NHD flowlines inside {len(bboxes)} bounding boxes......!")
+    flowlines = read_flowlines(bboxes)
+
+    if os.path.exists(output_nhd_gpkg):
+        os.remove(output_nhd_gpkg)
+    pyogrio.write_dataframe(
+        flowlines, output_nhd_gpkg, layer=output_nhd_layer, driver="GPKG"
+    )
+    with open(output_snapshot_json, "w") as f:
+        json.dump(snapshot, f)
+
+    print(f"{len(flowlines)} flowlines kept")
+    print(f"Output file: {output_nhd_gpkg} has been created successfully!")
+
+
+if __name__ == "__main__":
+    with stage_profile("extract-nhd-flowlines"):
+        main()
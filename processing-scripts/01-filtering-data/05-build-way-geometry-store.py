@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+from array import array
+
+import numpy as np
+import osmium
+import pyogrio
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import (
+    choose_location_index,
+    remove_location_index,
+    snapshot_key,
+    stage_profile,
+)
+
+# Filtered highways produced by 01-filter-osm-ways.py
+input_osm_gpkg = "output-data/gpkg-files/kentucky-filtered-highways.gpkg"
+input_osm_layer = "lines"
+input_osm_pbf = "output-data/pbf-files/kentucky-filtered-highways.osm.pbf"
+
+# Read the ways from the GeoPackage ("gpkg") or straight from the PBF ("pbf"),
+# which avoids converting multi-state and nationwide extracts with ogr2ogr
+way_source = "gpkg"
+
+# Directory holding the flat binary arrays of the store
+output_store_dir = "output-data/way-store"
+
+
+def read_ways(gpkg_path, layer):
+    """
+    Function to read way ids and line geometries from the filtered highways
+    """
+    ways = pyogrio.read_dataframe(gpkg_path, layer=layer, columns=["osm_id"])
+    ways = ways[ways["osm_id"].notna() & ways.geometry.notna()]
+    way_ids = ways["osm_id"].astype("int64").to_numpy()
+    return way_ids, ways.geometry.values
+
+
+class WayCoordinateHandler(osmium.SimpleHandler):
+    """
+    Collect the id and node coordinates of every way into flat arrays
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.way_ids = array("q")
+        self.counts = array("q")
+        self.x = array("d")
+        self.y = array("d")
+
+    def way(self, w):
+        locations = [node.location for node in w.nodes if node.location.valid()]
+        if len(locations) < 2:
+            return
+        self.way_ids.append(w.id)
+        self.counts.append(len(locations))
+        self.x.extend(location.lon for location in locations)
+        self.y.extend(location.lat for location in locations)
+
+
+def read_ways_from_pbf(pbf_path):
+    """
+    Function to read way ids and node coordinates from a PBF extract
+    """
+    index_type = choose_location_index(pbf_path)
+    print(f"Reading {pbf_path} with the {index_type.split(',')[0]} location index......!")
+
+    handler = WayCoordinateHandler()
+    try:
+        handler.apply_file(pbf_path, locations=True, idx=index_type)
+    finally:
+        remove_location_index(index_type)
+
+    return (
+        np.frombuffer(handler.way_ids, dtype="int64"),
+        np.frombuffer(handler.counts, dtype="int64"),
+        np.frombuffer(handler.x, dtype="float64"),
+        np.frombuffer(handler.y, dtype="float64"),
+    )
+
+
+def build_store_arrays(way_ids, lines):
+    """
+    Function to flatten line geometries into coordinate arrays with per-way offsets
+    """
+    coords, line_index = shapely.get_coordinates(lines, return_index=True)
+    counts = np.bincount(line_index, minlength=len(lines))
+    return pack_store_arrays(way_ids, counts, coords[:, 0], coords[:, 1])
+
+
+def pack_store_arrays(way_ids, counts, x, y):
+    """
+    Function to assemble the store arrays from per-way coordinate counts
+    """
+    # Ways without coordinates (empty geometries) have no bounds and nothing to
+    # split, and reduceat would give them the next way's coordinate: drop them
+    way_ids = np.asarray(way_ids)[counts > 0]
+    counts = counts[counts > 0]
+
+    offsets = np.zeros(len(way_ids) + 1, dtype="int64")
+    np.cumsum(counts, out=offsets[1:])
+    starts = offsets[:-1]
+
+    bounds = np.empty((0, 4))
+    if len(way_ids):
+        bounds = np.column_stack(
+            [
+                np.minimum.reduceat(x, starts),
+                np.minimum.reduceat(y, starts),
+                np.maximum.reduceat(x, starts),
+                np.maximum.reduceat(y, starts),
+            ]
+        )
+
+    sorted_index = np.argsort(way_ids, kind="stable")
+
+    return {
+        "way_ids": way_ids.astype("int64"),
+        "offsets": offsets,
+        "x": np.ascontiguousarray(x, dtype="float64"),
+        "y": np.ascontiguousarray(y, dtype="float64"),
+        "bounds": bounds.astype("float64"),
+        "sorted_ids": way_ids[sorted_index].astype("int64"),
+        "sorted_index": sorted_index.astype("int64"),
+    }
+
+
+def write_store(store_dir, arrays, snapshot):
+    """
+    Function to write every array as a .npy file that can be opened with numpy.memmap
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(store_dir, f"{name}.npy"), array)
+
+    meta = {
+        "snapshot": snapshot,
+        "way_count": int(len(arrays["way_ids"])),
+        "coordinate_count": int(len(arrays["x"])),
+        "crs": "EPSG:4326",
+    }
+    with open(os.path.join(store_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def main():
+    input_path = input_osm_pbf if way_source == "pbf" else input_osm_gpkg
+    snapshot = snapshot_key(input_path)
+    meta_path = os.path.join(output_store_dir, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f)["snapshot"] == snapshot:
+                print(f"{output_store_dir} is up to date with {input_path}")
+                return
+
+    if way_source == "pbf":
+        arrays = pack_store_arrays(*read_ways_from_pbf(input_osm_pbf))
+    else:
+        way_ids, lines = read_ways(input_osm_gpkg, input_osm_layer)
+        arrays = build_store_arrays(way_ids, lines)
+    write_store(output_store_dir, arrays, snapshot)
+
+    print(f"{len(arrays['way_ids'])} ways and {len(arrays['x'])} coordinates stored")
+    print(f"Output directory: {output_store_dir} has been created successfully!")
+
+
+if __name__ == "__main__":
+    with stage_profile("build-way-geometry-store"):
+        main()
@@ -0,0 +1,88 @@
+import os
+import sys
+
+import pandas as pd
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import stage_profile
+
+# NBI release used by the previous run and the new release
+previous_nbi_csv = "input-data/previous/Kentucky-NBI-bridge-data.csv"
+current_nbi_csv = "input-data/Kentucky-NBI-bridge-data.csv"
+
+# Bridges whose status is not "unchanged", read by the incremental tagging run
+release_diff_csv = "output-data/csv-files/NBI-Release-Diff.csv"
+
+# NBI fields hashed to detect moved and changed bridges
+diff_fields = {
+    "coordinates": ["LAT_016", "LONG_017"],
+    "attributes": [
+        "STRUCTURE_TYPE_043B",
+        "OPEN_CLOSED_POSTED_041",
+        "STRUCTURE_LEN_MT_049",
+    ],
+}
+
+
+def hash_release(nbi_csv):
+    """
+    Function to hash the coordinate and attribute fields of every bridge of an NBI release
+    """
+    fields = [field for group in diff_fields.values() for field in group]
+    df = pd.read_csv(
+        nbi_csv,
+        usecols=["STRUCTURE_NUMBER_008"] + fields,
+        # Structure numbers keep their leading zeros, as in the tagging step
+        dtype={field: str for field in ["STRUCTURE_NUMBER_008"] + fields},
+        low_memory=False,
+    )
+    df = df.drop_duplicates(subset="STRUCTURE_NUMBER_008")
+
+    hashes = pd.DataFrame({"STRUCTURE_NUMBER_008": df["STRUCTURE_NUMBER_008"]})
+    for group, group_fields in diff_fields.items():
+        # Hash the raw text so that number formatting cannot differ between releases
+        values = df[group_fields].fillna("").apply(lambda column: column.str.strip())
+        hashes[f"{group}_hash"] = [
+            f"{value:016x}"
+            for value in pd.util.hash_pandas_object(values, index=False).tolist()
+        ]
+    return hashes
+
+
+def classify_bridges(previous_hashes, current_hashes):
+    """
+    Function to classify every bridge as new, removed, moved, changed or unchanged
+    """
+    df = previous_hashes.merge(
+        current_hashes,
+        on="STRUCTURE_NUMBER_008",
+        how="outer",
+        suffixes=("_previous", ""),
+        indicator=True,
+    )
+
+    status = pd.Series("unchanged", index=df.index)
+    status[df["attributes_hash"] != df["attributes_hash_previous"]] = "changed"
+    status[df["coordinates_hash"] != df["coordinates_hash_previous"]] = "moved"
+    status[df["_merge"] == "right_only"] = "new"
+    status[df["_merge"] == "left_only"] = "removed"
+    df["status"] = status
+
+    return df[["STRUCTURE_NUMBER_008", "status", "coordinates_hash", "attributes_hash"]]
+
+
+def main():
+    previous_hashes = hash_release(previous_nbi_csv)
+    current_hashes = hash_release(current_nbi_csv)
+    diff = classify_bridges(previous_hashes, current_hashes)
+
+    print(diff["status"].value_counts().to_string())
+
+    diff[diff["status"] != "unchanged"].to_csv(release_diff_csv, index=False)
+    print(f"Output file: {release_diff_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    with stage_profile("diff-nbi-releases"):
+        main()
@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyogrio
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import extract_hstore_value, snapshot_key, stage_profile
+
+# NBI bridge points of one release and filtered highways of one OSM snapshot
+input_nbi_gpkg = "output-data/gpkg-files/NBI-Kentucky-Bridge-Data.gpkg"
+input_osm_gpkg = "output-data/gpkg-files/kentucky-filtered-highways.gpkg"
+input_osm_layer = "lines"
+
+# NHD flowlines, or their subset near the roads written by 04-extract-nhd-flowlines.py
+input_nhd_gpkg = "input-data/NHD-Kentucky-Streams-Flowline.gpkg"
+input_nhd_layer = "NHD-Kentucky-Flowline"
+nhd_subset_gpkg = "output-data/gpkg-files/NHD-Flowline-Subset.gpkg"
+nhd_subset_layer = "NHD-Flowline"
+
+# Metric CRS used for all distances
+metric_crs = "EPSG:32616"
+
+# Ways kept per bridge, nearest first, and the largest radius any consumer needs
+# (the 80m bridge tag filter of the tagging step)
+max_candidates = 100
+max_radius_m = 80.0
+
+# Streams within this distance of a bridge are its streams (10m buffer of the tagging step)
+stream_radius_m = 10.0
+
+# OSM tags of the filters, read from their own column when ogr2ogr gives them one
+# (man_made with its default osmconf.ini) and from 'other_tags' otherwise
+candidate_tags = ["bridge", "man_made", "layer", "oneway"]
+
+# Candidate table and the key of the inputs it was built from
+output_candidates_csv = "output-data/csv-files/Bridge-Way-Candidates.csv"
+output_snapshot_json = "output-data/csv-files/Bridge-Way-Candidates.json"
+
+
+def nhd_source():
+    """
+    Function to choose the NHD layer, preferring the subset near the roads
+    """
+    if os.path.exists(nhd_subset_gpkg):
+        return nhd_subset_gpkg, nhd_subset_layer
+    return input_nhd_gpkg, input_nhd_layer
+
+
+def load_bridges():
+    """
+    Function to load the NBI bridge points in the metric CRS
+    """
+    bridges = pyogrio.read_dataframe(
+        input_nbi_gpkg, columns=["OBJECTID", "STRUCTURE_NUMBER_008"]
+    )
+    bridges["STRUCTURE_NUMBER_008"] = bridges["STRUCTURE_NUMBER_008"].astype(str)
+    return bridges.to_crs(metric_crs).reset_index(drop=True)
+
+
+def load_ways(osm_gpkg=input_osm_gpkg, osm_layer=input_osm_layer):
+    """
+    Function to load the ways with their highway class and filter tags in the metric CRS
+    """
+    fields = set(pyogrio.read_info(osm_gpkg, layer=osm_layer)["fields"])
+    tag_columns = [key for key in candidate_tags if key in fields]
+    ways = pyogrio.read_dataframe(
+        osm_gpkg,
+        layer=osm_layer,
+        columns=["osm_id", "name", "highway", *tag_columns, "other_tags"],
+    )
+    ways = ways[ways["osm_id"].notna() & ways.geometry.notna()]
+    ways["osm_id"] = ways["osm_id"].astype("int64")
+    for key in candidate_tags:
+        if key not in tag_columns:
+            ways[key] = extract_hstore_value(ways["other_tags"], key)
+    ways = ways[["osm_id", "name", "highway", *candidate_tags, "geometry"]].to_crs(metric_crs)
+    return ways.reset_index(drop=True)
+
+
+def load_streams():
+    """
+    Function to load the NHD flowlines in the metric CRS
+    """
+    nhd_gpkg, nhd_layer = nhd_source()
+    streams = pyogrio.read_dataframe(
+        nhd_gpkg, layer=nhd_layer, columns=["OBJECTID", "permanent_identifier"]
+    )
+    return streams.to_crs(metric_crs).reset_index(drop=True)
+
+
+def nearest_candidates(points, geometries, k, radius):
+    """
+    Function to find the k nearest geometries within radius of every point, with their rank
+    """
+    tree = shapely.STRtree(geometries)
+    point_index, geometry_index = tree.query(points, predicate="dwithin", distance=radius)
+    distances = shapely.distance(points[point_index], geometries[geometry_index])
+
+    order = np.lexsort((geometry_index, distances, point_index))
+    point_index, geometry_index, distances = (
+        point_index[order],
+        geometry_index[order],
+        distances[order],
+    )
+
+    # Rank of each geometry among the geometries found for its point
+    first = np.ones(len(point_index), dtype=bool)
+    first[1:] = point_index[1:] != point_index[:-1]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(point_index)), 0))
+    rank = np.arange(len(point_index)) - group_start + 1
+
+    keep = rank <= k
+    return point_index[keep], geometry_index[keep], distances[keep], rank[keep]
+
+
+def stream_links(bridges, ways, streams):
+    """
+    Function to link the ways to the streams they cross, and the bridges to the streams near them
+    """
+    stream_tree = shapely.STRtree(streams.geometry.values)
+    way_index, stream_index = stream_tree.query(ways.geometry.values, predicate="intersects")
+    way_streams = pd.DataFrame(
+        {
+            "osm_id": ways["osm_id"].values[way_index],
+            "stream_id": streams["OBJECTID"].values[stream_index],
+        }
+    ).drop_duplicates()
+
+    bridge_index, stream_index = stream_tree.query(
+        bridges.geometry.values, predicate="dwithin", distance=stream_radius_m
+    )
+    bridge_streams = pd.DataFrame(
+        {
+            "OBJECTID": bridges["OBJECTID"].values[bridge_index],
+            "stream_id": streams["OBJECTID"].values[stream_index],
+        }
+    ).drop_duplicates()
+    return way_streams, bridge_streams
+
+
+def build_candidates(bridges, ways, streams):
+    """
+    Function to list the k nearest ways within max_radius_m of every bridge, with their
+    distance, highway class, filter tags and stream crossing flags
+    """
+    bridge_index, way_index, distances, rank = nearest_candidates(
+        bridges.geometry.values, ways.geometry.values, max_candidates, max_radius_m
+    )
+    candidates = pd.concat(
+        [
+            bridges[["OBJECTID", "STRUCTURE_NUMBER_008"]].iloc[bridge_index].reset_index(drop=True),
+            ways.drop(columns="geometry").iloc[way_index].reset_index(drop=True),
+        ],
+        axis=1,
+    )
+    candidates.insert(3, "rank", rank)
+    candidates.insert(4, "distance_m", np.round(distances, 3))
+
+    way_streams, bridge_streams = stream_links(bridges, ways, streams)
+    candidates["way_crosses_stream"] = candidates["osm_id"].isin(way_streams["osm_id"])
+    candidates["bridge_near_stream"] = candidates["OBJECTID"].isin(bridge_streams["OBJECTID"])
+
+    # The way crosses one of the streams within stream_radius_m of the bridge
+    shared = way_streams.merge(bridge_streams, on="stream_id")[["OBJECTID", "osm_id"]]
+    candidates["crosses_bridge_stream"] = (
+        candidates[["OBJECTID", "osm_id"]]
+        .merge(shared.drop_duplicates().assign(shared=True), on=["OBJECTID", "osm_id"], how="left")["shared"]
+        .fillna(False)
+        .astype(bool)
+        .values
+    )
+    return candidates
+
+
+def main():
+    nhd_gpkg, _ = nhd_source()
+    snapshot = {
+        "nbi": snapshot_key(input_nbi_gpkg),
+        "osm": snapshot_key(input_osm_gpkg),
+        "nhd": snapshot_key(nhd_gpkg),
+        "max_candidates": max_candidates,
+        "max_radius_m": max_radius_m,
+        "stream_radius_m": stream_radius_m,
+    }
+
+    if os.path.exists(output_candidates_csv) and os.path.exists(output_snapshot_json):
+        with open(output_snapshot_json, "r") as f:
+            if json.load(f) == snapshot:
+                print(f"{output_candidates_csv} is up to date with its inputs")
+                return
+
+    bridges = load_bridges()
+    candidates = build_candidates(bridges, load_ways(), load_streams())
+    candidates.to_csv(output_candidates_csv, index=False)
+    with open(output_snapshot_json, "w") as f:
+        json.dump(snapshot, f)
+
+    print(
+        f"{len(candidates)} candidate ways for "
+        f"{candidates['OBJECTID'].nunique()} of {len(bridges)} bridges"
+    )
+    print(f"Output file: {output_candidates_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    with stage_profile("build-bridge-way-candidates"):
+        main()
@@ -1,13 +1,19 @@
 import csv
+import json
+import os
 import sys
 
+import pandas as pd
 from qgis.analysis import QgsNativeAlgorithms
 from qgis.core import (
     QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsFeatureRequest,
     QgsProcessingFeedback,
     QgsProject,
     QgsVectorFileWriter,
     QgsVectorLayer,
+    QgsVectorLayerFeatureSource,
 )
 
 # Initialize QGIS application
@@ -21,15 +27,115 @@ sys.path.append("/Applications/QGIS-LTR.app/Contents/Resources/python/plugins")
 import processing
 from processing.core.Processing import Processing
 
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import (
+    BackgroundWriter,
+    candidate_exclusions,
+    snapshot_matches,
+    stage_profile,
+)
+
 # Initialize QGIS processing
 Processing.initialize()
 QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
 feedback = QgsProcessingFeedback()
 
+# Input layers, also used to check the snapshot keys of the filtering step outputs
+nbi_points_gpkg = "output-data/gpkg-files/NBI-Kentucky-Bridge-Data.gpkg"
+osm_gpkg = "output-data/gpkg-files/kentucky-filtered-highways.gpkg"
+
+# Output of 01-filtering-data/03-detect-parallel-carriageways.py, with the key of the
+# OSM and NBI snapshots it was computed from
+parallel_bridges_csv = "output-data/csv-files/Parallel-Carriageway-Bridges.csv"
+parallel_bridges_json = "output-data/csv-files/Parallel-Carriageway-Bridges.json"
+
+# NHD flowlines, and their subset near the roads written by
+# 01-filtering-data/04-extract-nhd-flowlines.py
+nhd_gpkg = "input-data/NHD-Kentucky-Streams-Flowline.gpkg"
+nhd_subset_gpkg = "output-data/gpkg-files/NHD-Flowline-Subset.gpkg"
+
+# Output of 01-filtering-data/07-build-bridge-way-candidates.py, with the key of the
+# NBI, OSM and NHD snapshots it was built from; when it matches the inputs, the filters
+# and the bridge-way links are selected from it instead of buffering and joining the layers
+bridge_way_candidates_csv = "output-data/csv-files/Bridge-Way-Candidates.csv"
+bridge_way_candidates_json = "output-data/csv-files/Bridge-Way-Candidates.json"
+
+# Metric CRS every layer is reprojected to once, so buffer radii are in metres
+metric_crs = "EPSG:32616"
+
+# CRS of the CSV and GeoPackage outputs read by the later stages
+output_crs = "EPSG:4326"
+
+# Reason codes of the bridge filters, in order of precedence
+exclusion_reasons = ["bridge_tag", "layer_tag", "parallel", "nearby"]
+
+# Exclusion flags of every bridge, also read back by the next incremental run
+exclusions_csv = "output-data/csv-files/NBI-Bridge-Exclusions.csv"
+
+# Incremental mode: only the bridges of the release diff written by
+# 01-filtering-data/06-diff-nbi-releases.py, and the bridges whose exclusion
+# changed since the previous run, are joined with the OSM and NHD layers.
+# Enabled with INCREMENTAL_TAGGING=1
+incremental_mode = os.environ.get("INCREMENTAL_TAGGING", "0") == "1"
+release_diff_csv = "output-data/csv-files/NBI-Release-Diff.csv"
+incremental_bridges_csv = "output-data/csv-files/NBI-Incremental-Bridges.csv"
+
+# Link tables read by 03-associating-data/01-join-all-data.py, keyed by the NBI
+# OBJECTID, the OSM way id and the NHD OBJECTID
+bridges_csv = "output-data/csv-files/NBI-Bridges.csv"
+bridge_ways_csv = "output-data/csv-files/NBI-30-OSM-Links.csv"
+ways_csv = "output-data/csv-files/OSM-Ways.csv"
+way_streams_csv = "output-data/csv-files/OSM-NHD-Links.csv"
+bridge_streams_csv = "output-data/csv-files/NBI-10-NHD-Links.csv"
+streams_csv = "output-data/csv-files/NHD-Streams.csv"
+
+# Radius of the bridge-way candidates, and the most ways kept per bridge
+candidate_radius_m = 30
+max_way_candidates = 50
+
+# Number of background threads writing CSV files from feature source snapshots and
+# DataFrames, and rows encoded per CSV batch
+writer_workers = 2
+csv_batch_size = 10000
+
+
+def reproject_layer(vector_layer):
+    """
+    Reproject a layer to the metric CRS and index it
+    """
+    reprojected = processing.run(
+        "native:reprojectlayer",
+        {
+            "INPUT": vector_layer,
+            "TARGET_CRS": QgsCoordinateReferenceSystem(metric_crs),
+            "OUTPUT": "memory:",
+        },
+    )["OUTPUT"]
+    return index_layer(reprojected)
+
+
+def index_layer(vector_layer):
+    """
+    Build the spatial index of a layer used by several joins
+    """
+    vector_layer.dataProvider().createSpatialIndex()
+    return vector_layer
+
+
+def release_layers(*layers):
+    """
+    Remove intermediate memory layers from the project so their features can be freed
+    """
+    project = QgsProject.instance()
+    for layer in layers:
+        if project.mapLayer(layer.id()) is not None:
+            project.removeMapLayer(layer.id())
+
 
 def create_buffer(vector_layer, radius):
     """
-    Create a buffer around a vector layer
+    Create a buffer around a vector layer, with the radius in metres of the metric CRS
     """
     buffered = processing.run(
         "native:buffer",
@@ -55,6 +161,21 @@ def filter_osm_data(vector_layer, filter_expression):
     return vector_layer
 
 
+def extract_osm_data(vector_layer, filter_expression):
+    """
+    Extract the features matching a filter expression into a new layer
+    """
+    extracted = processing.run(
+        "native:extractbyexpression",
+        {
+            "EXPRESSION": filter_expression,
+            "INPUT": vector_layer,
+            "OUTPUT": "memory:",
+        },
+    )["OUTPUT"]
+    return index_layer(extracted)
+
+
 def explode_osm_data(vector_layer):
     """
     Explode the 'other_tags' field in OSM data
@@ -71,14 +192,14 @@ def explode_osm_data(vector_layer):
     return exploded
 
 
-def join_by_location(input_layer, join_layer, join_fields):
+def join_by_location(input_layer, join_layer, join_fields, discard_nonmatching=False):
     """
     Join attributes by location
     """
     joined_layer = processing.run(
         "native:joinattributesbylocation",
         {
-            "DISCARD_NONMATCHING": False,
+            "DISCARD_NONMATCHING": discard_nonmatching,
             "INPUT": input_layer,
             "JOIN": join_layer,
             "JOIN_FIELDS": join_fields,
@@ -91,51 +212,133 @@ def join_by_location(input_layer, join_layer, join_fields):
     return joined_layer
 
 
-def vl_to_csv_filter(vector_layer, csv_path, keep_fields):
+def join_by_nearest(input_layer, join_layer, join_fields, max_distance, neighbors):
     """
-    Export vector layer to CSV with selected columns
+    Join the nearest features within a distance, with the distance in a "distance" field
     """
-    fields = vector_layer.fields()
+    joined_layer = processing.run(
+        "native:joinbynearest",
+        {
+            "DISCARD_NONMATCHING": True,
+            "FIELDS_TO_COPY": join_fields,
+            "INPUT": input_layer,
+            "INPUT_2": join_layer,
+            "MAX_DISTANCE": max_distance,
+            "NEIGHBORS": neighbors,
+            "OUTPUT": "memory:",
+            "PREFIX": "",
+        },
+    )["OUTPUT"]
+    return joined_layer
+
+
+class BufferCache:
+    """
+    Buffers keyed by (layer, radius), computed once and shared by the filters and joins
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, vector_layer, radius):
+        """
+        The indexed buffer of a layer, computed on first use
+        """
+        key = (vector_layer.id(), radius)
+        if key not in self.buffers:
+            self.buffers[key] = index_layer(create_buffer(vector_layer, radius))
+        return self.buffers[key]
+
+    def release(self, vector_layer=None):
+        """
+        Release the buffers of one layer, or every buffer
+        """
+        keys = [
+            key
+            for key in self.buffers
+            if vector_layer is None or key[0] == vector_layer.id()
+        ]
+        release_layers(*[self.buffers.pop(key) for key in keys])
+
+
+buffer_cache = BufferCache()
+
+
+background_writer = BackgroundWriter(writer_workers)
+
+
+def layer_snapshot(vector_layer):
+    """
+    Take a feature source snapshot of a layer, with its fields, in the main thread. Unlike
+    the layer, the snapshot can be read from a writer thread.
+    """
+    return QgsVectorLayerFeatureSource(vector_layer), vector_layer.fields()
+
+
+def vl_to_csv_filter(snapshot, csv_path, keep_fields):
+    """
+    Export a layer snapshot to CSV with selected columns
+    """
+    source, fields = snapshot
+    header = [field.name() for field in fields if field.name() in keep_fields]
+
+    # Only fetch the kept attributes and encode rows in batches
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(header, fields)
+
     with open(csv_path, mode="w", newline="", encoding="utf-8") as file:
         csv_writer = csv.writer(file)
-        header = [field.name() for field in fields if field.name() in keep_fields]
         csv_writer.writerow(header)
-        for feature in vector_layer.getFeatures():
-            row = [
-                feature[field.name()] for field in fields if field.name() in keep_fields
-            ]
-            csv_writer.writerow(row)
+        rows = []
+        for feature in source.getFeatures(request):
+            rows.append([feature[name] for name in header])
+            if len(rows) == csv_batch_size:
+                csv_writer.writerows(rows)
+                rows = []
+        csv_writer.writerows(rows)
+
+
+def submit_layer_csv(vector_layer, csv_path, keep_fields):
+    """
+    Queue the export of selected columns of a layer, reading a snapshot taken now
+    """
+    return background_writer.submit(
+        vl_to_csv_filter, layer_snapshot(vector_layer), csv_path, keep_fields
+    )
 
 
 def vl_to_csv(vector_layer, csv_path):
     """
-    Export vector layer to CSV with WKT geometry column
+    Export vector layer to CSV with WKT geometry column, transformed back to the output CRS.
+    QgsVectorFileWriter reads the layer itself, so this runs in the main thread.
     """
     QgsVectorFileWriter.writeAsVectorFormat(
         vector_layer,
         csv_path,
         "utf-8",
-        vector_layer.crs(),
+        QgsCoordinateReferenceSystem(output_crs),
         "CSV",
         layerOptions=["GEOMETRY=AS_WKT"],
     )
+    print(f"\nOutput file: {csv_path} has been created successfully!")
 
 
-def get_nearby_bridge_ids_from_csv(csv_file_path):
+def vl_to_gpkg(vector_layer, gpkg_path):
     """
-    Extract nearby bridge IDs from CSV file
+    Export vector layer to GeoPackage in the output CRS, in the main thread
     """
-    nearby_bridge_ids = []
+    QgsVectorFileWriter.writeAsVectorFormat(
+        vector_layer, gpkg_path, "utf-8", QgsCoordinateReferenceSystem(output_crs), "GPKG"
+    )
+    print(f"\nOutput file: {gpkg_path} has been created successfully!")
 
-    with open(csv_file_path, mode="r") as file:
-        csv_reader = csv.DictReader(file)
-        for row in csv_reader:
-            if row["STRUCTURE_NUMBER_008"] != row["STRUCTURE_NUMBER_008_2"]:
-                nearby_bridge_ids.append(row["STRUCTURE_NUMBER_008"])
-                nearby_bridge_ids.append(row["STRUCTURE_NUMBER_008_2"])
-    nearby_bridge_ids = list(set(nearby_bridge_ids))
 
-    return nearby_bridge_ids
+def df_to_csv(df, csv_path):
+    """
+    Export a DataFrame to CSV
+    """
+    df.to_csv(csv_path, index=False, chunksize=csv_batch_size)
 
 
 def get_bridge_ids_from_csv(csv_file_path):
@@ -152,24 +355,51 @@ def get_bridge_ids_from_csv(csv_file_path):
     return bridge_ids
 
 
-def filter_nbi_layer(vector_layer, exclusion_ids):
+def get_bridge_ids_from_layer(vector_layer):
     """
-    Filter NBI layer by excluding certain IDs
+    Extract the set of bridge IDs present in a join layer
     """
-    # Create a memory layer to store filtered features
-    filtered_layer = QgsVectorLayer("Point?crs=EPSG:4326", "filtered_layer", "memory")
-    provider = filtered_layer.dataProvider()
+    return {
+        feature["STRUCTURE_NUMBER_008"]
+        for feature in vector_layer.getFeatures()
+        if feature["STRUCTURE_NUMBER_008"]
+    }
 
-    # Add fields from the original layer to the filtered layer
-    provider.addAttributes(vector_layer.fields())
-    filtered_layer.updateFields()
 
-    # Iterate through the features and filter them
+def subset_by_bridge_ids(vector_layer, bridge_ids):
+    """
+    Keep the features of the given bridges, e.g. from a buffer of every NBI point
+    """
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(["STRUCTURE_NUMBER_008"], vector_layer.fields())
+    keep_fids = [
+        feature.id()
+        for feature in vector_layer.getFeatures(request)
+        if feature["STRUCTURE_NUMBER_008"] in bridge_ids
+    ]
+    return index_layer(filter_nbi_layer(vector_layer, keep_fids))
+
+
+def get_nearby_bridge_pairs(vector_layer):
+    """
+    Extract pairs of distinct bridges lying near each other from a join layer
+    """
+    nearby_bridge_pairs = set()
     for feature in vector_layer.getFeatures():
-        if feature["STRUCTURE_NUMBER_008"] not in exclusion_ids:
-            provider.addFeature(feature)
+        bridge_id = feature["STRUCTURE_NUMBER_008"]
+        nearby_id = feature["STRUCTURE_NUMBER_008_2"]
+        if nearby_id and bridge_id != nearby_id:
+            nearby_bridge_pairs.add((bridge_id, nearby_id))
+    return nearby_bridge_pairs
 
-    return filtered_layer
+
+def filter_nbi_layer(vector_layer, keep_fids):
+    """
+    Filter NBI layer by keeping only the given feature IDs
+    """
+    request = QgsFeatureRequest().setFilterFids(keep_fids)
+    return vector_layer.materialize(request)
 
 
 def get_line_intersections(filtered_osm_gl, rivers_gl):
@@ -198,7 +428,7 @@ def get_line_intersections(filtered_osm_gl, rivers_gl):
 
 def load_layers(nbi_points_fp, osm_fp):
     """
-    Load required layers
+    Load required layers, reprojected once to the metric CRS
     """
     nbi_points_gl = QgsVectorLayer(nbi_points_fp, "nbi-points", "ogr")
     if not nbi_points_gl.isValid():
@@ -210,18 +440,50 @@ def load_layers(nbi_points_fp, osm_fp):
         print("OSM ways layer failed to load!")
         sys.exit(1)
 
-    return nbi_points_gl, osm_gl
+    return reproject_layer(nbi_points_gl), reproject_layer(osm_gl)
+
+
+def read_bridge_way_candidates():
+    """
+    Read the bridge-way candidates if they were built from the current NBI, OSM and NHD
+    inputs and reach the largest filter radius
+    """
+    if not (
+        os.path.exists(bridge_way_candidates_csv)
+        and os.path.exists(bridge_way_candidates_json)
+    ):
+        return None
+    with open(bridge_way_candidates_json, "r") as f:
+        snapshot = json.load(f)
+    # The stream flags of the table come from the NHD layer this run joins
+    current_nhd_gpkg = nhd_subset_gpkg if os.path.exists(nhd_subset_gpkg) else nhd_gpkg
+    if (
+        not snapshot_matches(
+            bridge_way_candidates_json,
+            {"nbi": nbi_points_gpkg, "osm": osm_gpkg, "nhd": current_nhd_gpkg},
+        )
+        or snapshot.get("max_radius_m", 0) < 80
+        or snapshot.get("max_candidates", 0) < max_way_candidates
+    ):
+        print(f"{bridge_way_candidates_csv} is out of date, joining the layers instead")
+        return None
+    candidates = pd.read_csv(
+        bridge_way_candidates_csv,
+        dtype={"STRUCTURE_NUMBER_008": str, "bridge": str, "man_made": str, "oneway": str},
+    )
+    candidates["layer"] = pd.to_numeric(candidates["layer"], errors="coerce")
+    return candidates
 
 
-def process_bridge(nbi_points_gl, exploded_osm_gl):
+def find_bridge_tag_exclusions(nbi_points_gl, exploded_osm_gl):
     """
-    Process bridges: filter and join NBI data with OSM data
+    Find bridges near OSM ways already tagged as bridges
     """
     filter_expression = "bridge is not null or man_made='bridge'"
 
-    filtered_osm_gl = filter_osm_data(exploded_osm_gl, filter_expression)
+    filtered_osm_gl = extract_osm_data(exploded_osm_gl, filter_expression)
 
-    buffer_80 = create_buffer(filtered_osm_gl, 0.0008)
+    buffer_80 = buffer_cache.get(filtered_osm_gl, 80)
 
     osm_bridge_yes_nbi_join = join_by_location(
         buffer_80,
@@ -235,34 +497,23 @@ def process_bridge(nbi_points_gl, exploded_osm_gl):
 
     vl_to_csv(osm_bridge_yes_nbi_join, join_csv_path)
 
-    exclusion_ids = get_bridge_ids_from_csv(join_csv_path)
+    exclusion_ids = get_bridge_ids_from_layer(osm_bridge_yes_nbi_join)
 
-    filtered_layer = filter_nbi_layer(nbi_points_gl, exclusion_ids)
+    buffer_cache.release(filtered_osm_gl)
+    release_layers(filtered_osm_gl, osm_bridge_yes_nbi_join)
 
-    output_path = "output-data/gpkg-files/NBI-Filtered-Yes-Manmade-Bridges.gpkg"
+    return exclusion_ids
 
-    QgsVectorFileWriter.writeAsVectorFormat(
-        filtered_layer, output_path, "utf-8", filtered_layer.crs(), "GPKG"
-    )
 
-    print(f"\nOutput file: {output_path} has been created successfully!")
-
-    QgsProject.instance().removeMapLayer(filtered_osm_gl.id())
-    QgsProject.instance().removeMapLayer(buffer_80.id())
-    QgsProject.instance().removeMapLayer(osm_bridge_yes_nbi_join.id())
-
-    return filtered_layer
-
-
-def process_layer_tag(nbi_points_gl, exploded_osm_gl):
+def find_layer_tag_exclusions(nbi_points_gl, exploded_osm_gl):
     """
-    Process layer tags: filter and join NBI data with OSM data based on layer tag
+    Find bridges near OSM ways with a positive layer tag
     """
     filter_expression = "layer>0"
 
-    filtered_osm_gl = filter_osm_data(exploded_osm_gl, filter_expression)
+    filtered_osm_gl = extract_osm_data(exploded_osm_gl, filter_expression)
 
-    buffer_30 = create_buffer(filtered_osm_gl, 0.0003)
+    buffer_30 = buffer_cache.get(filtered_osm_gl, 30)
 
     osm_bridge_yes_nbi_join = join_by_location(
         buffer_30,
@@ -278,41 +529,50 @@ def process_layer_tag(nbi_points_gl, exploded_osm_gl):
 
     vl_to_csv(osm_bridge_yes_nbi_join, join_csv_path)
 
-    exclusion_ids = get_bridge_ids_from_csv(join_csv_path)
+    exclusion_ids = get_bridge_ids_from_layer(osm_bridge_yes_nbi_join)
 
-    filtered_layer = filter_nbi_layer(nbi_points_gl, exclusion_ids)
+    buffer_cache.release(filtered_osm_gl)
+    release_layers(filtered_osm_gl, osm_bridge_yes_nbi_join)
 
-    output_path = "output-data/gpkg-files/NBI-Filtered-Yes-Manmade-Layer-Bridges.gpkg"
+    return exclusion_ids
 
-    QgsVectorFileWriter.writeAsVectorFormat(
-        filtered_layer, output_path, "utf-8", filtered_layer.crs(), "GPKG"
-    )
-
-    print(f"\nOutput file: {output_path} has been created successfully!")
 
-    QgsProject.instance().removeMapLayer(filtered_osm_gl.id())
-    QgsProject.instance().removeMapLayer(buffer_30.id())
-    QgsProject.instance().removeMapLayer(osm_bridge_yes_nbi_join.id())
-
-    return filtered_layer
+def parallel_bridges_are_current():
+    """
+    Check that the parallel carriageway flags were computed from the current OSM and NBI inputs
+    """
+    if not os.path.exists(parallel_bridges_csv):
+        return False
+    if not snapshot_matches(
+        parallel_bridges_json, {"osm": osm_gpkg, "nbi": nbi_points_gpkg}
+    ):
+        print(f"{parallel_bridges_csv} is out of date, joining the oneway ways instead")
+        return False
+    return True
 
 
-def process_parallel_bridges(nbi_points_gl, exploded_osm_gl):
+def find_parallel_bridge_exclusions(nbi_points_gl, exploded_osm_gl):
     """
-    Process parallel bridges: identify and filter parallel bridges
+    Find bridges on parallel oneway carriageways
     """
+    if parallel_bridges_are_current():
+        # Bridges already flagged by the parallel carriageway detector
+        return set(get_bridge_ids_from_csv(parallel_bridges_csv))
+
     filter_expression = "highway IN ('motorway_link', 'primary', 'primary_link', 'trunk', 'motorway', 'trunk_link') AND oneway = 'yes' AND bridge is null"
 
-    filtered_osm_gl = filter_osm_data(exploded_osm_gl, filter_expression)
+    filtered_osm_gl = extract_osm_data(exploded_osm_gl, filter_expression)
 
-    buffer_30 = create_buffer(filtered_osm_gl, 0.0003)
+    buffer_30 = buffer_cache.get(filtered_osm_gl, 30)
 
-    osm_oneway_yes_osm_join = join_by_location(
-        buffer_30,
-        filtered_osm_gl,
-        [
-            "osm_id",
-        ],
+    osm_oneway_yes_osm_join = index_layer(
+        join_by_location(
+            buffer_30,
+            filtered_osm_gl,
+            [
+                "osm_id",
+            ],
+        )
     )
 
     osm_oneway_yes_osm_bridge_join = join_by_location(
@@ -323,34 +583,28 @@ def process_parallel_bridges(nbi_points_gl, exploded_osm_gl):
 
     join_csv_path = "output-data/csv-files/OSM-Oneways-NBI-Join.csv"
     keep_fields = ["osm_id", "osm_id_2", "STRUCTURE_NUMBER_008"]
-    vl_to_csv_filter(osm_oneway_yes_osm_bridge_join, join_csv_path, keep_fields)
-
-    parallel_bridge_ids = get_bridge_ids_from_csv(join_csv_path)
-    filtered_layer = filter_nbi_layer(
-        vector_layer=nbi_points_gl, exclusion_ids=parallel_bridge_ids
+    write_future = submit_layer_csv(
+        osm_oneway_yes_osm_bridge_join, join_csv_path, keep_fields
     )
 
-    output_path = "output-data/gpkg-files/Filtered-NBI-Bridges.gpkg"
+    exclusion_ids = get_bridge_ids_from_layer(osm_oneway_yes_osm_bridge_join)
 
-    QgsVectorFileWriter.writeAsVectorFormat(
-        filtered_layer, output_path, "utf-8", filtered_layer.crs(), "GPKG"
+    # The layers are only released once their snapshot has been written
+    write_future.result()
+    buffer_cache.release(filtered_osm_gl)
+    release_layers(
+        filtered_osm_gl, osm_oneway_yes_osm_join, osm_oneway_yes_osm_bridge_join
     )
 
-    print(f"\nOutput file: {output_path} has been created successfully!")
+    return exclusion_ids
 
-    QgsProject.instance().removeMapLayer(filtered_osm_gl.id())
-    QgsProject.instance().removeMapLayer(buffer_30.id())
-    QgsProject.instance().removeMapLayer(osm_oneway_yes_osm_join.id())
-    QgsProject.instance().removeMapLayer(osm_oneway_yes_osm_bridge_join.id())
-
-    return filtered_layer
 
-
-def process_nearby_bridges(nbi_points_gl):
+def find_nearby_bridge_pairs(nbi_points_gl):
     """
-    Process nearby bridges: identify and filter nearby bridges
+    Find pairs of bridges lying near each other
     """
-    buffer_10 = create_buffer(nbi_points_gl, 0.0001)
+    # Kept in the cache, the buffer is reused by process_buffer_join
+    buffer_10 = buffer_cache.get(nbi_points_gl, 10)
 
     nbi_10_nbi_join = join_by_location(
         buffer_10,
@@ -362,137 +616,250 @@ def process_nearby_bridges(nbi_points_gl):
 
     join_csv_path = "output-data/csv-files/NBI-10-NBI-Join.csv"
     keep_fields = ["STRUCTURE_NUMBER_008", "STRUCTURE_NUMBER_008_2"]
-    vl_to_csv_filter(nbi_10_nbi_join, join_csv_path, keep_fields)
+    write_future = submit_layer_csv(nbi_10_nbi_join, join_csv_path, keep_fields)
+
+    nearby_bridge_pairs = get_nearby_bridge_pairs(nbi_10_nbi_join)
+
+    write_future.result()
+    release_layers(nbi_10_nbi_join)
+
+    return nearby_bridge_pairs
+
 
-    nearby_bridge_ids = get_nearby_bridge_ids_from_csv(join_csv_path)
-    filtered_layer = filter_nbi_layer(
-        vector_layer=nbi_points_gl, exclusion_ids=nearby_bridge_ids
+def build_bridge_table(nbi_points_gl):
+    """
+    Build the in-memory columnar bridge table shared by all filters
+    """
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(["STRUCTURE_NUMBER_008"], nbi_points_gl.fields())
+
+    fids = []
+    bridge_ids = []
+    for feature in nbi_points_gl.getFeatures(request):
+        fids.append(feature.id())
+        bridge_ids.append(feature["STRUCTURE_NUMBER_008"])
+
+    return pd.DataFrame({"fid": fids, "STRUCTURE_NUMBER_008": bridge_ids})
+
+
+def evaluate_filters(nbi_points_gl, exploded_osm_gl, candidates=None):
+    """
+    Evaluate all bridge filters over the same NBI and OSM layers, one after the other in
+    the main thread, since QGIS layers and processing algorithms are not thread-safe
+    """
+    filters = {
+        "bridge_tag": (find_bridge_tag_exclusions, (nbi_points_gl, exploded_osm_gl)),
+        "layer_tag": (find_layer_tag_exclusions, (nbi_points_gl, exploded_osm_gl)),
+        "parallel": (find_parallel_bridge_exclusions, (nbi_points_gl, exploded_osm_gl)),
+        "nearby": (find_nearby_bridge_pairs, (nbi_points_gl,)),
+    }
+
+    if candidates is not None:
+        # The same predicates and radii as the buffer joins, as column filters
+        filters["bridge_tag"] = (candidate_exclusions, (candidates, "bridge_tag"))
+        filters["layer_tag"] = (candidate_exclusions, (candidates, "layer_tag"))
+        if not parallel_bridges_are_current():
+            filters["parallel"] = (candidate_exclusions, (candidates, "parallel"))
+
+    return {
+        reason: filter_function(*args)
+        for reason, (filter_function, args) in filters.items()
+    }
+
+
+def apply_exclusions(bridge_table, filter_results):
+    """
+    Add one boolean exclusion column per filter and the reason code of the first matching filter
+    """
+    for reason in ["bridge_tag", "layer_tag", "parallel"]:
+        bridge_table[f"excluded_{reason}"] = bridge_table["STRUCTURE_NUMBER_008"].isin(
+            filter_results[reason]
+        )
+
+    # Nearby bridges are only excluded when both of them survive the other filters
+    excluded = bridge_table[
+        ["excluded_bridge_tag", "excluded_layer_tag", "excluded_parallel"]
+    ].any(axis=1)
+    surviving_ids = set(bridge_table.loc[~excluded, "STRUCTURE_NUMBER_008"])
+    nearby_ids = {
+        bridge_id
+        for pair in filter_results["nearby"]
+        if surviving_ids.issuperset(pair)
+        for bridge_id in pair
+    }
+    bridge_table["excluded_nearby"] = bridge_table["STRUCTURE_NUMBER_008"].isin(
+        nearby_ids
     )
 
-    output_path = "output-data/gpkg-files/Final-filtered-NBI-Bridges.gpkg"
-    QgsVectorFileWriter.writeAsVectorFormat(
-        filtered_layer, output_path, "utf-8", filtered_layer.crs(), "GPKG"
+    exclusion_columns = [f"excluded_{reason}" for reason in exclusion_reasons]
+    first_reason = (
+        bridge_table[exclusion_columns]
+        .idxmax(axis=1)
+        .str.replace("excluded_", "", regex=False)
+    )
+    bridge_table["exclusion_reason"] = first_reason.where(
+        bridge_table[exclusion_columns].any(axis=1), ""
     )
 
-    print(f"\nOutput file: {output_path} has been created successfully!")
+    return bridge_table
+
 
-    QgsProject.instance().removeMapLayer(buffer_10.id())
-    QgsProject.instance().removeMapLayer(nbi_10_nbi_join.id())
+def write_final_bridges(nbi_points_gl, bridge_table):
+    """
+    Write the bridges surviving every filter, together with the exclusion table
+    """
+    keep_fids = bridge_table.loc[bridge_table["exclusion_reason"] == "", "fid"].tolist()
+    filtered_layer = filter_nbi_layer(nbi_points_gl, keep_fids)
+
+    output_path = "output-data/gpkg-files/Final-filtered-NBI-Bridges.gpkg"
+    vl_to_gpkg(filtered_layer, output_path)
+
+    background_writer.submit(
+        df_to_csv, bridge_table.drop(columns=["fid"]), exclusions_csv
+    )
 
     return filtered_layer
 
 
-def process_buffer_join(nbi_points_gl, osm_gl, exploded_osm_gl):
+def select_incremental_bridges(nbi_points_gl, bridge_table, previous_exclusions):
     """
-    Process buffer join: join NBI data with OSM and river data
+    Keep the filtered bridges of the release diff and those whose exclusion reason changed
     """
-    rivers_fp = (
-        "input-data/NHD-Kentucky-Streams-Flowline.gpkg|layername=NHD-Kentucky-Flowline"
+    release_diff = pd.read_csv(release_diff_csv, dtype={"STRUCTURE_NUMBER_008": str})
+    affected_ids = set(release_diff["STRUCTURE_NUMBER_008"].astype(str))
+
+    bridge_ids = bridge_table["STRUCTURE_NUMBER_008"].astype(str)
+    reasons = pd.DataFrame(
+        {"bridge_id": bridge_ids, "reason": bridge_table["exclusion_reason"]}
+    ).merge(
+        pd.DataFrame(
+            {
+                "bridge_id": previous_exclusions["STRUCTURE_NUMBER_008"].astype(str),
+                "previous_reason": previous_exclusions["exclusion_reason"].fillna(""),
+            }
+        ),
+        on="bridge_id",
+    )
+    affected_ids.update(
+        reasons.loc[reasons["reason"] != reasons["previous_reason"], "bridge_id"]
     )
+
+    # The association stage replaces exactly these bridges in the previous tables
+    background_writer.submit(
+        df_to_csv,
+        pd.DataFrame({"STRUCTURE_NUMBER_008": sorted(affected_ids)}),
+        incremental_bridges_csv,
+    )
+
+    keep_fids = bridge_table.loc[
+        (bridge_table["exclusion_reason"] == "") & bridge_ids.isin(affected_ids), "fid"
+    ].tolist()
+    return filter_nbi_layer(nbi_points_gl, keep_fids)
+
+
+def process_buffer_join(nbi_points_gl, bridge_ids, osm_gl, exploded_osm_gl, candidates=None):
+    """
+    Process buffer join: join the given bridges of the NBI data with OSM and river data
+    """
+    rivers_fp = f"{nhd_gpkg}|layername=NHD-Kentucky-Flowline"
+    if os.path.exists(nhd_subset_gpkg):
+        # Column-pruned flowlines near the roads only
+        rivers_fp = f"{nhd_subset_gpkg}|layername=NHD-Flowline"
     rivers_gl = QgsVectorLayer(rivers_fp, "rivers", "ogr")
     if not rivers_gl.isValid():
         print("Rivers layer failed to load!")
         sys.exit(1)
-        
+    rivers_gl = reproject_layer(rivers_gl)
+
     filter_expression = "highway not in ('abandoned','bridleway','construction','corridor','crossing','cycleway','elevator','escape','footway','living_street','path','pedestrian','planned','proposed','raceway','rest_area','steps') AND bridge IS NULL AND layer IS NULL"
     exploded_osm_gl = filter_osm_data(exploded_osm_gl, filter_expression)
 
     intersections = get_line_intersections(exploded_osm_gl, rivers_gl)
 
     output_path = "output-data/csv-files/OSM-NHD-Intersections.csv"
-    vl_to_csv(
-        intersections,
-        output_path,
-    )
-    print(f"\nOutput file: {output_path} has been created successfully!")
-
-    osm_river_join = join_by_location(
-        osm_gl,
-        rivers_gl,
-        [
-            "OBJECTID",
-            "permanent_identifier",
-            "gnis_id",
-            "gnis_name",
-            "fcode_description",
-        ],
+    vl_to_csv(intersections, output_path)
+
+    # Each link table has one row per pair, instead of one per bridge, way and stream
+    # combination as in the former NBI-30-OSM-NHD-Join.csv
+    bridge_points = subset_by_bridge_ids(nbi_points_gl, bridge_ids)
+    submit_layer_csv(
+        bridge_points,
+        bridges_csv,
+        ["OBJECTID", "STATE_CODE_001", "STRUCTURE_NUMBER_008", "LATDD", "LONGDD"],
     )
 
-    output_path = "output-data/csv-files/OSM-NHD-Join.csv"
-    vl_to_csv(
-        osm_river_join,
-        "output-data/csv-files/OSM-NHD-Join.csv",
+    if candidates is not None:
+        # The nearest ways are already ranked per bridge in the candidate table
+        bridge_ways = candidates.loc[
+            (candidates["distance_m"] <= candidate_radius_m)
+            & (candidates["rank"] <= max_way_candidates)
+            & candidates["STRUCTURE_NUMBER_008"].isin(bridge_ids),
+            ["OBJECTID", "osm_id", "distance_m"],
+        ].rename(columns={"distance_m": "distance"})
+        background_writer.submit(df_to_csv, bridge_ways, bridge_ways_csv)
+    else:
+        bridge_ways = join_by_nearest(
+            bridge_points, osm_gl, ["osm_id"], candidate_radius_m, max_way_candidates
+        )
+        submit_layer_csv(bridge_ways, bridge_ways_csv, ["OBJECTID", "osm_id", "distance"])
+    # Snapshots are taken here, so the joins below can keep reading the layers
+    submit_layer_csv(osm_gl, ways_csv, ["osm_id", "name", "highway"])
+
+    way_streams = join_by_location(
+        osm_gl, rivers_gl, ["OBJECTID"], discard_nonmatching=True
     )
-    print(f"\nOutput file: {output_path} has been created successfully!")
+    submit_layer_csv(way_streams, way_streams_csv, ["osm_id", "OBJECTID"])
 
-    buffer_10 = create_buffer(nbi_points_gl, 0.0001)
-    buffer_30 = create_buffer(nbi_points_gl, 0.0003)
+    # Buffers of every NBI point, cut down to the bridges being joined
+    buffer_10 = subset_by_bridge_ids(buffer_cache.get(nbi_points_gl, 10), bridge_ids)
+    buffer_cache.release(nbi_points_gl)
 
-    nbi_10_river_join = join_by_location(
-        buffer_10,
-        rivers_gl,
-        [
-            "OBJECTID",
-            "permanent_identifier",
-            "gnis_id",
-            "gnis_name",
-            "fcode_description",
-        ],
+    # The stream OBJECTID is renamed OBJECTID_2 next to the bridge OBJECTID
+    bridge_streams = join_by_location(
+        buffer_10, rivers_gl, ["OBJECTID"], discard_nonmatching=True
     )
+    submit_layer_csv(bridge_streams, bridge_streams_csv, ["OBJECTID", "OBJECTID_2"])
+    submit_layer_csv(rivers_gl, streams_csv, ["OBJECTID", "permanent_identifier"])
 
-    keep_fields = [
-        "STRUCTURE_NUMBER_008",
-        "permanent_identifier",
-    ]
-
-    output_path = "output-data/csv-files/NBI-10-NHD-Join.csv"
-
-    vl_to_csv_filter(
-        nbi_10_river_join,
-        output_path,
-        keep_fields,
-    )
-    print(f"\nOutput file: {output_path} has been created successfully!")
-
-    nbi_30_osm_river_join = join_by_location(
-        buffer_30,
-        osm_river_join,
-        [],
-    )
-
-    keep_fields = [
-        "OBJECTID",
-        "STATE_CODE_001",
-        "STRUCTURE_NUMBER_008",
-        "LATDD",
-        "LONGDD",
-        "osm_id",
-        "name",
-        "highway",
-        "OBJECTID_2",
-        "permanent_identifier",
-    ]
-
-    output_path = "output-data/csv-files/NBI-30-OSM-NHD-Join.csv"
-    vl_to_csv_filter(
-        nbi_30_osm_river_join,
-        output_path,
-        keep_fields,
-    )
-    print(f"\nOutput file: {output_path} has been created successfully!")
+    release_layers(buffer_10)
 
 
 def main():
-    nbi_points_fp = "output-data/gpkg-files/NBI-Kentucky-Bridge-Data.gpkg|layername=NBI-Kentucky-Bridge-Data"
-    osm_fp = "output-data/gpkg-files/kentucky-filtered-highways.gpkg|layername=lines"
+    nbi_points_fp = f"{nbi_points_gpkg}|layername=NBI-Kentucky-Bridge-Data"
+    osm_fp = f"{osm_gpkg}|layername=lines"
     nbi_points_gl, osm_gl = load_layers(nbi_points_fp, osm_fp)
-    exploded_osm_gl = explode_osm_data(osm_gl)
-    output_layer1 = process_bridge(nbi_points_gl, exploded_osm_gl)
-    output_layer2 = process_layer_tag(output_layer1, exploded_osm_gl)
-    output_layer3 = process_parallel_bridges(output_layer2, exploded_osm_gl)
-    output_layer4 = process_nearby_bridges(output_layer3)
-    process_buffer_join(output_layer4, osm_gl, exploded_osm_gl)
+    incremental_run = incremental_mode and os.path.exists(exclusions_csv)
+    if incremental_mode and not incremental_run:
+        print(f"{exclusions_csv} not found, running a full tagging run instead")
+    if incremental_run:
+        # Read before this run overwrites it
+        previous_exclusions = pd.read_csv(
+            exclusions_csv, dtype={"STRUCTURE_NUMBER_008": str}
+        )
+    exploded_osm_gl = index_layer(explode_osm_data(osm_gl))
+    bridge_table = build_bridge_table(nbi_points_gl)
+    candidates = read_bridge_way_candidates()
+    filter_results = evaluate_filters(nbi_points_gl, exploded_osm_gl, candidates)
+    bridge_table = apply_exclusions(bridge_table, filter_results)
+    filtered_nbi_gl = write_final_bridges(nbi_points_gl, bridge_table)
+    if incremental_run:
+        filtered_nbi_gl = select_incremental_bridges(
+            nbi_points_gl, bridge_table, previous_exclusions
+        )
+    process_buffer_join(
+        nbi_points_gl,
+        get_bridge_ids_from_layer(filtered_nbi_gl),
+        osm_gl,
+        exploded_osm_gl,
+        candidates,
+    )
+
+    # Make sure every output file is complete before exiting
+    background_writer.wait()
+    buffer_cache.release()
 
 
 if __name__ == "__main__":
-    main()
+    with stage_profile("tagging-nbi-and-osm-data"):
+        main()
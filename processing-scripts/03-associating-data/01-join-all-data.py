@@ -1,9 +1,19 @@
 import os
 import shutil
+import sys
 
 import dask.dataframe as dd
 import pandas as pd
 
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import stage_profile
+
+# Input and output files of this stage
+nbi_osm_nhd_csv = "output-data/csv-files/NBI-30-OSM-NHD-Join.csv"
+nbi_nhd_csv = "output-data/csv-files/NBI-10-NHD-Join.csv"
+all_join_csv = "output-data/csv-files/All-Join-Result.csv"
+
 # Specify the data types for the CSV columns
 dtype_left = {
     "OBJECTID_2": "float64",
@@ -19,45 +29,145 @@ dtype_right = {
     # Add other columns with their expected data types
 }
 
-# Load the CSV files into Dask DataFrames with specified dtypes
-left_ddf = dd.read_csv(
-    "output-data/csv-files/NBI-30-OSM-NHD-Join.csv",
-    dtype=dtype_left,
-)
-right_ddf = dd.read_csv(
-    "output-data/csv-files/NBI-10-NHD-Join.csv",
-    dtype=dtype_right,
-)
-
-# Perform a left join on the 'bridge_id' column
-result_ddf = left_ddf.merge(right_ddf, on="STRUCTURE_NUMBER_008", how="left")
-
-# Save the result to a directory with multiple part files
-result_ddf.to_csv(
-    "output-data/csv-files/result_directory/*.csv",
-    index=False,
-)
-
-# Ensure the Dask computations are done before combining files
-dd.compute()
-
-# List the part files
-part_files = sorted(
-    os.path.join("output-data/csv-files/result_directory", f)
-    for f in os.listdir("output-data/csv-files/result_directory")
-    if f.endswith(".csv")
-)
-
-# Combine the part files into a single DataFrame
-combined_df = pd.concat(pd.read_csv(file) for file in part_files)
-
-# Save the combined DataFrame to a single CSV file
-output_path = "output-data/csv-files/All-Join-Result.csv"
-combined_df.to_csv(
-    output_path,
-    index=False,
-)
-print(f"Output file: {output_path} has been created successfully!")
-
-# Optional: Clean up the part files
-shutil.rmtree("output-data/csv-files/result_directory")
+
+# Narrow link tables written by the tagging step, keyed by the NBI OBJECTID, the
+# OSM way id and the NHD OBJECTID; they replace the two wide join files above
+link_table_csvs = {
+    "bridges": "output-data/csv-files/NBI-Bridges.csv",
+    "bridge_ways": "output-data/csv-files/NBI-30-OSM-Links.csv",
+    "ways": "output-data/csv-files/OSM-Ways.csv",
+    "way_streams": "output-data/csv-files/OSM-NHD-Links.csv",
+    "bridge_streams": "output-data/csv-files/NBI-10-NHD-Links.csv",
+    "streams": "output-data/csv-files/NHD-Streams.csv",
+}
+
+link_table_dtypes = {
+    "bridge_ways": {"osm_id": "int64"},
+    "way_streams": {"osm_id": "int64"},
+    "streams": {"permanent_identifier": "object"},
+}
+
+# Columns of All-Join-Result.csv
+all_join_columns = [
+    "OBJECTID",
+    "STATE_CODE_001",
+    "STRUCTURE_NUMBER_008",
+    "LATDD",
+    "LONGDD",
+    "osm_id",
+    "name",
+    "highway",
+    "OBJECTID_2",
+    "permanent_identifier_x",
+    "permanent_identifier_y",
+]
+
+
+def join_all_data(nbi_osm_nhd_df, nbi_nhd_df):
+    """
+    Function to join the NBI-OSM-NHD data with the NBI-NHD data in memory
+    """
+    return nbi_osm_nhd_df.merge(nbi_nhd_df, on="STRUCTURE_NUMBER_008", how="left")
+
+
+def join_link_tables(tables):
+    """
+    Function to build the bridge-way-stream combinations of All-Join-Result.csv from the
+    link tables, merging on integer keys only
+    """
+    streams = tables["streams"][["OBJECTID", "permanent_identifier"]]
+    way_streams = (
+        tables["way_streams"][["osm_id", "OBJECTID"]]
+        .merge(streams, on="OBJECTID")
+        .rename(columns={"OBJECTID": "OBJECTID_2"})
+    )
+    bridge_streams = (
+        tables["bridge_streams"][["OBJECTID", "OBJECTID_2"]]
+        .merge(streams.rename(columns={"OBJECTID": "OBJECTID_2"}), on="OBJECTID_2")
+        .drop(columns="OBJECTID_2")
+    )
+
+    # Bridges without a way within 30m keep one row without an OSM id, as in the wide join
+    df = (
+        tables["bridges"]
+        .merge(tables["bridge_ways"][["OBJECTID", "osm_id"]], on="OBJECTID", how="left")
+        .merge(tables["ways"][["osm_id", "name", "highway"]], on="osm_id", how="left")
+        .merge(way_streams, on="osm_id", how="left")
+        .merge(bridge_streams, on="OBJECTID", how="left")
+    )
+    df["osm_id"] = df["osm_id"].astype("float64")
+    df["OBJECTID_2"] = df["OBJECTID_2"].astype("float64")
+    return df[all_join_columns]
+
+
+def read_join_tables():
+    """
+    Function to read the link tables of the tagging step, or the wide join files of older runs
+    """
+    if all(os.path.exists(path) for path in link_table_csvs.values()):
+        return {
+            name: pd.read_csv(path, dtype=link_table_dtypes.get(name))
+            for name, path in link_table_csvs.items()
+        }
+    return {
+        "nbi_osm_nhd": pd.read_csv(nbi_osm_nhd_csv, dtype=dtype_left),
+        "nbi_nhd": pd.read_csv(nbi_nhd_csv, dtype=dtype_right),
+    }
+
+
+def build_all_join(tables):
+    """
+    Function to join the tables returned by read_join_tables, whichever layout they have
+    """
+    if "bridge_ways" in tables:
+        return join_link_tables(tables)
+    return join_all_data(tables["nbi_osm_nhd"], tables["nbi_nhd"])
+
+
+def main():
+    if all(os.path.exists(path) for path in link_table_csvs.values()):
+        # The link tables are narrow enough to join in memory
+        join_link_tables(read_join_tables()).to_csv(all_join_csv, index=False)
+        print(f"Output file: {all_join_csv} has been created successfully!")
+        return
+
+    # Load the CSV files into Dask DataFrames with specified dtypes
+    left_ddf = dd.read_csv(nbi_osm_nhd_csv, dtype=dtype_left)
+    right_ddf = dd.read_csv(nbi_nhd_csv, dtype=dtype_right)
+
+    # Perform a left join on the 'bridge_id' column
+    result_ddf = left_ddf.merge(right_ddf, on="STRUCTURE_NUMBER_008", how="left")
+
+    # Save the result to a directory with multiple part files
+    result_ddf.to_csv(
+        "output-data/csv-files/result_directory/*.csv",
+        index=False,
+    )
+
+    # Ensure the Dask computations are done before combining files
+    dd.compute()
+
+    # List the part files
+    part_files = sorted(
+        os.path.join("output-data/csv-files/result_directory", f)
+        for f in os.listdir("output-data/csv-files/result_directory")
+        if f.endswith(".csv")
+    )
+
+    # Combine the part files into a single DataFrame
+    combined_df = pd.concat(pd.read_csv(file) for file in part_files)
+
+    # Save the combined DataFrame to a single CSV file
+    combined_df.to_csv(
+        all_join_csv,
+        index=False,
+    )
+    print(f"Output file: {all_join_csv} has been created successfully!")
+
+    # Optional: Clean up the part files
+    shutil.rmtree("output-data/csv-files/result_directory")
+
+
+if __name__ == "__main__":
+    with stage_profile("join-all-data"):
+        main()
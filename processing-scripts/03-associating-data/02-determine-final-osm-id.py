@@ -1,7 +1,99 @@
 import math
+import os
+import sqlite3
+import sys
 
+import numpy as np
 import pandas as pd
 
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import BackgroundWriter, stage_profile
+
+# Rows encoded per batch when writing CSV files
+csv_batch_size = 100000
+
+# Input files of this stage
+all_join_csv = "output-data/csv-files/All-Join-Result.csv"
+intersections_csv = "output-data/csv-files/OSM-NHD-Intersections.csv"
+ntad_bridges_csv = "input-data/NTAD-National-Bridge-Inventory-Dataset.csv"
+
+# Indexed store of bridges, ways, streams, candidate links, final choices and split points
+association_db = "output-data/association-store.sqlite"
+
+# Rows sent to SQLite per executemany call
+db_batch_size = 50000
+
+store_schema = """
+CREATE TABLE IF NOT EXISTS bridges (
+    structure_number TEXT PRIMARY KEY,
+    lat REAL,
+    long REAL,
+    bridge_length REAL
+);
+CREATE TABLE IF NOT EXISTS ways (
+    osm_id INTEGER PRIMARY KEY,
+    name TEXT,
+    highway TEXT
+);
+CREATE TABLE IF NOT EXISTS streams (
+    permanent_identifier TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS candidate_links (
+    structure_number TEXT NOT NULL,
+    osm_id INTEGER,
+    way_stream TEXT,
+    bridge_stream TEXT,
+    intersection_lat REAL,
+    intersection_long REAL,
+    haversine_dist_km REAL,
+    is_min_dist INTEGER,
+    is_stream_identical INTEGER
+);
+CREATE INDEX IF NOT EXISTS candidate_links_bridge ON candidate_links (structure_number);
+CREATE INDEX IF NOT EXISTS candidate_links_way ON candidate_links (osm_id);
+CREATE INDEX IF NOT EXISTS candidate_links_stream ON candidate_links (way_stream);
+CREATE TABLE IF NOT EXISTS final_choices (
+    structure_number TEXT PRIMARY KEY,
+    final_osm_id INTEGER,
+    final_long REAL,
+    final_lat REAL
+);
+CREATE INDEX IF NOT EXISTS final_choices_way ON final_choices (final_osm_id);
+CREATE TABLE IF NOT EXISTS split_points (
+    structure_number TEXT NOT NULL,
+    osm_id INTEGER,
+    bridge_coordinate TEXT,
+    bridge_length REAL,
+    first_split_point_lat REAL,
+    first_split_point_lon REAL,
+    osm_id_for_first_split_point INTEGER,
+    second_split_point_lat REAL,
+    second_split_point_lon REAL,
+    osm_id_for_second_split_point INTEGER
+);
+CREATE INDEX IF NOT EXISTS split_points_bridge ON split_points (structure_number);
+"""
+
+# Columns of bridge-osm-association-with-lengths.csv
+association_columns = [
+    "STRUCTURE_NUMBER_008",
+    "final_osm_id",
+    "final_long",
+    "final_lat",
+    "bridge_length",
+]
+
+
+def df_to_csv(df, csv_path, **to_csv_kwargs):
+    """
+    Function to write a DataFrame to CSV in batches
+    """
+    df.to_csv(csv_path, chunksize=csv_batch_size, **to_csv_kwargs)
+
+
+background_writer = BackgroundWriter()
+
 
 def haversine(lon1, lat1, lon2, lat2):
     """
@@ -92,38 +184,95 @@ def determine_final_osm_id(group):
     )
 
 
-def merge_join_data_with_intersections():
+def aggregate_intersections(intersection_data):
     """
-    Function to tag all data join result with intersections information.
+    Function to group the intersection points of every (way, stream) pair into flat
+    coordinate arrays, with the start and count of each pair's points
     """
-    # Load the final join data
-    final_join_data = pd.read_csv("output-data/csv-files/All-Join-Result.csv")
+    intersection_data = intersection_data.loc[
+        intersection_data["WKT"].notna(), ["WKT", "osm_id", "permanent_identifier"]
+    ].reset_index(drop=True)
+    pair_index = intersection_data.groupby(
+        ["osm_id", "permanent_identifier"], sort=False, dropna=False
+    ).ngroup()
+
+    # Points of a pair stay in file order, so ties go to the first crossing
+    order = np.argsort(pair_index.to_numpy(), kind="stable")
+    points = intersection_data.iloc[order].reset_index(drop=True)
+    coords = (
+        points["WKT"]
+        .str.replace("POINT (", "", regex=False)
+        .str.replace(")", "", regex=False)
+        .str.split(n=1, expand=True)
+    )
 
-    # Load the intersection data
-    intersection_data = pd.read_csv(
-        "output-data/csv-files/OSM-NHD-Intersections.csv", low_memory=False
+    sorted_pairs = pair_index.to_numpy()[order]
+    starts = np.flatnonzero(np.r_[True, sorted_pairs[1:] != sorted_pairs[:-1]])
+    pairs = points.loc[starts, ["osm_id", "permanent_identifier"]].reset_index(drop=True)
+    pairs["point_start"] = starts
+    pairs["point_count"] = np.diff(np.r_[starts, len(points)])
+
+    return {
+        "pairs": pairs,
+        "lon": coords[0].to_numpy(dtype="float64"),
+        "lat": coords[1].to_numpy(dtype="float64"),
+        "wkt": points["WKT"].to_numpy(),
+    }
+
+
+def nearest_points_of_pairs(bridge_lon, bridge_lat, point_start, point_count, crossings):
+    """
+    Function to find, for every row, the point of its (way, stream) pair nearest to its bridge
+    """
+    rows = np.repeat(np.arange(len(point_count)), point_count)
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(point_count) - point_count, point_count)
+    candidates = np.repeat(point_start, point_count) + within
+
+    lon1, lat1 = np.radians(bridge_lon[rows]), np.radians(bridge_lat[rows])
+    lon2, lat2 = np.radians(crossings["lon"][candidates]), np.radians(crossings["lat"][candidates])
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
     )
-    intersection_data = intersection_data[["WKT", "osm_id", "permanent_identifier"]]
 
-    # Ensure 'osm_id' and 'permanent_identifier_x' in df are of the same type as df2 columns
-    final_join_data["osm_id"] = final_join_data["osm_id"]
-    final_join_data["permanent_identifier_x"] = final_join_data[
-        "permanent_identifier_x"
-    ]
+    # First candidate of every row after sorting by row, then distance, then file order
+    order = np.lexsort((within, a, rows))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = rows[order][1:] != rows[order][:-1]
+    return rows[order][first], candidates[order][first]
+
+
+def merge_join_data_with_intersections(final_join_data, intersection_data):
+    """
+    Function to tag all data join result with the nearest intersection of each way and stream.
+    """
+    crossings = aggregate_intersections(intersection_data)
 
-    # Perform the left merge
+    # Each (way, stream) pair matches at most one row, so the join keeps one row per candidate
     df = pd.merge(
         final_join_data,
-        intersection_data,
+        crossings["pairs"],
         how="left",
         left_on=["osm_id", "permanent_identifier_x"],
         right_on=["osm_id", "permanent_identifier"],
     )
 
-    return df
+    matched = np.flatnonzero(df["point_count"].notna().to_numpy())
+    rows, points = nearest_points_of_pairs(
+        df["LONGDD"].to_numpy(dtype="float64")[matched],
+        df["LATDD"].to_numpy(dtype="float64")[matched],
+        df["point_start"].to_numpy()[matched].astype("int64"),
+        df["point_count"].to_numpy()[matched].astype("int64"),
+        crossings,
+    )
+    wkt = np.full(len(df), np.nan, dtype=object)
+    wkt[matched[rows]] = crossings["wkt"][points]
+    df["WKT"] = wkt
+
+    return df[list(final_join_data.columns) + ["WKT", "permanent_identifier"]]
 
 
-def create_intermediate_association(df):
+def create_intermediate_association(df, checkpoint=True):
     """
     Function to create intermediate association among bridges and ways.
     """
@@ -162,13 +311,15 @@ def create_intermediate_association(df):
     ].transform("nunique")
 
     # Save intermediate results
-    df.to_csv("output-data/csv-files/Intermediate-Association.csv")
-    print("\nIntermediate-Association.csv file has been created successfully!")
+    if checkpoint:
+        background_writer.submit(
+            df_to_csv, df, "output-data/csv-files/Intermediate-Association.csv"
+        )
 
     return df
 
 
-def create_final_associations(df):
+def create_final_associations(df, checkpoint=True):
     """
     Function to create final association among bridges and ways.
     """
@@ -192,26 +343,21 @@ def create_final_associations(df):
     df = df.merge(final_values_df, on="STRUCTURE_NUMBER_008", how="left")
 
     # Save the updated dataframe to a new CSV file
-    df.to_csv(
-        "output-data/csv-files/Final-associations-with-intersections.csv",
-        index=False,
-    )
-    print(
-        "\nFinal-associations-with-intersections.csv file has been created successfully!"
-    )
+    if checkpoint:
+        background_writer.submit(
+            df_to_csv,
+            df,
+            "output-data/csv-files/Final-associations-with-intersections.csv",
+            index=False,
+        )
 
     return df
 
 
-def add_bridge_details(df):
+def add_bridge_details(df, bridge_data_df, checkpoint=True):
     """
     Function to add bridge information to associated data.
     """
-    bridge_data_df = pd.read_csv(
-        "input-data/NTAD-National-Bridge-Inventory-Dataset.csv",
-        low_memory=False,
-    )
-
     # Merge the data on 'STRUCTURE_NUMBER_008'
     merged_df = pd.merge(
         df,
@@ -235,21 +381,275 @@ def add_bridge_details(df):
     result_df.rename(columns={"STRUCTURE_LEN_MT_049": "bridge_length"}, inplace=True)
 
     # Save the resulting DataFrame to a new CSV file
-    result_df.to_csv(
-        "output-data/csv-files/bridge-osm-association-with-lengths.csv",
-        index=False,
+    if checkpoint:
+        background_writer.submit(
+            df_to_csv,
+            result_df,
+            "output-data/csv-files/bridge-osm-association-with-lengths.csv",
+            index=False,
+        )
+
+    return result_df
+
+
+def open_association_store(db_path=association_db):
+    """
+    Function to open the association store, creating its tables and indexes when missing
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(store_schema)
+    return conn
+
+
+def store_rows(df, integer_columns=()):
+    """
+    Function to turn DataFrame rows into tuples for SQLite, with missing values as NULL
+    """
+    df = df.copy()
+    for column in integer_columns:
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def execute_batches(conn, sql, rows):
+    """
+    Function to run a statement over rows in batches of db_batch_size
+    """
+    for start in range(0, len(rows), db_batch_size):
+        conn.executemany(sql, rows[start : start + db_batch_size])
+
+
+def upsert_associations(conn, final_df, result_df):
+    """
+    Function to insert or replace the bridges of this run, their candidate ways and streams,
+    and their final choices in one transaction
+    """
+    final_df = final_df.assign(
+        STRUCTURE_NUMBER_008=final_df["STRUCTURE_NUMBER_008"].astype(str)
     )
-    print(
-        "\nbridge-osm-association-with-lengths.csv file has been created successfully!"
+    result_df = result_df.assign(
+        STRUCTURE_NUMBER_008=result_df["STRUCTURE_NUMBER_008"].astype(str)
+    ).drop_duplicates(subset="STRUCTURE_NUMBER_008")
+
+    bridges = final_df.drop_duplicates(subset="STRUCTURE_NUMBER_008")[
+        ["STRUCTURE_NUMBER_008", "LATDD", "LONGDD"]
+    ].merge(
+        result_df[["STRUCTURE_NUMBER_008", "bridge_length"]],
+        on="STRUCTURE_NUMBER_008",
+        how="left",
+    )
+    ways = final_df.loc[final_df["osm_id"].notna(), ["osm_id", "name", "highway"]]
+    ways = ways.drop_duplicates(subset="osm_id")
+    streams = pd.concat(
+        [final_df["permanent_identifier_x"], final_df["permanent_identifier_y"]]
+    ).dropna()
+    streams = pd.DataFrame({"permanent_identifier": streams.astype(str).unique()})
+    links = final_df[
+        [
+            "STRUCTURE_NUMBER_008",
+            "osm_id",
+            "permanent_identifier_x",
+            "permanent_identifier_y",
+            "Lat_intersection",
+            "Long_intersection",
+            "Haversine_dist",
+            "Is_Min_Dist",
+            "Is_Stream_Identical",
+        ]
+    ]
+    choices = result_df[["STRUCTURE_NUMBER_008", "final_osm_id", "final_long", "final_lat"]]
+
+    with conn:
+        # Candidate links have no key of their own, so a bridge's links are replaced as a whole
+        execute_batches(
+            conn,
+            "DELETE FROM candidate_links WHERE structure_number = ?",
+            [(bridge_id,) for bridge_id in bridges["STRUCTURE_NUMBER_008"]],
+        )
+        execute_batches(
+            conn,
+            """INSERT INTO bridges VALUES (?, ?, ?, ?)
+            ON CONFLICT (structure_number) DO UPDATE SET
+            lat = excluded.lat, long = excluded.long, bridge_length = excluded.bridge_length""",
+            store_rows(bridges),
+        )
+        execute_batches(
+            conn,
+            """INSERT INTO ways VALUES (?, ?, ?)
+            ON CONFLICT (osm_id) DO UPDATE SET
+            name = excluded.name, highway = excluded.highway""",
+            store_rows(ways, integer_columns=["osm_id"]),
+        )
+        execute_batches(
+            conn, "INSERT OR IGNORE INTO streams VALUES (?)", store_rows(streams)
+        )
+        execute_batches(
+            conn,
+            "INSERT INTO candidate_links VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            store_rows(links, integer_columns=["osm_id"]),
+        )
+        execute_batches(
+            conn,
+            """INSERT INTO final_choices VALUES (?, ?, ?, ?)
+            ON CONFLICT (structure_number) DO UPDATE SET
+            final_osm_id = excluded.final_osm_id,
+            final_long = excluded.final_long,
+            final_lat = excluded.final_lat""",
+            store_rows(choices, integer_columns=["final_osm_id"]),
+        )
+
+
+def upsert_split_points(conn, split_df, structure_numbers):
+    """
+    Function to replace the split points of the given bridges with their rows in split_df,
+    which has the columns of bridge-osm-association-with-split-coords.csv
+    """
+    split_df = split_df.assign(
+        STRUCTURE_NUMBER_008=split_df["STRUCTURE_NUMBER_008"].astype(str),
+        bridge_coordinate=split_df["bridge_coordinate"].astype(str),
+    )
+    with conn:
+        # A bridge may have several rows, so its rows are replaced as a whole
+        execute_batches(
+            conn,
+            "DELETE FROM split_points WHERE structure_number = ?",
+            [(str(bridge_id),) for bridge_id in structure_numbers],
+        )
+        execute_batches(
+            conn,
+            "INSERT INTO split_points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            store_rows(
+                split_df,
+                integer_columns=[
+                    "osm_id",
+                    "osm_id_for_first_split_point",
+                    "osm_id_for_second_split_point",
+                ],
+            ),
+        )
+
+
+def delete_bridges(conn, structure_numbers):
+    """
+    Function to remove bridges, with their candidate links, final choices and split
+    points, from the store
+    """
+    rows = [(str(bridge_id),) for bridge_id in structure_numbers]
+    with conn:
+        for table in ["candidate_links", "final_choices", "split_points", "bridges"]:
+            execute_batches(conn, f"DELETE FROM {table} WHERE structure_number = ?", rows)
+
+
+def remove_stale_bridges(conn, structure_numbers):
+    """
+    Function to delete the bridges of an earlier full run that are not among the given bridges
+    """
+    stored = pd.read_sql_query("SELECT structure_number FROM bridges", conn)
+    current = set(pd.Series(structure_numbers).astype(str))
+    delete_bridges(conn, set(stored["structure_number"]) - current)
+
+
+def bridges_on_way(conn, osm_id):
+    """
+    Function to list the bridges whose final choice is the given way
+    """
+    return pd.read_sql_query(
+        """SELECT b.*, f.final_long, f.final_lat FROM final_choices f
+        JOIN bridges b USING (structure_number) WHERE f.final_osm_id = ?""",
+        conn,
+        params=(int(osm_id),),
+    )
+
+
+def bridge_state(conn, structure_number):
+    """
+    Function to read one bridge with its final choice and candidate links
+    """
+    bridge = pd.read_sql_query(
+        """SELECT * FROM bridges LEFT JOIN final_choices USING (structure_number)
+        WHERE structure_number = ?""",
+        conn,
+        params=(str(structure_number),),
+    )
+    links = pd.read_sql_query(
+        "SELECT * FROM candidate_links WHERE structure_number = ?",
+        conn,
+        params=(str(structure_number),),
     )
+    return bridge, links
+
+
+def export_associations(conn, csv_path):
+    """
+    Function to write bridge-osm-association-with-lengths.csv from the store, one row per bridge
+    """
+    df = pd.read_sql_query(
+        """SELECT structure_number AS STRUCTURE_NUMBER_008, final_osm_id, final_long,
+        final_lat, bridge_length FROM bridges LEFT JOIN final_choices USING (structure_number)
+        ORDER BY structure_number""",
+        conn,
+    )
+    df[association_columns].to_csv(csv_path, index=False)
+    return len(df)
+
+
+def export_split_points(conn, csv_path):
+    """
+    Function to write bridge-osm-association-with-split-coords.csv from the store
+    """
+    df = pd.read_sql_query(
+        "SELECT * FROM split_points ORDER BY structure_number, rowid", conn
+    ).rename(columns={"structure_number": "STRUCTURE_NUMBER_008"})
+    df = df.astype(
+        {
+            "osm_id": "Int64",
+            "osm_id_for_first_split_point": "Int64",
+            "osm_id_for_second_split_point": "Int64",
+        }
+    )
+    df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+    return len(df)
+
+
+def determine_final_associations(
+    final_join_data, intersection_data, bridge_data_df, checkpoint=False, store=None
+):
+    """
+    Function to run this stage on in-memory tables, writing its CSV files only when checkpoint
+    is set and upserting the results into the association store when one is given
+    """
+    df = merge_join_data_with_intersections(final_join_data, intersection_data)
+    intermediate_df = create_intermediate_association(df, checkpoint)
+    final_df = create_final_associations(intermediate_df, checkpoint)
+    result_df = add_bridge_details(final_df, bridge_data_df, checkpoint)
+    if store is not None:
+        upsert_associations(store, final_df, result_df)
+    return result_df
 
 
 def main():
-    df = merge_join_data_with_intersections()
-    intermediate_df = create_intermediate_association(df)
-    final_df = create_final_associations(intermediate_df)
-    add_bridge_details(final_df)
+    final_join_data = pd.read_csv(all_join_csv)
+    intersection_data = pd.read_csv(intersections_csv, low_memory=False)
+    bridge_data_df = pd.read_csv(ntad_bridges_csv, low_memory=False)
+
+    store = open_association_store()
+    try:
+        result_df = determine_final_associations(
+            final_join_data, intersection_data, bridge_data_df, checkpoint=True, store=store
+        )
+        remove_stale_bridges(store, result_df["STRUCTURE_NUMBER_008"])
+    finally:
+        store.close()
+    print(f"Output file: {association_db} has been updated successfully!")
+
+    # Make sure every output file is complete before exiting
+    background_writer.wait()
 
 
 if __name__ == "__main__":
-    main()
+    with stage_profile("determine-final-osm-id"):
+        main()
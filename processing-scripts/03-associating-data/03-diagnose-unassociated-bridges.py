@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+import pyogrio
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import extract_hstore_value
+
+# Bridges surviving the tagging filters, and the outputs of the association stage
+final_bridges_gpkg = "output-data/gpkg-files/Final-filtered-NBI-Bridges.gpkg"
+nbi_osm_nhd_csv = "output-data/csv-files/NBI-30-OSM-NHD-Join.csv"
+bridges_csv = "output-data/csv-files/NBI-Bridges.csv"
+bridge_ways_csv = "output-data/csv-files/NBI-30-OSM-Links.csv"
+associations_csv = "output-data/csv-files/bridge-osm-association-with-lengths.csv"
+
+# Association store written by 02-determine-final-osm-id.py. Unlike the CSVs of an
+# incremental run, it holds the candidate ways of every bridge
+association_db = "output-data/association-store.sqlite"
+
+# Ways and streams searched around each unassociated bridge
+osm_gpkg = "output-data/gpkg-files/kentucky-filtered-highways.gpkg"
+osm_layer = "lines"
+nhd_gpkg = "input-data/NHD-Kentucky-Streams-Flowline.gpkg"
+nhd_layer = "NHD-Kentucky-Flowline"
+nhd_subset_gpkg = "output-data/gpkg-files/NHD-Flowline-Subset.gpkg"
+nhd_subset_layer = "NHD-Flowline"
+
+output_report_csv = "output-data/csv-files/Unassociated-Bridges-Report.csv"
+
+# Metric CRS used for all distances
+metric_crs = "EPSG:32616"
+
+# Number of nearest ways and streams reported per bridge, and the search radius
+nearest_count = 3
+search_radius_m = 250.0
+
+
+def find_bridges_with_way():
+    """
+    Function to find the bridges with a way in the 30m buffer, from the association store,
+    or from the link tables or the wide join of a run without a store
+    """
+    if os.path.exists(association_db):
+        conn = sqlite3.connect(f"file:{association_db}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT DISTINCT structure_number FROM candidate_links WHERE osm_id IS NOT NULL"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    if os.path.exists(bridges_csv) and os.path.exists(bridge_ways_csv):
+        bridges = pd.read_csv(
+            bridges_csv,
+            usecols=["OBJECTID", "STRUCTURE_NUMBER_008"],
+            dtype={"STRUCTURE_NUMBER_008": str},
+        )
+        linked = pd.read_csv(bridge_ways_csv, usecols=["OBJECTID"])["OBJECTID"]
+        return set(bridges.loc[bridges["OBJECTID"].isin(linked), "STRUCTURE_NUMBER_008"])
+
+    joined = pd.read_csv(nbi_osm_nhd_csv, usecols=["STRUCTURE_NUMBER_008", "osm_id"])
+    return set(joined.loc[joined["osm_id"].notna(), "STRUCTURE_NUMBER_008"].astype(str))
+
+
+def find_unassociated_bridges():
+    """
+    Function to find the filtered bridges without a way in the 30m buffer or without a final OSM way
+    """
+    bridges = pyogrio.read_dataframe(final_bridges_gpkg, columns=["STRUCTURE_NUMBER_008"])
+    bridges = bridges.to_crs(metric_crs)
+    bridges["STRUCTURE_NUMBER_008"] = bridges["STRUCTURE_NUMBER_008"].astype(str)
+
+    ids_with_way = find_bridges_with_way()
+
+    associations = pd.read_csv(
+        associations_csv,
+        usecols=["STRUCTURE_NUMBER_008", "final_osm_id"],
+        dtype={"STRUCTURE_NUMBER_008": str},
+    )
+    associated_ids = set(
+        associations.loc[
+            associations["final_osm_id"].notna(), "STRUCTURE_NUMBER_008"
+        ].astype(str)
+    )
+
+    reason = pd.Series("", index=bridges.index)
+    reason[~bridges["STRUCTURE_NUMBER_008"].isin(associated_ids)] = "no_final_osm_id"
+    reason[~bridges["STRUCTURE_NUMBER_008"].isin(ids_with_way)] = "no_way_within_30m"
+    bridges["reason"] = reason
+
+    return bridges[bridges["reason"] != ""].reset_index(drop=True)
+
+
+def load_ways():
+    """
+    Function to load the ways with their highway class and bridge/layer tags
+    """
+    ways = pyogrio.read_dataframe(
+        osm_gpkg, layer=osm_layer, columns=["osm_id", "name", "highway", "other_tags"]
+    )
+    ways["bridge"] = extract_hstore_value(ways["other_tags"], "bridge")
+    ways["layer"] = extract_hstore_value(ways["other_tags"], "layer")
+    ways = ways.rename(columns={"osm_id": "feature_id"}).to_crs(metric_crs)
+    return ways[["feature_id", "name", "highway", "bridge", "layer", "geometry"]]
+
+
+def load_streams():
+    """
+    Function to load the NHD streams, preferring the subset near the roads
+    """
+    gpkg_path, layer = nhd_gpkg, nhd_layer
+    if os.path.exists(nhd_subset_gpkg):
+        gpkg_path, layer = nhd_subset_gpkg, nhd_subset_layer
+    streams = pyogrio.read_dataframe(
+        gpkg_path,
+        layer=layer,
+        columns=["permanent_identifier", "gnis_name", "fcode_description"],
+    )
+    streams = streams.rename(
+        columns={"permanent_identifier": "feature_id", "gnis_name": "name"}
+    ).to_crs(metric_crs)
+    return streams[["feature_id", "name", "fcode_description", "geometry"]]
+
+
+def nearest_features(points, geometries, k, radius):
+    """
+    Function to find the k nearest features within radius of every point in one vectorized query
+    """
+    tree = shapely.STRtree(geometries)
+    point_index, feature_index = tree.query(points, predicate="dwithin", distance=radius)
+    distances = shapely.distance(points[point_index], geometries[feature_index])
+
+    order = np.lexsort((distances, point_index))
+    point_index, feature_index, distances = (
+        point_index[order],
+        feature_index[order],
+        distances[order],
+    )
+
+    # Rank of each feature among the features found for its point
+    first = np.ones(len(point_index), dtype=bool)
+    first[1:] = point_index[1:] != point_index[:-1]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(point_index)), 0))
+    rank = np.arange(len(point_index)) - group_start + 1
+
+    keep = rank <= k
+    return point_index[keep], feature_index[keep], distances[keep], rank[keep]
+
+
+def build_report(bridges, features, kind):
+    """
+    Function to list the nearest features of one kind for every unassociated bridge
+    """
+    point_index, feature_index, distances, rank = nearest_features(
+        bridges.geometry.values,
+        features.geometry.values,
+        nearest_count,
+        search_radius_m,
+    )
+    report = features.drop(columns="geometry").iloc[feature_index].reset_index(drop=True)
+    report.insert(0, "STRUCTURE_NUMBER_008", bridges["STRUCTURE_NUMBER_008"].values[point_index])
+    report.insert(1, "reason", bridges["reason"].values[point_index])
+    report.insert(2, "kind", kind)
+    report.insert(3, "rank", rank)
+    report.insert(5, "distance_m", np.round(distances, 1))
+    return report
+
+
+def main():
+    bridges = find_unassociated_bridges()
+    print(bridges["reason"].value_counts().to_string())
+
+    report = pd.concat(
+        [
+            build_report(bridges, load_ways(), "way"),
+            build_report(bridges, load_streams(), "stream"),
+        ],
+        ignore_index=True,
+    )
+
+    # Bridges without any way or stream in the search radius are still listed
+    missing = bridges[~bridges["STRUCTURE_NUMBER_008"].isin(report["STRUCTURE_NUMBER_008"])]
+    report = pd.concat(
+        [report, missing[["STRUCTURE_NUMBER_008", "reason"]]], ignore_index=True
+    )
+
+    report["rank"] = report["rank"].astype("Int64")
+    report = report.sort_values(
+        ["STRUCTURE_NUMBER_008", "kind", "rank"], kind="stable", ignore_index=True
+    )
+    report.to_csv(output_report_csv, index=False)
+    print(f"Output file: {output_report_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import importlib.util
+import os
+import sys
+
+import dask
+import dask.dataframe as dd
+import pandas as pd
+from dask.distributed import Client, LocalCluster
+
+# Output of this script, the same table as 02-determine-final-osm-id.py writes
+associations_csv = "output-data/csv-files/bridge-osm-association-with-lengths.csv"
+
+# Local cluster: one single-threaded worker per core, since the association
+# functions hold the GIL, with a memory limit per worker
+worker_count = int(os.environ.get("ASSOCIATION_WORKERS", os.cpu_count()))
+worker_memory_limit = os.environ.get("ASSOCIATION_WORKER_MEMORY", "4GB")
+
+# Folder where workers spill partitions that do not fit in their memory limit
+spill_dir = "output-data/dask-spill"
+
+# Fractions of the memory limit at which a worker spills to disk, pauses and is restarted
+worker_memory_config = {
+    "distributed.worker.memory.target": 0.6,
+    "distributed.worker.memory.spill": 0.7,
+    "distributed.worker.memory.pause": 0.85,
+    "distributed.worker.memory.terminate": 0.95,
+}
+
+# Bytes per partition when reading the input CSV files
+csv_blocksize = "64MB"
+
+
+def load_stage(name, file_name):
+    """
+    Function to import a stage script of this folder as a module
+    """
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+    )
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that the cluster workers can unpickle the stage functions
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+join_stage = load_stage("join_all_data", "01-join-all-data.py")
+determine_stage = load_stage("determine_final_osm_id", "02-determine-final-osm-id.py")
+
+# Columns and types of the partition results
+result_meta = pd.DataFrame(
+    {
+        "STRUCTURE_NUMBER_008": pd.Series(dtype=object),
+        "final_osm_id": pd.Series(dtype=object),
+        "final_long": pd.Series(dtype=object),
+        "final_lat": pd.Series(dtype=object),
+        "bridge_length": pd.Series(dtype="float64"),
+    }
+)
+
+
+# How every table of the join gets its state: from its own STATE_CODE_001 column, or
+# from the states of its key in the tables listed as (table, column holding the key)
+state_sources = {
+    "link": [
+        ("bridges", None, []),
+        ("bridge_ways", "OBJECTID", [("bridges", "OBJECTID")]),
+        ("bridge_streams", "OBJECTID", [("bridges", "OBJECTID")]),
+        ("ways", "osm_id", [("bridge_ways", "osm_id")]),
+        ("way_streams", "osm_id", [("bridge_ways", "osm_id")]),
+        ("streams", "OBJECTID", [("way_streams", "OBJECTID"), ("bridge_streams", "OBJECTID_2")]),
+        ("intersections", "osm_id", [("bridge_ways", "osm_id")]),
+        ("ntad", None, []),
+    ],
+    "wide": [
+        ("nbi_osm_nhd", None, []),
+        ("nbi_nhd", "STRUCTURE_NUMBER_008", [("nbi_osm_nhd", "STRUCTURE_NUMBER_008")]),
+        ("intersections", "osm_id", [("nbi_osm_nhd", "osm_id")]),
+        ("ntad", None, []),
+    ],
+}
+
+
+def read_inputs():
+    """
+    Function to read the tagging outputs and the NBI bridge details as Dask DataFrames
+    """
+    if all(os.path.exists(path) for path in join_stage.link_table_csvs.values()):
+        tables = {
+            name: dd.read_csv(
+                path, dtype=join_stage.link_table_dtypes.get(name), blocksize=csv_blocksize
+            )
+            for name, path in join_stage.link_table_csvs.items()
+        }
+    else:
+        tables = {
+            "nbi_osm_nhd": dd.read_csv(
+                join_stage.nbi_osm_nhd_csv, dtype=join_stage.dtype_left, blocksize=csv_blocksize
+            ),
+            "nbi_nhd": dd.read_csv(
+                join_stage.nbi_nhd_csv, dtype=join_stage.dtype_right, blocksize=csv_blocksize
+            ),
+        }
+    tables["intersections"] = dd.read_csv(
+        determine_stage.intersections_csv,
+        usecols=["WKT", "osm_id", "permanent_identifier"],
+        dtype={"osm_id": "float64", "permanent_identifier": "object"},
+        blocksize=csv_blocksize,
+    )
+    tables["ntad"] = dd.read_csv(
+        determine_stage.ntad_bridges_csv,
+        usecols=["STRUCTURE_NUMBER_008", "STATE_CODE_001", "STRUCTURE_LEN_MT_049"],
+        dtype={"STRUCTURE_NUMBER_008": "object"},
+        blocksize=csv_blocksize,
+    )
+    return tables
+
+
+def partition_by_state(ddf, states):
+    """
+    Function to index a Dask DataFrame by STATE_CODE_001 with exactly one partition per state
+    """
+    ddf = ddf[ddf["STATE_CODE_001"].isin(states)]
+    return ddf.set_index("STATE_CODE_001", divisions=states + [states[-1]])
+
+
+def add_state_codes(tables, layout):
+    """
+    Function to give every table without a state the states of its bridges, ways or
+    streams; a way or stream near a border goes to both states
+    """
+    tables = dict(tables)
+    for name, key, sources in state_sources[layout]:
+        if not sources:
+            continue
+        key_states = dd.concat(
+            [
+                tables[source][[source_key, "STATE_CODE_001"]]
+                .dropna()
+                .rename(columns={source_key: key})
+                .astype({key: tables[name][key].dtype})
+                for source, source_key in sources
+            ]
+        ).drop_duplicates()
+        tables[name] = tables[name].merge(key_states, on=key, how="inner")
+    return tables
+
+
+def associate_state(names, *frames):
+    """
+    Function to run the join and the final OSM id selection on the tables of one state
+    """
+    tables = dict(zip(names, frames))
+    main_table = "bridges" if "bridges" in tables else "nbi_osm_nhd"
+    if tables[main_table].empty:
+        return result_meta
+    # The bridge table keeps its state column, the rest only carried it for partitioning
+    tables = {
+        name: df.reset_index() if name == main_table else df.reset_index(drop=True)
+        for name, df in tables.items()
+    }
+    intersections = tables.pop("intersections")
+    ntad = tables.pop("ntad")
+    all_join_df = join_stage.build_all_join(tables)
+    return determine_stage.determine_final_associations(all_join_df, intersections, ntad)[
+        result_meta.columns
+    ].reset_index(drop=True)
+
+
+def associate_by_state(tables):
+    """
+    Function to build the partition-local association of every state as one Dask DataFrame
+    """
+    layout = "link" if "bridges" in tables else "wide"
+    main_table = state_sources[layout][0][0]
+    states = sorted(tables[main_table]["STATE_CODE_001"].dropna().unique().compute().tolist())
+    tables = add_state_codes(tables, layout)
+    names = tuple(tables)
+    return dd.map_partitions(
+        associate_state,
+        names,
+        *(partition_by_state(tables[name], states) for name in names),
+        meta=result_meta,
+    )
+
+
+def main():
+    # Object columns keep pandas' NaN comparisons, which the association rules rely on
+    dask.config.set({"dataframe.convert-string": False, **worker_memory_config})
+    os.makedirs(spill_dir, exist_ok=True)
+
+    with LocalCluster(
+        n_workers=worker_count,
+        threads_per_worker=1,
+        memory_limit=worker_memory_limit,
+        local_directory=spill_dir,
+    ) as cluster, Client(cluster) as client:
+        print(f"Dask dashboard: {client.dashboard_link}")
+        associations = associate_by_state(read_inputs())
+        associations.to_csv(associations_csv, single_file=True, index=False)
+
+    print(f"Output file: {associations_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    main()
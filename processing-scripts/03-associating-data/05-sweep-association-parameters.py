@@ -0,0 +1,307 @@
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count, get_all_start_methods, set_start_method
+
+import numpy as np
+import pandas as pd
+import pyogrio
+import pyproj
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import snapshot_key
+
+# Radii swept for the bridge-way candidates (30m in the tagging step) and the
+# bridge-stream links (10m), and tolerances swept for the distance between a final
+# point and its way below which the split stage accepts the bridge (1m)
+way_radii_m = [10, 15, 20, 25, 30, 40, 50]
+stream_radii_m = [5, 10, 15, 20, 30]
+split_tolerances_m = [0.1, 0.5, 1, 2, 5]
+
+# Processes evaluating parameter combinations
+sweep_workers = int(os.environ.get("SWEEP_WORKERS", cpu_count()))
+
+# Bridges with a reviewed OSM way (STRUCTURE_NUMBER_008, osm_id), used to score each combination
+labelled_csv = "input-data/Labelled-Bridge-Ways.csv"
+
+# Ways and streams measured against the bridges
+osm_gpkg = "output-data/gpkg-files/kentucky-filtered-highways.gpkg"
+osm_layer = "lines"
+nhd_gpkg = "input-data/NHD-Kentucky-Streams-Flowline.gpkg"
+nhd_layer = "NHD-Kentucky-Flowline"
+nhd_subset_gpkg = "output-data/gpkg-files/NHD-Flowline-Subset.gpkg"
+nhd_subset_layer = "NHD-Flowline"
+
+# Metric CRS used for all distances
+metric_crs = "EPSG:32616"
+
+# Bridge-way and bridge-stream distances up to the largest radii, reused while their
+# inputs are unchanged
+bridge_way_distances_csv = (
+    f"output-data/csv-files/Sweep-Bridge-Way-Distances-{max(way_radii_m)}m.csv"
+)
+bridge_stream_distances_csv = (
+    f"output-data/csv-files/Sweep-Bridge-Stream-Distances-{max(stream_radii_m)}m.csv"
+)
+
+sweep_csv = "output-data/csv-files/Association-Parameter-Sweep.csv"
+
+# Tables shared with the forked workers
+sweep_tables = {}
+
+
+def load_stage(name, relative_path):
+    """
+    Function to import a stage script as a module
+    """
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(os.path.dirname(os.path.abspath(__file__)), relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+join_stage = load_stage("join_all_data", "01-join-all-data.py")
+determine_stage = load_stage("determine_final_osm_id", "02-determine-final-osm-id.py")
+split_stage = load_stage(
+    "obtain_bridge_split_info",
+    "../04-obtaining-bridge-coordinates/01-obtain-bridge-split-info.py",
+)
+candidate_stage = load_stage(
+    "build_bridge_way_candidates",
+    "../01-filtering-data/07-build-bridge-way-candidates.py",
+)
+
+
+def pair_distances(points, geometries, radius):
+    """
+    Function to find every (point, geometry) pair within radius, with its distance, in one STRtree query
+    """
+    tree = shapely.STRtree(geometries)
+    point_index, geometry_index = tree.query(points, predicate="dwithin", distance=radius)
+    distances = shapely.distance(points[point_index], geometries[geometry_index])
+    return point_index, geometry_index, distances
+
+
+def is_fresh(output_path, input_paths):
+    """
+    Function to check that an output exists and is newer than all of its inputs
+    """
+    if not os.path.exists(output_path):
+        return False
+    output_time = os.path.getmtime(output_path)
+    return all(
+        os.path.getmtime(path) <= output_time for path in input_paths if os.path.exists(path)
+    )
+
+
+def candidate_way_distances(bridges):
+    """
+    Function to take the bridge-way distances from the candidate index when it covers the
+    largest swept radius and was built from the current bridges and ways, so its
+    OBJECTIDs are those of the swept bridges
+    """
+    if not os.path.exists(candidate_stage.output_snapshot_json) or not os.path.exists(
+        candidate_stage.input_nbi_gpkg
+    ):
+        return None
+    with open(candidate_stage.output_snapshot_json, "r") as f:
+        snapshot = json.load(f)
+    if (
+        snapshot.get("nbi") != snapshot_key(candidate_stage.input_nbi_gpkg)
+        or snapshot.get("osm") != snapshot_key(osm_gpkg)
+        or snapshot.get("max_radius_m", 0) < max(way_radii_m)
+    ):
+        return None
+    candidates = pd.read_csv(
+        candidate_stage.output_candidates_csv, usecols=["OBJECTID", "osm_id", "distance_m"]
+    )
+    candidates = candidates[
+        candidates["OBJECTID"].isin(bridges["OBJECTID"])
+        & (candidates["distance_m"] <= max(way_radii_m))
+    ]
+    return candidates.rename(columns={"distance_m": "distance"})
+
+
+def compute_distance_tables(bridges):
+    """
+    Function to measure the bridge-way and bridge-stream distances once, at the largest swept radii
+    """
+    nhd_path, layer = nhd_gpkg, nhd_layer
+    if os.path.exists(nhd_subset_gpkg):
+        nhd_path, layer = nhd_subset_gpkg, nhd_subset_layer
+    inputs = [join_stage.link_table_csvs["bridges"], osm_gpkg, nhd_path]
+    if is_fresh(bridge_way_distances_csv, inputs) and is_fresh(
+        bridge_stream_distances_csv, inputs
+    ):
+        print("Reusing the bridge-way and bridge-stream distance tables......!")
+        return pd.read_csv(bridge_way_distances_csv), pd.read_csv(bridge_stream_distances_csv)
+
+    transformer = pyproj.Transformer.from_crs("EPSG:4326", metric_crs, always_xy=True)
+    points = shapely.points(*transformer.transform(bridges["LONGDD"], bridges["LATDD"]))
+
+    bridge_ways = candidate_way_distances(bridges)
+    if bridge_ways is not None:
+        print("Reusing the bridge-way distances of the candidate index......!")
+    else:
+        ways = pyogrio.read_dataframe(osm_gpkg, layer=osm_layer, columns=["osm_id"])
+        ways = ways.to_crs(metric_crs)
+        bridge_index, way_index, distances = pair_distances(
+            points, ways.geometry.values, max(way_radii_m)
+        )
+        bridge_ways = pd.DataFrame(
+            {
+                "OBJECTID": bridges["OBJECTID"].values[bridge_index],
+                "osm_id": ways["osm_id"].astype("int64").values[way_index],
+                "distance": distances,
+            }
+        )
+
+    streams = pyogrio.read_dataframe(nhd_path, layer=layer, columns=["OBJECTID"])
+    streams = streams.to_crs(metric_crs)
+    bridge_index, stream_index, distances = pair_distances(
+        points, streams.geometry.values, max(stream_radii_m)
+    )
+    bridge_streams = pd.DataFrame(
+        {
+            "OBJECTID": bridges["OBJECTID"].values[bridge_index],
+            "OBJECTID_2": streams["OBJECTID"].values[stream_index],
+            "distance": distances,
+        }
+    )
+
+    # Nearest first, as the tagging step lists the candidates of a bridge
+    bridge_ways = bridge_ways.sort_values(["OBJECTID", "distance"], kind="stable")
+    bridge_streams = bridge_streams.sort_values(["OBJECTID", "distance"], kind="stable")
+    bridge_ways.to_csv(bridge_way_distances_csv, index=False)
+    bridge_streams.to_csv(bridge_stream_distances_csv, index=False)
+    print(f"Output file: {bridge_way_distances_csv} has been created successfully!")
+    print(f"Output file: {bridge_stream_distances_csv} has been created successfully!")
+    return bridge_ways, bridge_streams
+
+
+def final_point_distances(associations_df):
+    """
+    Function to measure how far each final point lies from its final way in the way store
+    """
+    store = sweep_tables.get("way_store")
+    distances = np.full(len(associations_df), np.nan)
+    if store is None:
+        return distances
+
+    osm_ids = pd.to_numeric(associations_df["final_osm_id"], errors="coerce").to_numpy()
+    lat = pd.to_numeric(associations_df["final_lat"], errors="coerce").to_numpy()
+    lon = pd.to_numeric(associations_df["final_long"], errors="coerce").to_numpy()
+    rows = np.flatnonzero(~np.isnan(osm_ids) & ~np.isnan(lat) & ~np.isnan(lon))
+    way_index = store.find_many(osm_ids[rows].astype("int64"))
+    rows, way_index = rows[way_index >= 0], way_index[way_index >= 0]
+
+    # Ways are projected once per worker and kept for the next combinations
+    lines = sweep_tables.setdefault("way_lines", {})
+    for index in set(way_index.tolist()) - lines.keys():
+        lines[index] = store.line(index, split_stage.utm_transformer)
+    points = shapely.points(*split_stage.utm_transformer.transform(lon[rows], lat[rows]))
+    distances[rows] = shapely.distance(
+        np.array([lines[index] for index in way_index.tolist()] + [None], dtype=object)[:-1],
+        points,
+    )
+    return distances
+
+
+def evaluate_combination(combination):
+    """
+    Function to run the association on the links within one combination of radii and score it
+    """
+    way_radius, stream_radius = combination
+    bridge_ways = sweep_tables["bridge_way_distances"]
+    bridge_streams = sweep_tables["bridge_stream_distances"]
+
+    tables = dict(sweep_tables["link_tables"])
+    tables["bridge_ways"] = bridge_ways[bridge_ways["distance"] <= way_radius]
+    tables["bridge_streams"] = bridge_streams[bridge_streams["distance"] <= stream_radius]
+    associations_df = determine_stage.determine_final_associations(
+        join_stage.join_link_tables(tables),
+        sweep_tables["intersections"],
+        sweep_tables["ntad"],
+    )
+
+    associated = associations_df["final_osm_id"].notna()
+    row = {
+        "way_radius_m": way_radius,
+        "stream_radius_m": stream_radius,
+        "bridge_way_links": len(tables["bridge_ways"]),
+        "bridge_stream_links": len(tables["bridge_streams"]),
+        "associated_bridges": int(associated.sum()),
+        "unassociated_bridges": int((~associated).sum()),
+    }
+
+    labelled = sweep_tables.get("labelled")
+    if labelled is not None:
+        scored = labelled.merge(
+            associations_df[["STRUCTURE_NUMBER_008", "final_osm_id"]].astype(
+                {"STRUCTURE_NUMBER_008": str}
+            ),
+            on="STRUCTURE_NUMBER_008",
+            how="left",
+        )
+        agreeing = pd.to_numeric(scored["final_osm_id"], errors="coerce") == scored["osm_id"]
+        row["labelled_bridges"] = len(labelled)
+        row["labelled_agreeing"] = int(agreeing.sum())
+        row["labelled_agreement"] = round(agreeing.mean(), 4) if len(labelled) else np.nan
+
+    distances = final_point_distances(associations_df)
+    for tolerance in split_tolerances_m:
+        row[f"split_ready_{tolerance}m"] = int((distances < tolerance).sum())
+    return row
+
+
+def main():
+    link_tables = join_stage.read_join_tables()
+    if "bridge_ways" not in link_tables:
+        print("Link tables not found, run 02-tagging-data/01-tagging-nbi-and-osm-data.py first")
+        return
+
+    bridge_ways, bridge_streams = compute_distance_tables(link_tables["bridges"])
+    sweep_tables["link_tables"] = link_tables
+    sweep_tables["bridge_way_distances"] = bridge_ways
+    sweep_tables["bridge_stream_distances"] = bridge_streams
+    sweep_tables["intersections"] = pd.read_csv(
+        determine_stage.intersections_csv, low_memory=False
+    )
+    sweep_tables["ntad"] = pd.read_csv(determine_stage.ntad_bridges_csv, low_memory=False)
+    if os.path.exists(labelled_csv):
+        sweep_tables["labelled"] = pd.read_csv(
+            labelled_csv,
+            usecols=["STRUCTURE_NUMBER_008", "osm_id"],
+            dtype={"STRUCTURE_NUMBER_008": str},
+        )
+    if os.path.exists(os.path.join(split_stage.way_store_dir, "meta.json")):
+        sweep_tables["way_store"] = split_stage.WayStore(split_stage.way_store_dir)
+
+    # Workers inherit the tables instead of unpickling them
+    if "fork" in get_all_start_methods():
+        set_start_method("fork", force=True)
+
+    combinations = list(itertools.product(way_radii_m, stream_radii_m))
+    started = time.perf_counter()
+    with Pool(processes=min(sweep_workers, len(combinations))) as pool:
+        rows = pool.map(evaluate_combination, combinations, chunksize=1)
+    print(
+        f"{len(combinations)} parameter combinations evaluated in "
+        f"{time.perf_counter() - started:.1f}s......!"
+    )
+
+    sweep_df = pd.DataFrame(rows).sort_values(["way_radius_m", "stream_radius_m"])
+    sweep_df.to_csv(sweep_csv, index=False)
+    print(f"Output file: {sweep_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,64 @@
 import csv
-import json
 import logging
+import os
+import sys
+from collections import OrderedDict
 from multiprocessing import Pool, cpu_count
 
+import numpy as np
+import pandas as pd
 import pyproj
+import shapely
 from shapely.geometry import LineString, Point
 from shapely.ops import nearest_points, transform
 
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import stage_profile, start_process_profile
+
+# Flat way geometry store built by 01-filtering-data/05-build-way-geometry-store.py
+way_store_dir = "output-data/way-store"
+
+# Define projection transformations
+wgs84 = pyproj.CRS("EPSG:4326")
+utm_zone = pyproj.CRS("EPSG:32616")  # UTM zone for your input coordinates
+utm_transformer = pyproj.Transformer.from_crs(wgs84, utm_zone, always_xy=True)
+inverse_utm_transformer = pyproj.Transformer.from_crs(utm_zone, wgs84, always_xy=True)
+
+# Compute split points for all bridges with vectorized shapely calls, handling
+# only bridges that run past the end of their way one at a time
+batched_mode = True
+
+split_coords_csv = "output-data/csv-files/bridge-osm-association-with-split-coords.csv"
+split_coords_header = [
+    "STRUCTURE_NUMBER_008",
+    "osm_id",
+    "bridge_coordinate",
+    "bridge_length",
+    "first_split_point_lat",
+    "first_split_point_lon",
+    "osm_id_for_first_split_point",
+    "second_split_point_lat",
+    "second_split_point_lon",
+    "osm_id_for_second_split_point",
+]
+
+# Pool settings: number of workers and bridges per spatially contiguous chunk
+worker_count = int(os.environ.get("SPLIT_WORKERS", cpu_count()))
+chunk_size = int(os.environ.get("SPLIT_CHUNK_SIZE", 64))
+
+# Memory budget of the projected way geometries cached by each process
+cache_budget_mb = float(os.environ.get("SPLIT_CACHE_MB", 256))
+
+# Streaming mode: process bridges tile by tile in a single process, loading only
+# the ways within a halo of each tile, so peak memory is bounded by tile size
+streaming_mode = os.environ.get("SPLIT_STREAMING", "0") == "1"
+tile_size_deg = float(os.environ.get("SPLIT_TILE_DEG", 0.25))
+halo_margin_m = 50.0
+
+# Per-process state of the pool workers
+worker_state = {}
+
 
 def setup_logging():
     logging.basicConfig(
@@ -16,31 +68,220 @@ def setup_logging():
     )
 
 
-def load_geojson(file_path):
-    with open(file_path, "r") as f:
-        data = json.load(f)
-    return data
+class WayStore:
+    """
+    Read-only view of the flat way geometry store, memory-mapped from disk so
+    that pool workers share its pages through the OS page cache
+    """
+
+    def __init__(self, store_dir):
+        def open_array(name):
+            return np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.way_ids = open_array("way_ids")
+        self.offsets = open_array("offsets")
+        self.x = open_array("x")
+        self.y = open_array("y")
+        self.bounds = open_array("bounds")
+        self.sorted_ids = open_array("sorted_ids")
+        self.sorted_index = open_array("sorted_index")
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    def find(self, way_id):
+        """
+        Binary search the store index of a way id, or -1 when it is missing
+        """
+        position = np.searchsorted(self.sorted_ids, way_id)
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == way_id:
+            return int(self.sorted_index[position])
+        return -1
+
+    def find_many(self, way_ids):
+        """
+        Vectorized find, returning -1 for every missing way id
+        """
+        way_ids = np.asarray(way_ids, dtype="int64")
+        positions = np.searchsorted(self.sorted_ids, way_ids)
+        positions = np.minimum(positions, len(self.sorted_ids) - 1)
+        found = np.asarray(self.sorted_ids)[positions] == way_ids
+        return np.where(found, np.asarray(self.sorted_index)[positions], -1)
+
+    def line(self, index, transformer=None):
+        """
+        A single way as a LineString, optionally transformed
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        x, y = np.asarray(self.x[start:end]), np.asarray(self.y[start:end])
+        if transformer is not None:
+            x, y = transformer.transform(x, y)
+        return LineString(np.column_stack([x, y]))
+
+
+class WayGeometryCache:
+    """
+    Projects a way from the store the first time it is requested and keeps it in
+    an LRU cache bounded by an estimated memory budget
+    """
+
+    # Rough size of a LineString besides its coordinates
+    line_overhead_bytes = 200
+
+    def __init__(self, store, budget_bytes):
+        self.store = store
+        self.budget_bytes = budget_bytes
+        self.lines = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def estimated_size(self, index):
+        coordinate_count = int(self.store.offsets[index + 1] - self.store.offsets[index])
+        return self.line_overhead_bytes + 16 * coordinate_count
+
+    def get(self, index):
+        line = self.lines.get(index)
+        if line is not None:
+            self.hits += 1
+            self.lines.move_to_end(index)
+            return line
+
+        self.misses += 1
+        line = self.store.line(index, utm_transformer)
+        self.lines[index] = line
+        self.used_bytes += self.estimated_size(index)
+        while self.used_bytes > self.budget_bytes and len(self.lines) > 1:
+            evicted_index, _ = self.lines.popitem(last=False)
+            self.used_bytes -= self.estimated_size(evicted_index)
+            self.evictions += 1
+        return line
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "cached_ways": len(self.lines),
+            "cached_mb": self.used_bytes / 2**20,
+        }
+
+
+class IndexedWays:
+    """
+    Way lookups used by the split functions. Each lookup returns a superset of
+    the ways that can match, in store order, so the functions keep the same
+    first-match results as scanning every way. Only the bounds of the ways are
+    indexed up front; geometries come from the demand-driven cache.
+    """
+
+    def __init__(self, store, cache_budget_bytes, way_indexes=None):
+        self.store = store
+        self.cache = WayGeometryCache(store, cache_budget_bytes)
+
+        # Optionally restrict spatial lookups to a subset of the store
+        if way_indexes is None:
+            way_indexes = np.arange(len(store))
+        self.way_indexes = np.asarray(way_indexes, dtype="int64")
+        self.bounds_tree = shapely.STRtree(
+            shapely.box(*np.asarray(store.bounds[self.way_indexes]).T)
+        )
+
+    def line(self, index):
+        return self.cache.get(index)
+
+    def _lines(self, indexes):
+        return [
+            (self.line(index), int(self.store.way_ids[index]))
+            for index in sorted(set(indexes))
+        ]
+
+    def _candidates(self, points_utm, tolerance=1e-7):
+        """
+        Pairs of (point, way) indexes whose way bounds contain the point
+        """
+        lon, lat = inverse_utm_transformer.transform(
+            shapely.get_x(points_utm), shapely.get_y(points_utm)
+        )
+        boxes = shapely.box(lon - tolerance, lat - tolerance, lon + tolerance, lat + tolerance)
+        point_index, tree_index = self.bounds_tree.query(boxes)
+        return point_index, self.way_indexes[tree_index]
+
+    def with_id(self, way_id):
+        index = self.store.find(way_id)
+        return self._lines([index] if index >= 0 else [])
+
+    def near(self, point):
+        _, way_index = self._candidates(np.array([point]))
+        return self._lines(way_index.tolist())
+
+    # A way touching a point at an endpoint always has the point inside its bounds
+    touching = near
+
+    def first_way_ids_at(self, points_utm):
+        """
+        Vectorized find_way_id_for_point: the first way in store order passing
+        within 1e-6 of each point, or -1 when there is none
+        """
+        point_index, way_index = self._candidates(points_utm)
+        lines = np.array([self.line(index) for index in way_index.tolist()] + [None])[:-1]
+        on_way = shapely.distance(lines, points_utm[point_index]) < 1e-6
+        point_index, way_index = point_index[on_way], way_index[on_way]
+
+        order = np.lexsort((way_index, point_index))
+        point_index, way_index = point_index[order], way_index[order]
+        first = np.ones(len(point_index), dtype=bool)
+        first[1:] = point_index[1:] != point_index[:-1]
+
+        first_way_ids = np.full(len(points_utm), -1, dtype="int64")
+        first_way_ids[point_index[first]] = np.asarray(self.store.way_ids)[
+            way_index[first]
+        ]
+        return first_way_ids
+
+
+def bridges_from_dataframe(df):
+    """
+    Bridge records of the split functions from a bridge association table
+    """
+    osm_ids = pd.to_numeric(df["final_osm_id"], errors="coerce").to_numpy("float64")
+    lat = pd.to_numeric(df["final_lat"], errors="coerce").to_numpy("float64")
+    lon = pd.to_numeric(df["final_long"], errors="coerce").to_numpy("float64")
+    lengths = pd.to_numeric(df["bridge_length"], errors="coerce").to_numpy("float64")
+    bridge_ids = df["STRUCTURE_NUMBER_008"].astype(str).to_numpy()
+
+    # Bridges without a final OSM way, coordinate or length cannot be split
+    rows = np.flatnonzero(~np.isnan(osm_ids) & ~np.isnan(lat) & ~np.isnan(lengths))
+    return [
+        {
+            "index": row + 1,
+            "osm_id": osm_id,
+            "bridge_id": bridge_id,
+            "bridge_length": bridge_length,
+            "bridge_coordinate": (bridge_lat, bridge_lon),
+        }
+        for row, osm_id, bridge_id, bridge_length, bridge_lat, bridge_lon in zip(
+            rows.tolist(),
+            osm_ids[rows].astype("int64").tolist(),
+            bridge_ids[rows].tolist(),
+            lengths[rows].tolist(),
+            lat[rows].tolist(),
+            lon[rows].tolist(),
+        )
+    ]
 
 
 def load_csv(file_path):
-    bridge_data = []
-    with open(file_path, "r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row_number, row in enumerate(reader, start=1):
-            osm_id = row["final_osm_id"]
-            bridge_id = row["STRUCTURE_NUMBER_008"]
-            bridge_length = float(row["bridge_length"])
-            bridge_coordinate = (float(row["final_lat"]), float(row["final_long"]))
-            bridge_data.append(
-                {
-                    "index": row_number,
-                    "osm_id": osm_id,
-                    "bridge_id": bridge_id,
-                    "bridge_length": bridge_length,
-                    "bridge_coordinate": bridge_coordinate,
-                }
-            )
-    return bridge_data
+    df = pd.read_csv(
+        file_path,
+        dtype={"STRUCTURE_NUMBER_008": str},
+        encoding="utf-8-sig",
+        float_precision="round_trip",
+    )
+    return bridges_from_dataframe(df)
 
 
 def find_nearest_point_on_line(line, point):
@@ -48,14 +289,14 @@ def find_nearest_point_on_line(line, point):
     return nearest_geoms[0]
 
 
-def find_way_id_for_point(point, all_lines_with_ids):
-    for line, way_id in all_lines_with_ids:
+def find_way_id_for_point(point, ways):
+    for line, way_id in ways.near(point):
         if line.distance(point) < 1e-6:
             return way_id
     return None
 
 
-def calculate_points_on_way(line, nearest_point, half_distance, all_lines_with_ids):
+def calculate_points_on_way(line, nearest_point, half_distance, ways):
     nearest_distance = line.project(nearest_point)
     forward_distance = nearest_distance + half_distance
     backward_distance = nearest_distance - half_distance
@@ -72,28 +313,26 @@ def calculate_points_on_way(line, nearest_point, half_distance, all_lines_with_i
 
     if forward_point is None:
         forward_point, forward_way_id = extend_along_connected_way(
-            line, forward_distance - line.length, all_lines_with_ids
+            line, forward_distance - line.length, ways
         )
     else:
-        forward_way_id = find_way_id_for_point(forward_point, all_lines_with_ids)
+        forward_way_id = find_way_id_for_point(forward_point, ways)
 
     if backward_point is None:
         backward_point, backward_way_id = extend_along_connected_way(
-            line, -backward_distance, all_lines_with_ids, reverse=True
+            line, -backward_distance, ways, reverse=True
         )
     else:
-        backward_way_id = find_way_id_for_point(backward_point, all_lines_with_ids)
+        backward_way_id = find_way_id_for_point(backward_point, ways)
 
     return forward_point, forward_way_id, backward_point, backward_way_id
 
 
-def extend_along_connected_way(
-    current_line, remaining_distance, all_lines_with_ids, reverse=False
-):
+def extend_along_connected_way(current_line, remaining_distance, ways, reverse=False):
     start_or_end = 0 if reverse else -1
     connection_point = Point(current_line.coords[start_or_end])
 
-    for line, way_id in all_lines_with_ids:
+    for line, way_id in ways.touching(connection_point):
         if line.equals(current_line):
             continue
         if connection_point.equals(Point(line.coords[0])):
@@ -108,7 +347,7 @@ def extend_along_connected_way(
     return connection_point, None
 
 
-def process_single_bridge(bridge, lines_utm_with_ids, project, inverse_project):
+def process_single_bridge(bridge, ways):
     try:
         print(f"{bridge['index']}/6599")
         osm_id = bridge["osm_id"]
@@ -116,12 +355,11 @@ def process_single_bridge(bridge, lines_utm_with_ids, project, inverse_project):
         input_coordinate = bridge["bridge_coordinate"]
         half_distance = bridge_length / 2
 
-        point = Point(input_coordinate)
-        point_utm = transform(project, point)
+        # The bridge coordinate is stored as (lat, long)
+        point = Point(input_coordinate[1], input_coordinate[0])
+        point_utm = transform(utm_transformer.transform, point)
 
-        for line_utm, way_id in lines_utm_with_ids:
-            if way_id != osm_id:
-                continue
+        for line_utm, way_id in ways.with_id(osm_id):
 
             nearest_point_utm = find_nearest_point_on_line(line_utm, point_utm)
             if line_utm.distance(point_utm) < 1:
@@ -131,12 +369,18 @@ def process_single_bridge(bridge, lines_utm_with_ids, project, inverse_project):
                     backward_point_utm,
                     backward_way_id,
                 ) = calculate_points_on_way(
-                    line_utm, nearest_point_utm, half_distance, lines_utm_with_ids
+                    line_utm, nearest_point_utm, half_distance, ways
+                )
+                forward_point = transform(
+                    inverse_utm_transformer.transform, forward_point_utm
+                )
+                backward_point = transform(
+                    inverse_utm_transformer.transform, backward_point_utm
                 )
-                forward_point = transform(inverse_project, forward_point_utm)
-                backward_point = transform(inverse_project, backward_point_utm)
 
                 result = {
+                    "index": bridge["index"],
+                    "bridge_id": bridge["bridge_id"],
                     "original_osm_id": osm_id,
                     "bridge_length": bridge_length,
                     "bridge_coordinate": input_coordinate,
@@ -150,44 +394,321 @@ def process_single_bridge(bridge, lines_utm_with_ids, project, inverse_project):
                     "actual_backward_distance": point_utm.distance(backward_point_utm),
                 }
 
-                # Write the result immediately to the CSV file
-                with open("results_optimized.csv", "a", encoding="utf-8-sig") as rf:
-                    writer = csv.writer(rf)
-                    writer.writerow(
-                        [
-                            result["original_osm_id"],
-                            result["bridge_coordinate"],
-                            result["bridge_length"],
-                            result["forward_point"][1],
-                            result["forward_point"][0],
-                            result["forward_way_id"],
-                            result["backward_point"][1],
-                            result["backward_point"][0],
-                            result["backward_way_id"],
-                        ]
-                    )
-
                 return result
     except Exception as e:
         logging.error(f"Error processing bridge {bridge['osm_id']}: {e}")
     return None
 
 
-def process_bridge_data_parallel(bridge_data, lines_with_ids, project, inverse_project):
-    lines_utm_with_ids = [
-        (transform(project, line), way_id) for way_id, line in lines_with_ids.items()
-    ]
-    pool = Pool(cpu_count())
-    results = pool.starmap(
-        process_single_bridge,
-        [
-            (bridge, lines_utm_with_ids, project, inverse_project)
-            for bridge in bridge_data
-        ],
+def hilbert_key(x, y, order=16):
+    """
+    Position of each coordinate along a Hilbert curve covering their extent
+    """
+    side = 1 << order
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    span = max(np.ptp(x), np.ptp(y)) or 1.0
+    xi = ((x - x.min()) / span * (side - 1)).astype("int64")
+    yi = ((y - y.min()) / span * (side - 1)).astype("int64")
+
+    key = np.zeros(len(xi), dtype="int64")
+    s = side // 2
+    while s > 0:
+        rx = (xi & s) > 0
+        ry = (yi & s) > 0
+        key += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        xi = np.where(flip, s - 1 - xi, xi)
+        yi = np.where(flip, s - 1 - yi, yi)
+        xi, yi = np.where(~ry, yi, xi), np.where(~ry, xi, yi)
+        s //= 2
+    return key
+
+
+def spatial_chunks(bridges, size):
+    """
+    Split bridges into chunks of neighbouring bridges following a Hilbert curve
+    """
+    lat, lon = np.array([bridge["bridge_coordinate"] for bridge in bridges]).T
+    order = np.argsort(hilbert_key(lon, lat), kind="stable")
+    ordered = [bridges[index] for index in order]
+    return [ordered[start : start + size] for start in range(0, len(ordered), size)]
+
+
+def init_worker(store_dir):
+    """
+    Open the way store in a pool worker and build its way indexes
+    """
+    worker_state["ways"] = IndexedWays(WayStore(store_dir), cache_budget_mb * 2**20)
+    # One sampler per worker, written once when the worker exits
+    start_process_profile(f"split-worker-{os.getpid()}")
+
+
+def process_bridge_chunk(chunk):
+    ways = worker_state["ways"]
+    results = [process_single_bridge(bridge, ways) for bridge in chunk]
+    return [result for result in results if result is not None], (
+        os.getpid(),
+        ways.cache.stats(),
+    )
+
+
+def process_bridge_data_parallel(bridge_data, store_dir):
+    if not bridge_data:
+        return []
+    chunks = spatial_chunks(bridge_data, chunk_size)
+    results = []
+    cache_stats = {}
+    with Pool(worker_count, initializer=init_worker, initargs=(store_dir,)) as pool:
+        for chunk_results, (pid, stats) in pool.imap_unordered(
+            process_bridge_chunk, chunks
+        ):
+            results.extend(chunk_results)
+            cache_stats[pid] = stats
+        # Let the workers exit on their own, so their finalizers write their profiles
+        pool.close()
+        pool.join()
+    for pid, stats in sorted(cache_stats.items()):
+        logging.info(f"Way cache in worker {pid}: {stats}")
+    return results
+
+
+def process_bridge_batch(bridges, ways):
+    """
+    Compute split points for a batch of bridges with array-wide shapely calls.
+    Returns the results and the bridges whose split points overflow their way.
+    """
+    if not bridges:
+        return [], []
+
+    osm_ids = np.array([bridge["osm_id"] for bridge in bridges], dtype="int64")
+    lat, lon = np.array([bridge["bridge_coordinate"] for bridge in bridges]).T
+    half_distance = np.array([bridge["bridge_length"] for bridge in bridges]) / 2
+
+    points_utm = shapely.points(*utm_transformer.transform(lon, lat))
+    way_index = ways.store.find_many(osm_ids)
+    lines = np.full(len(bridges), None, dtype=object)
+    for position in np.flatnonzero(way_index >= 0):
+        lines[position] = ways.line(way_index[position])
+
+    on_way = (way_index >= 0) & (shapely.distance(lines, points_utm) < 1)
+    nearest_utm = shapely.get_point(shapely.shortest_line(lines, points_utm), 0)
+    nearest_distance = shapely.line_locate_point(lines, nearest_utm)
+    forward_distance = nearest_distance + half_distance
+    backward_distance = nearest_distance - half_distance
+    fits = (
+        on_way
+        & (forward_distance <= shapely.length(lines))
+        & (backward_distance >= 0)
+    )
+    overflow = on_way & ~fits
+
+    selected = np.flatnonzero(fits)
+    forward_utm = shapely.line_interpolate_point(
+        lines[selected], forward_distance[selected]
+    )
+    backward_utm = shapely.line_interpolate_point(
+        lines[selected], backward_distance[selected]
+    )
+    forward_way_ids = ways.first_way_ids_at(forward_utm)
+    backward_way_ids = ways.first_way_ids_at(backward_utm)
+
+    forward_lon, forward_lat = inverse_utm_transformer.transform(
+        shapely.get_x(forward_utm), shapely.get_y(forward_utm)
+    )
+    backward_lon, backward_lat = inverse_utm_transformer.transform(
+        shapely.get_x(backward_utm), shapely.get_y(backward_utm)
+    )
+    forward_lengths = shapely.distance(points_utm[selected], forward_utm)
+    backward_lengths = shapely.distance(points_utm[selected], backward_utm)
+
+    results = []
+    for position, bridge_index in enumerate(selected):
+        bridge = bridges[bridge_index]
+        osm_id = bridge["osm_id"]
+        results.append(
+            {
+                "index": bridge["index"],
+                "bridge_id": bridge["bridge_id"],
+                "original_osm_id": osm_id,
+                "bridge_length": bridge["bridge_length"],
+                "bridge_coordinate": bridge["bridge_coordinate"],
+                "input_coordinate": bridge["bridge_coordinate"],
+                "nearest_point": (
+                    shapely.get_x(nearest_utm[bridge_index]),
+                    shapely.get_y(nearest_utm[bridge_index]),
+                ),
+                "forward_point": (forward_lon[position], forward_lat[position]),
+                "backward_point": (backward_lon[position], backward_lat[position]),
+                "forward_way_id": int(forward_way_ids[position])
+                if forward_way_ids[position] != -1
+                else osm_id,
+                "backward_way_id": int(backward_way_ids[position])
+                if backward_way_ids[position] != -1
+                else osm_id,
+                "actual_forward_distance": forward_lengths[position],
+                "actual_backward_distance": backward_lengths[position],
+            }
+        )
+
+    overflow_bridges = [bridges[bridge_index] for bridge_index in np.flatnonzero(overflow)]
+    return results, overflow_bridges
+
+
+def process_bridge_data_batched(bridge_data, store_dir):
+    ways = IndexedWays(WayStore(store_dir), cache_budget_mb * 2**20)
+
+    results, overflow_bridges = process_bridge_batch(bridge_data, ways)
+    print(
+        f"{len(results)} bridges split in batch, {len(overflow_bridges)} overflow their way......!"
     )
-    pool.close()
-    pool.join()
-    return [result for result in results if result is not None]
+    logging.info(f"Way cache in batch: {ways.cache.stats()}")
+
+    # Bridges running past the end of their way continue along a connected way
+    if overflow_bridges:
+        results += process_bridge_data_parallel(overflow_bridges, store_dir)
+    return results
+
+
+def tile_keys(tile_x, tile_y):
+    """
+    Single int64 key for each (x, y) tile index
+    """
+    return (np.asarray(tile_x, dtype="int64") << 32) + (
+        np.asarray(tile_y, dtype="int64") + (1 << 31)
+    )
+
+
+def halo_degrees(bridge_data):
+    """
+    Halo around each tile covering the longest bridge, in degrees of longitude
+    at the northernmost bridge (the widest degree-to-metre ratio)
+    """
+    max_half_length = max(bridge["bridge_length"] for bridge in bridge_data) / 2
+    max_lat = max(abs(bridge["bridge_coordinate"][0]) for bridge in bridge_data)
+    metres_per_degree = 111320 * np.cos(np.radians(max_lat))
+    return (max_half_length + halo_margin_m) / metres_per_degree
+
+
+def assign_ways_to_tiles(store, bridge_tiles, halo_deg, block_size=1000000):
+    """
+    Map each tile holding bridges to the store indexes of the ways whose bounds,
+    grown by the halo, reach the tile. Bounds are scanned block by block.
+    """
+    tile_parts = []
+    way_parts = []
+    for start in range(0, len(store), block_size):
+        bounds = np.asarray(store.bounds[start : start + block_size])
+        x0 = np.floor((bounds[:, 0] - halo_deg) / tile_size_deg).astype("int64")
+        y0 = np.floor((bounds[:, 1] - halo_deg) / tile_size_deg).astype("int64")
+        x1 = np.floor((bounds[:, 2] + halo_deg) / tile_size_deg).astype("int64")
+        y1 = np.floor((bounds[:, 3] + halo_deg) / tile_size_deg).astype("int64")
+
+        # Most ways reach a single tile; the others are expanded one by one
+        single = (x0 == x1) & (y0 == y1)
+        keys = tile_keys(x0[single], y0[single])
+        indexes = np.flatnonzero(single) + start
+        keep = np.isin(keys, bridge_tiles)
+        tile_parts.append(keys[keep])
+        way_parts.append(indexes[keep])
+
+        for position in np.flatnonzero(~single):
+            tile_x, tile_y = np.meshgrid(
+                np.arange(x0[position], x1[position] + 1),
+                np.arange(y0[position], y1[position] + 1),
+            )
+            keys = tile_keys(tile_x.ravel(), tile_y.ravel())
+            keys = keys[np.isin(keys, bridge_tiles)]
+            tile_parts.append(keys)
+            way_parts.append(np.full(len(keys), position + start, dtype="int64"))
+
+    keys = np.concatenate(tile_parts)
+    indexes = np.concatenate(way_parts)
+    order = np.lexsort((indexes, keys))
+    keys, indexes = keys[order], indexes[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    return dict(zip(unique_keys.tolist(), np.split(indexes, starts[1:])))
+
+
+def process_bridge_data_streaming(bridge_data, store_dir, file_path):
+    store = WayStore(store_dir)
+    lat, lon = np.array([bridge["bridge_coordinate"] for bridge in bridge_data]).T
+    bridge_tile_keys = tile_keys(
+        np.floor(lon / tile_size_deg), np.floor(lat / tile_size_deg)
+    )
+    bridge_tiles = np.unique(bridge_tile_keys)
+    tile_ways = assign_ways_to_tiles(store, bridge_tiles, halo_degrees(bridge_data))
+
+    result_count = 0
+    for tile_number, tile in enumerate(bridge_tiles.tolist(), start=1):
+        tile_bridges = [
+            bridge_data[index] for index in np.flatnonzero(bridge_tile_keys == tile)
+        ]
+        ways = IndexedWays(
+            store,
+            cache_budget_mb * 2**20,
+            tile_ways.get(tile, np.array([], dtype="int64")),
+        )
+
+        results, overflow_bridges = process_bridge_batch(tile_bridges, ways)
+        for bridge in overflow_bridges:
+            result = process_single_bridge(bridge, ways)
+            if result is not None:
+                results.append(result)
+
+        write_results(results, file_path)
+        result_count += len(results)
+        print(
+            f"Tile {tile_number}/{len(bridge_tiles)}: {len(tile_bridges)} bridges, "
+            f"{len(ways.way_indexes)} ways, {len(results)} results......!"
+        )
+
+        # Release the tile before loading the next one
+        del ways, results
+
+    return result_count
+
+
+def result_rows(results):
+    """
+    Output rows of the split results in input order, matching split_coords_header
+    """
+    return [
+        [
+            result["bridge_id"],
+            result["original_osm_id"],
+            result["bridge_coordinate"],
+            result["bridge_length"],
+            result["forward_point"][1],
+            result["forward_point"][0],
+            result["forward_way_id"],
+            result["backward_point"][1],
+            result["backward_point"][0],
+            result["backward_way_id"],
+        ]
+        for result in sorted(results, key=lambda result: result["index"])
+    ]
+
+
+def write_results(results, file_path):
+    with open(file_path, "a", encoding="utf-8", newline="") as rf:
+        writer = csv.writer(rf)
+        writer.writerows(result_rows(results))
+
+
+def compute_split_points(associations_df, store_dir=way_store_dir):
+    """
+    Split points of the bridge associations held in a DataFrame, returned as a
+    DataFrame with the columns of split_coords_csv. Streaming mode writes tile
+    by tile and only applies to main().
+    """
+    bridge_data = bridges_from_dataframe(associations_df)
+    if batched_mode:
+        results = process_bridge_data_batched(bridge_data, store_dir)
+    else:
+        results = process_bridge_data_parallel(bridge_data, store_dir)
+    return pd.DataFrame(result_rows(results), columns=split_coords_header)
 
 
 def main():
@@ -195,12 +716,11 @@ def main():
     logging.info("Starting processing...")
 
     try:
-        # Load the GeoJSON file
-        geojson_file_path = (
-            "kentucky-filtered-highways.geojson"
-        )
-        geojson_data = load_geojson(geojson_file_path)
-        print("Reading OSM data completed......!")
+        if not os.path.exists(os.path.join(way_store_dir, "meta.json")):
+            logging.error(
+                f"Way store {way_store_dir} not found, run 05-build-way-geometry-store.py first"
+            )
+            return
 
         # Load the CSV file containing bridge data
         csv_file_path = (
@@ -209,44 +729,22 @@ def main():
         bridge_data = load_csv(csv_file_path)
         print("Reading bridge data completed......!")
 
-        lines_with_ids = {
-            feature["properties"]["osm_id"]: LineString(
-                feature["geometry"]["coordinates"]
-            )
-            for feature in geojson_data["features"]
-        }
-        print("Consolidated lines with IDs......!")
-        # Define projection transformations
-        wgs84 = pyproj.CRS("EPSG:4326")
-        utm_zone = pyproj.CRS("EPSG:32616")  # UTM zone for your input coordinates
-        project = pyproj.Transformer.from_crs(wgs84, utm_zone, always_xy=True).transform
-        inverse_project = pyproj.Transformer.from_crs(
-            utm_zone, wgs84, always_xy=True
-        ).transform
-
         # Initialize the results CSV file with headers
-        with open(
-            "output-data/csv-files/bridge-osm-association-with-split-coords.csv", "w", encoding="utf-8-sig"
-        ) as rf:
+        with open(split_coords_csv, "w", encoding="utf-8-sig", newline="") as rf:
             writer = csv.writer(rf)
-            writer.writerow(
-                [
-                    "osm_id",
-                    "bridge_coordinate",
-                    "bridge_length",
-                    "first_split_point_lat",
-                    "first_split_point_lon",
-                    "osm_id_for_first_split_point",
-                    "second_split_point_lat",
-                    "second_split_point_lon",
-                    "osm_id_for_second_split_point",
-                ]
-            )
+            writer.writerow(split_coords_header)
 
-        # Process each bridge entry in parallel
-        process_bridge_data_parallel(
-            bridge_data, lines_with_ids, project, inverse_project
-        )
+        if streaming_mode:
+            process_bridge_data_streaming(bridge_data, way_store_dir, split_coords_csv)
+        else:
+            if batched_mode:
+                results = process_bridge_data_batched(bridge_data, way_store_dir)
+            else:
+                # Process each bridge entry in parallel
+                results = process_bridge_data_parallel(bridge_data, way_store_dir)
+
+            write_results(results, split_coords_csv)
+        print(f"Output file: {split_coords_csv} has been created successfully!")
 
         logging.info("Processing completed successfully.")
     except Exception as e:
@@ -254,4 +752,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with stage_profile("obtain-bridge-split-info"):
+        main()
@@ -2,15 +2,19 @@ import * as console from "josm/scriptingconsole";
 
 const LatLon = Java.type("org.openstreetmap.josm.data.coor.LatLon");
 const Node = Java.type("org.openstreetmap.josm.data.osm.Node");
-const Way = Java.type("org.openstreetmap.josm.data.osm.Way");
 const MainApplication = Java.type("org.openstreetmap.josm.gui.MainApplication");
-const SplitWayAction = Java.type("org.openstreetmap.josm.actions.SplitWayAction");
 const AddCommand = Java.type("org.openstreetmap.josm.command.AddCommand");
-const ChangeCommand = Java.type("org.openstreetmap.josm.command.ChangeCommand");
+const ChangePropertyCommand = Java.type("org.openstreetmap.josm.command.ChangePropertyCommand");
+const SequenceCommand = Java.type("org.openstreetmap.josm.command.SequenceCommand");
+const SplitWayCommand = Java.type("org.openstreetmap.josm.command.SplitWayCommand");
 const Geometry = Java.type("org.openstreetmap.josm.tools.Geometry");
 const ProjectionRegistry = Java.type("org.openstreetmap.josm.data.projection.ProjectionRegistry");
 const UndoRedoHandler = Java.type("org.openstreetmap.josm.data.UndoRedoHandler");
 const OsmPrimitiveType = Java.type("org.openstreetmap.josm.data.osm.OsmPrimitiveType");
+const ArrayList = Java.type("java.util.ArrayList");
+const Collections = Java.type("java.util.Collections");
+const Files = Java.type("java.nio.file.Files");
+const Paths = Java.type("java.nio.file.Paths");
 
 console.clear();
 
@@ -18,12 +22,19 @@ console.clear();
 const BRIDGE_TAG = "bridge";
 const BRIDGE_VALUE = "yes";
 
-// Improved coordinate list structure
+// Coordinate sets written by 04-export-multi-way-bridges.py
+const COORDINATES_FILE = "output-data/json-files/Multi-Way-Bridges.json";
+
+// Number of bridges grouped into one undo step
+const BATCH_SIZE = 100;
+
+// Coordinate list used when COORDINATES_FILE is not found
 const coordinatesList = [
   {
+    bridgeId: "example",
     points: [
-      { latitude: 37.9340811, longitude: -87.5476108, wayId: 17561921 },
-      { latitude: 37.9363173, longitude: -87.5462384, wayId: 97759371 },
+      { latitude: 37.9340811, longitude: -87.5476108, wayId: 17561921, bridgeSide: "after" },
+      { latitude: 37.9363173, longitude: -87.5462384, wayId: 97759371, bridgeSide: "before" },
     ],
     additionalBridgeWayIds: [17563421]
   }
@@ -33,129 +44,180 @@ function getDataSet() {
   return MainApplication.getLayerManager().getEditDataSet();
 }
 
-function addNodeToWay(way, latLon, isFirstPoint, preExistingNodeId) {
-  const dataSet = getDataSet();
+function loadCoordinatesList() {
+  const path = Paths.get(COORDINATES_FILE);
+  if (!Files.exists(path)) {
+    console.println(`${COORDINATES_FILE} not found, using the inline coordinate list.`);
+    return coordinatesList;
+  }
+  return JSON.parse(String(Files.readString(path))).coordinateSets;
+}
+
+function findClosestSegment(way, latLon) {
+  // Compare squared distances in projected coordinates, using the cached east/north of each node
   const projection = ProjectionRegistry.getProjection();
+  const target = projection.latlon2eastNorth(latLon);
   const wayNodes = way.getNodes();
   let closestIndex = -1;
   let closestDistance = Infinity;
-  let closestLatLon = latLon;
+  let closestPoint = null;
 
+  let segmentStart = wayNodes.get(0).getEastNorth();
   for (let i = 0; i < wayNodes.size() - 1; i++) {
-    const segmentStart = projection.latlon2eastNorth(wayNodes.get(i).getCoor());
-    const segmentEnd = projection.latlon2eastNorth(wayNodes.get(i + 1).getCoor());
-    const point = Geometry.closestPointToSegment(
-      segmentStart,
-      segmentEnd,
-      projection.latlon2eastNorth(latLon)
-    );
-    const pointLatLon = projection.eastNorth2latlon(point);
-    const distance = latLon.greatCircleDistance(pointLatLon);
+    const segmentEnd = wayNodes.get(i + 1).getEastNorth();
+    const point = Geometry.closestPointToSegment(segmentStart, segmentEnd, target);
+    const distance = point.distanceSq(target);
     if (distance < closestDistance) {
       closestDistance = distance;
       closestIndex = i;
-      closestLatLon = pointLatLon;
+      closestPoint = point;
     }
+    segmentStart = segmentEnd;
   }
 
-  if (closestIndex !== -1) {
-    const closestNode = new Node(closestLatLon);
-    const newWayNodes = new java.util.ArrayList(wayNodes);
-    newWayNodes.add(closestIndex + 1, closestNode);
-
-    const newWay = new Way(way);
-    newWay.setNodes(newWayNodes);
-
-    UndoRedoHandler.getInstance().add(new AddCommand(dataSet, closestNode));
-    UndoRedoHandler.getInstance().add(new ChangeCommand(way, newWay));
-
-    dataSet.setSelected(closestNode);
-    SplitWayAction.runOn(dataSet);
-
-    console.println(`Node added at latitude: ${latLon.lat()}, longitude: ${latLon.lon()} and Node ID: ${closestNode.getId()}`);
+  if (closestIndex === -1) {
+    return null;
+  }
+  return { index: closestIndex, latLon: projection.eastNorth2latlon(closestPoint) };
+}
 
-    // Tag the appropriate way as a bridge
-    const selectedWays = dataSet.getSelectedWays();
-    for (const selectedWay of selectedWays) {
-      const selectedWayNodes = selectedWay.getNodes();
-      let isBridgeWay = false;
+function executeCommand(command, executedCommands) {
+  if (!command.executeCommand()) {
+    throw new Error(`Command failed: ${command.getDescriptionText()}`);
+  }
+  executedCommands.add(command);
+}
 
-      if (isFirstPoint) {
-        isBridgeWay = selectedWayNodes.get(0).getId() === closestNode.getId() &&
-                      selectedWayNodes.get(selectedWayNodes.size() - 1).getId() === preExistingNodeId;
-      } else {
-        isBridgeWay = selectedWayNodes.get(0).getId() === preExistingNodeId &&
-                      selectedWayNodes.get(selectedWayNodes.size() - 1).getId() === closestNode.getId();
-      }
+// bridgeSide is "after" when the bridge continues from the split point towards the end of
+// the way, and "before" when it lies between the start of the way and the split point
+function splitWayAtPoint(dataSet, way, latLon, bridgeSide, executedCommands) {
+  const segment = findClosestSegment(way, latLon);
+  if (!segment) {
+    throw new Error(`Failed to find a suitable segment of way ${way.getId()} to insert the node.`);
+  }
 
-      if (isBridgeWay) {
-        selectedWay.put(BRIDGE_TAG, BRIDGE_VALUE);
-        UndoRedoHandler.getInstance().add(new ChangeCommand(selectedWay, selectedWay));
-        console.println(`Bridge way ${selectedWay.getId()} tagged successfully.`);
-        break;
-      }
-    }
+  const closestNode = new Node(segment.latLon);
+  const wayNodes = way.getNodes();
+  const firstChunk = new ArrayList(wayNodes.subList(0, segment.index + 1));
+  firstChunk.add(closestNode);
+  const secondChunk = new ArrayList();
+  secondChunk.add(closestNode);
+  secondChunk.addAll(wayNodes.subList(segment.index + 1, wayNodes.size()));
+  const wayChunks = new ArrayList();
+  wayChunks.add(firstChunk);
+  wayChunks.add(secondChunk);
+
+  // The original way keeps the first chunk, so the bridge chunk is known without a selection
+  const splitCommand = SplitWayCommand.splitWay(
+    way,
+    wayChunks,
+    Collections.emptyList(),
+    SplitWayCommand.Strategy.keepFirstChunk()
+  );
+  if (!splitCommand) {
+    throw new Error(`Way ${way.getId()} could not be split.`);
+  }
 
-    return closestNode;
+  executeCommand(new AddCommand(dataSet, closestNode), executedCommands);
+  if (bridgeSide === "after") {
+    // The new way is not in the data set yet, so it is tagged before being added
+    splitCommand.getNewWays().get(0).put(BRIDGE_TAG, BRIDGE_VALUE);
+    executeCommand(splitCommand, executedCommands);
   } else {
-    console.println("Failed to find a suitable segment to insert the node.");
-    return null;
+    executeCommand(splitCommand, executedCommands);
+    executeCommand(
+      new ChangePropertyCommand(dataSet, Collections.singleton(way), BRIDGE_TAG, BRIDGE_VALUE),
+      executedCommands
+    );
   }
 }
 
-function tagAdditionalBridgeWays(additionalBridgeWayIds) {
-  const dataSet = getDataSet();
+function tagAdditionalBridgeWays(dataSet, additionalBridgeWayIds, executedCommands) {
+  const ways = new ArrayList();
   for (const wayId of additionalBridgeWayIds) {
     const way = dataSet.getPrimitiveById(wayId, OsmPrimitiveType.WAY);
     if (way) {
-      way.put(BRIDGE_TAG, BRIDGE_VALUE);
-      UndoRedoHandler.getInstance().add(new ChangeCommand(way, way));
-      console.println(`Additional bridge way ${wayId} tagged successfully.`);
+      ways.add(way);
     } else {
       console.println(`Additional bridge way ${wayId} not found.`);
     }
   }
-}
-
-function processCoordinateSet(coordinateSet) {
-  const dataSet = getDataSet();
-  if (!dataSet) {
-    console.println("No active data set found.");
-    return;
+  if (!ways.isEmpty()) {
+    executeCommand(new ChangePropertyCommand(dataSet, ways, BRIDGE_TAG, BRIDGE_VALUE), executedCommands);
   }
+}
 
+function processCoordinateSet(dataSet, coordinateSet) {
   const { points, additionalBridgeWayIds } = coordinateSet;
+  const executedCommands = new ArrayList();
+
+  try {
+    for (let i = 0; i < points.length; i++) {
+      const point = points[i];
+      const way = dataSet.getPrimitiveById(point.wayId, OsmPrimitiveType.WAY);
+      if (!way) {
+        throw new Error(`Way ${point.wayId} not found for point ${i}`);
+      }
+      // Which part of the way carries the bridge depends on the direction of the way,
+      // so it is given per point by 04-export-multi-way-bridges.py
+      if (point.bridgeSide !== "after" && point.bridgeSide !== "before") {
+        throw new Error(`Point ${i} has no bridgeSide`);
+      }
+      splitWayAtPoint(dataSet, way, new LatLon(point.latitude, point.longitude), point.bridgeSide, executedCommands);
+    }
+    tagAdditionalBridgeWays(dataSet, additionalBridgeWayIds || [], executedCommands);
+  } catch (error) {
+    for (let i = executedCommands.size() - 1; i >= 0; i--) {
+      executedCommands.get(i).undoCommand();
+    }
+    console.println(`Bridge ${coordinateSet.bridgeId} skipped: ${error.message}`);
+    return null;
+  }
 
-  for (let i = 0; i < points.length - 1; i++) {
-    const currentPoint = points[i];
-    const nextPoint = points[i + 1];
-
-    const currentWay = dataSet.getPrimitiveById(currentPoint.wayId, OsmPrimitiveType.WAY);
-    const nextWay = dataSet.getPrimitiveById(nextPoint.wayId, OsmPrimitiveType.WAY);
+  return new SequenceCommand(`Add bridge ${coordinateSet.bridgeId}`, executedCommands);
+}
 
-    if (!currentWay || !nextWay) {
-      console.println(`Way not found for point ${i} or ${i + 1}`);
-      continue;
-    }
+function processBatch(dataSet, batch, batchStart) {
+  const bridgeCommands = new ArrayList();
 
-    const isFirstPoint = i === 0;
-    const currentNode = addNodeToWay(currentWay, new LatLon(currentPoint.latitude, currentPoint.longitude), isFirstPoint, currentWay.getNodes().get(currentWay.getNodes().size() - 1).getId());
-    
-    if (i === points.length - 2) {
-      addNodeToWay(nextWay, new LatLon(nextPoint.latitude, nextPoint.longitude), false, nextWay.getNodes().get(0).getId());
+  // Hold back data set events until the whole batch has been applied
+  dataSet.beginUpdate();
+  try {
+    for (const coordinateSet of batch) {
+      const bridgeCommand = processCoordinateSet(dataSet, coordinateSet);
+      if (bridgeCommand) {
+        bridgeCommands.add(bridgeCommand);
+      }
     }
+  } finally {
+    dataSet.endUpdate();
   }
 
-  tagAdditionalBridgeWays(additionalBridgeWayIds);
-
-  MainApplication.getMap().mapView.repaint();
+  // The commands have already been executed, so they are only recorded as one undo step
+  if (!bridgeCommands.isEmpty()) {
+    UndoRedoHandler.getInstance().add(
+      new SequenceCommand(`Add bridges ${batchStart + 1}-${batchStart + batch.length}`, bridgeCommands),
+      false
+    );
+  }
+  return bridgeCommands.size();
 }
 
 // Main execution
 try {
-  for (const coordinateSet of coordinatesList) {
-    processCoordinateSet(coordinateSet);
+  const dataSet = getDataSet();
+  if (!dataSet) {
+    console.println("No active data set found.");
+  } else {
+    const coordinateSets = loadCoordinatesList();
+    let addedCount = 0;
+    for (let batchStart = 0; batchStart < coordinateSets.length; batchStart += BATCH_SIZE) {
+      const batch = coordinateSets.slice(batchStart, batchStart + BATCH_SIZE);
+      addedCount += processBatch(dataSet, batch, batchStart);
+    }
+    console.println(`${addedCount} of ${coordinateSets.length} bridges added.`);
+    MainApplication.getMap().mapView.repaint();
   }
 } catch (error) {
   console.println(`An error occurred: ${error.message}`);
-}
\ No newline at end of file
+}
@@ -0,0 +1,191 @@
+import importlib.util
+import json
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+import osmium
+import pandas as pd
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import choose_location_index, remove_location_index
+
+# Split points of every bridge, and the filtered ways they are routed over
+split_coords_csv = "output-data/csv-files/bridge-osm-association-with-split-coords.csv"
+osm_file = "output-data/pbf-files/kentucky-filtered-highways.osm.pbf"
+
+# Coordinate sets read by 03-JOSM-1-handle-multi-way-bridge.js
+output_json = "output-data/json-files/Multi-Way-Bridges.json"
+
+
+def load_shortest_route_script():
+    """
+    Function to import the shortest route helpers of 02-shortest-route-between-two-ways.py
+    """
+    spec = importlib.util.spec_from_file_location(
+        "shortest_route",
+        os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "02-shortest-route-between-two-ways.py",
+        ),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class WayLocationHandler(osmium.SimpleHandler):
+    """
+    Node ids and node locations of every way, in way order
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ways = {}
+        self.locations = {}
+
+    def way(self, w):
+        self.ways[w.id] = [n.ref for n in w.nodes]
+        self.locations[w.id] = [(n.lon, n.lat) for n in w.nodes]
+
+
+def load_multi_way_bridges(csv_path):
+    """
+    Function to select the bridges whose split points lie on two different ways
+    """
+    df = pd.read_csv(
+        csv_path,
+        dtype={"STRUCTURE_NUMBER_008": str},
+        encoding="utf-8-sig",
+        float_precision="round_trip",
+    )
+    return df[
+        df["osm_id_for_first_split_point"] != df["osm_id_for_second_split_point"]
+    ].reset_index(drop=True)
+
+
+def route_between_ways(graph, ways, first_way_id, second_way_id):
+    """
+    Function to find the node route with the fewest edges from any node of the first way to
+    any node of the second. It starts where the bridge leaves the first way and ends where
+    it enters the second.
+    """
+    targets = set(ways[second_way_id])
+    parents = {node: None for node in ways[first_way_id]}
+    frontier = list(parents)
+    while frontier:
+        next_frontier = []
+        for node in frontier:
+            if node in targets:
+                route = []
+                while node is not None:
+                    route.append(node)
+                    node = parents[node]
+                return route[::-1]
+            for neighbor in graph.adj.get(node, {}):
+                if neighbor not in parents:
+                    parents[neighbor] = node
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    raise nx.NetworkXNoPath(f"No route between ways {first_way_id} and {second_way_id}")
+
+
+def bridge_side(way_nodes, way_locations, point, junction_node):
+    """
+    Function to tell whether the bridge part of a way lies "after" or "before" its split
+    point, in the direction of the way: it is the part towards the junction node shared
+    with the next way of the bridge route
+    """
+    coords = np.asarray(way_locations, dtype="float64")
+    lengths = np.concatenate(
+        [[0.0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))]
+    )
+    along_junction = lengths[way_nodes.index(junction_node)]
+    along_point = shapely.line_locate_point(
+        shapely.LineString(coords), shapely.Point(point)
+    )
+    return "after" if along_point < along_junction else "before"
+
+
+def build_coordinate_sets(bridges, graph, ways, locations):
+    """
+    Function to build the JOSM coordinate set of every bridge spanning several ways, with
+    the side of each split point on which its way carries the bridge
+    """
+    coordinate_sets = []
+    unrouted = []
+    for bridge in bridges.itertuples(index=False):
+        first_way_id = int(bridge.osm_id_for_first_split_point)
+        second_way_id = int(bridge.osm_id_for_second_split_point)
+        try:
+            route = route_between_ways(graph, ways, first_way_id, second_way_id)
+        except (KeyError, nx.NetworkXNoPath):
+            unrouted.append(bridge.STRUCTURE_NUMBER_008)
+            continue
+
+        additional_way_ids = []
+        for start, end in zip(route[:-1], route[1:]):
+            way_id = graph.edges[start, end]["way_id"]
+            if way_id not in (first_way_id, second_way_id, *additional_way_ids):
+                additional_way_ids.append(way_id)
+
+        # The route leaves the first way at its first node and enters the second at its last
+        points = []
+        for split_point, way_id, junction_node in [
+            ("first", first_way_id, route[0]),
+            ("second", second_way_id, route[-1]),
+        ]:
+            lat = getattr(bridge, f"{split_point}_split_point_lat")
+            lon = getattr(bridge, f"{split_point}_split_point_lon")
+            points.append(
+                {
+                    "latitude": lat,
+                    "longitude": lon,
+                    "wayId": way_id,
+                    "bridgeSide": bridge_side(
+                        ways[way_id], locations[way_id], (lon, lat), junction_node
+                    ),
+                }
+            )
+
+        coordinate_sets.append(
+            {
+                "bridgeId": bridge.STRUCTURE_NUMBER_008,
+                "points": points,
+                "additionalBridgeWayIds": additional_way_ids,
+            }
+        )
+    return coordinate_sets, unrouted
+
+
+def main():
+    shortest_route = load_shortest_route_script()
+
+    bridges = load_multi_way_bridges(split_coords_csv)
+    print(f"{len(bridges)} bridges span more than one way......!")
+
+    handler = WayLocationHandler()
+    index_type = choose_location_index(osm_file)
+    try:
+        handler.apply_file(osm_file, locations=True, idx=index_type)
+    finally:
+        remove_location_index(index_type)
+    graph = shortest_route.build_graph(handler.ways)
+
+    coordinate_sets, unrouted = build_coordinate_sets(
+        bridges, graph, handler.ways, handler.locations
+    )
+    if unrouted:
+        print(f"No route between the split ways of {len(unrouted)} bridges: {unrouted}")
+
+    os.makedirs(os.path.dirname(output_json), exist_ok=True)
+    with open(output_json, "w") as f:
+        json.dump({"coordinateSets": coordinate_sets}, f, indent=2)
+    print(f"Output file: {output_json} has been created successfully!")
+
+
+if __name__ == "__main__":
+    main()
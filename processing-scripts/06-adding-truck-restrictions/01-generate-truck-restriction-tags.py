@@ -0,0 +1,308 @@
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import osmium
+import pandas as pd
+import pyproj
+import shapely
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_helpers import choose_location_index, remove_location_index
+
+# NBI bridge data and the final OSM way of every associated bridge
+nbi_csv = "input-data/Kentucky-NBI-bridge-data.csv"
+associations_csv = "output-data/csv-files/bridge-osm-association-with-lengths.csv"
+
+# Filtered highways the phase one edits started from, holding the final OSM ways as they
+# were before the JOSM scripts split them
+original_osm_pbf = "output-data/pbf-files/kentucky-filtered-highways.osm.pbf"
+
+# OSM extract taken after the phase one edits were uploaded, so the bridge ways are tagged
+osm_snapshot_pbf = "input-data/Kentucky-Latest.osm.pbf"
+
+restriction_tags_csv = "output-data/csv-files/Bridge-Truck-Restriction-Tags.csv"
+output_osc = "output-data/osc-files/Kentucky-Truck-Restrictions.osc"
+
+# Posting status codes (item 41) of bridges posted for load, and of closed bridges
+posted_codes = ["P", "R"]
+closed_codes = ["K"]
+
+# Clearances (item 10) at or above this height are not restrictions; 99.99 means unlimited
+max_tagged_clearance_m = 5.0
+
+# Bridges posted below this weight cannot carry heavy goods vehicles at all
+hgv_weight_limit_t = 3.5
+
+# Keep maxweight/maxheight/hgv values already mapped on a way
+overwrite_existing = False
+
+# Metric CRS used to match the bridges to the bridge ways of the snapshot
+metric_crs = "EPSG:32616"
+
+# A snapshot way was split from the final OSM way when all its nodes lie this close to it
+derived_tolerance_m = 1.0
+
+# Largest distance between a bridge point and the bridge way it is matched to
+max_match_distance_m = 10.0
+
+
+def floor_to_tenth(values):
+    """
+    Function to round values down to one decimal, so a tagged limit never exceeds the rating
+    """
+    return np.floor(values * 10 + 1e-9) / 10
+
+
+def format_limit(values):
+    """
+    Function to format limits as OSM values, dropping a trailing ".0"
+    """
+    return values.map(lambda value: f"{value:g}", na_action="ignore")
+
+
+def derive_restriction_tags(nbi_df):
+    """
+    Function to derive the maxweight, maxheight and hgv limits of every bridge from its NBI ratings
+    """
+    status = nbi_df["OPEN_CLOSED_POSTED_041"].astype(str).str.strip()
+    operating = pd.to_numeric(nbi_df["OPERATING_RATING_064"], errors="coerce")
+    inventory = pd.to_numeric(nbi_df["INVENTORY_RATING_066"], errors="coerce")
+    clearance = pd.to_numeric(nbi_df["MIN_VERT_CLR_010"], errors="coerce")
+
+    # Posted bridges are limited to their operating rating, or their inventory rating without one
+    rating = operating.where(operating > 0, inventory)
+    maxweight = floor_to_tenth(rating.where(status.isin(posted_codes) & (rating > 0)))
+
+    maxheight = floor_to_tenth(
+        clearance.where((clearance > 0) & (clearance < max_tagged_clearance_m))
+    )
+
+    no_hgv = status.isin(closed_codes) | (maxweight < hgv_weight_limit_t)
+
+    return pd.DataFrame(
+        {
+            "STRUCTURE_NUMBER_008": nbi_df["STRUCTURE_NUMBER_008"].astype(str),
+            "maxweight": maxweight,
+            "maxheight": maxheight,
+            "no_hgv": no_hgv,
+        }
+    )
+
+
+class WayGeometryHandler(osmium.SimpleHandler):
+    """
+    Version, node ids, tags and node locations of the ways selected by keep(way)
+    """
+
+    def __init__(self, keep):
+        super().__init__()
+        self.keep = keep
+        self.ways = {}
+
+    def way(self, w):
+        if not self.keep(w):
+            return
+        try:
+            coords = [(n.lon, n.lat) for n in w.nodes]
+        except osmium.InvalidLocationError:
+            return
+        self.ways[w.id] = {
+            "version": w.version,
+            "nodes": [n.ref for n in w.nodes],
+            "tags": dict(w.tags),
+            "coords": coords,
+        }
+
+
+def read_ways(pbf_path, keep):
+    """
+    Function to read the ways of an OSM file selected by keep(way), with their node locations
+    """
+    handler = WayGeometryHandler(keep)
+    index_type = choose_location_index(pbf_path)
+    try:
+        handler.apply_file(pbf_path, locations=True, idx=index_type)
+    finally:
+        remove_location_index(index_type)
+    return handler.ways
+
+
+def metric_lines(ways, transformer):
+    """
+    Function to build the metric line of every way, in the order of the ways
+    """
+    lines = []
+    for way in ways.values():
+        lons, lats = zip(*way["coords"])
+        lines.append(shapely.LineString(np.column_stack(transformer.transform(lons, lats))))
+    return np.array(lines, dtype=object)
+
+
+def match_bridge_ways(associations_df, original_ways, bridge_ways):
+    """
+    Function to find the bridge way of every bridge in the edited snapshot: the way tagged
+    as a bridge that was split from its final OSM way and contains, or is nearest to, its point
+    """
+    transformer = pyproj.Transformer.from_crs("EPSG:4326", metric_crs, always_xy=True)
+    bridge_way_ids = np.array(list(bridge_ways), dtype="int64")
+    bridge_lines = metric_lines(bridge_ways, transformer)
+    tree = shapely.STRtree(bridge_lines)
+    original_lines = dict(zip(original_ways, metric_lines(original_ways, transformer)))
+
+    associations = associations_df[associations_df["final_osm_id"].notna()]
+    points = shapely.points(
+        np.column_stack(
+            transformer.transform(
+                associations["final_long"].to_numpy(dtype="float64"),
+                associations["final_lat"].to_numpy(dtype="float64"),
+            )
+        )
+    )
+
+    matched_ids = []
+    for final_osm_id, point in zip(associations["final_osm_id"].astype("int64"), points):
+        original = original_lines.get(final_osm_id)
+        if original is None:
+            matched_ids.append(None)
+            continue
+        candidates = tree.query(point, predicate="dwithin", distance=max_match_distance_m)
+        derived = [
+            index
+            for index in candidates
+            if shapely.distance(
+                shapely.points(shapely.get_coordinates(bridge_lines[index])), original
+            ).max()
+            <= derived_tolerance_m
+        ]
+        if not derived:
+            matched_ids.append(None)
+            continue
+        nearest = min(derived, key=lambda index: shapely.distance(point, bridge_lines[index]))
+        matched_ids.append(int(bridge_way_ids[nearest]))
+
+    return pd.DataFrame(
+        {
+            "STRUCTURE_NUMBER_008": associations["STRUCTURE_NUMBER_008"].astype(str).values,
+            "final_osm_id": associations["final_osm_id"].astype("int64").values,
+            "osm_id": pd.array(matched_ids, dtype="Int64"),
+        }
+    )
+
+
+def join_to_ways(restrictions_df, matches_df):
+    """
+    Function to join the limits to the matched bridge ways, keeping the tightest limits of
+    bridges that share a way, and format them as OSM tags
+    """
+    matches = matches_df.loc[
+        matches_df["osm_id"].notna(), ["STRUCTURE_NUMBER_008", "osm_id"]
+    ]
+    joined = matches.merge(restrictions_df, on="STRUCTURE_NUMBER_008", how="inner")
+    joined["osm_id"] = joined["osm_id"].astype("int64")
+
+    way_tags = joined.groupby("osm_id").agg(
+        bridge_ids=("STRUCTURE_NUMBER_008", lambda ids: ";".join(sorted(set(ids)))),
+        maxweight=("maxweight", "min"),
+        maxheight=("maxheight", "min"),
+        no_hgv=("no_hgv", "any"),
+    )
+    way_tags["maxweight"] = format_limit(way_tags["maxweight"])
+    way_tags["maxheight"] = format_limit(way_tags["maxheight"])
+    way_tags["hgv"] = np.where(way_tags["no_hgv"], "no", None)
+    way_tags = way_tags.drop(columns="no_hgv")
+
+    restricted = way_tags[["maxweight", "maxheight", "hgv"]].notna().any(axis=1)
+    return way_tags[restricted].reset_index()
+
+
+def write_osmchange(way_tags_df, bridge_ways, osc_path):
+    """
+    Function to write one osmChange file with a modify action for every restricted bridge
+    way, carrying its snapshot version, nodes and tags with the new limits
+    """
+    root = ET.Element(
+        "osmChange", version="0.6", generator="01-generate-truck-restriction-tags.py"
+    )
+    modify = ET.SubElement(root, "modify")
+    written, unchanged = 0, []
+    for row in way_tags_df.to_dict("records"):
+        way = bridge_ways[row["osm_id"]]
+        tags = dict(way["tags"])
+        for key in ("maxweight", "maxheight", "hgv"):
+            if pd.notna(row[key]) and (overwrite_existing or key not in tags):
+                tags[key] = row[key]
+        if tags == way["tags"]:
+            unchanged.append(row["osm_id"])
+            continue
+
+        element = ET.SubElement(
+            modify, "way", id=str(row["osm_id"]), version=str(way["version"])
+        )
+        for ref in way["nodes"]:
+            ET.SubElement(element, "nd", ref=str(ref))
+        for key, value in tags.items():
+            ET.SubElement(element, "tag", k=key, v=value)
+        written += 1
+
+    os.makedirs(os.path.dirname(osc_path), exist_ok=True)
+    ET.indent(root)
+    ET.ElementTree(root).write(osc_path, encoding="utf-8", xml_declaration=True)
+    return written, unchanged
+
+
+def main():
+    nbi_df = pd.read_csv(
+        nbi_csv,
+        usecols=[
+            "STRUCTURE_NUMBER_008",
+            "OPEN_CLOSED_POSTED_041",
+            "OPERATING_RATING_064",
+            "INVENTORY_RATING_066",
+            "MIN_VERT_CLR_010",
+        ],
+        dtype={"STRUCTURE_NUMBER_008": str},
+        low_memory=False,
+    )
+    associations_df = pd.read_csv(
+        associations_csv, dtype={"STRUCTURE_NUMBER_008": str}
+    )
+    restrictions_df = derive_restriction_tags(nbi_df)
+
+    # Only the bridges with a restriction need a bridge way
+    restricted_ids = restrictions_df.loc[
+        restrictions_df[["maxweight", "maxheight"]].notna().any(axis=1)
+        | restrictions_df["no_hgv"],
+        "STRUCTURE_NUMBER_008",
+    ]
+    associations_df = associations_df[
+        associations_df["STRUCTURE_NUMBER_008"].isin(restricted_ids)
+    ]
+    final_osm_ids = set(associations_df["final_osm_id"].dropna().astype("int64"))
+
+    original_ways = read_ways(original_osm_pbf, lambda w: w.id in final_osm_ids)
+    bridge_ways = read_ways(
+        osm_snapshot_pbf, lambda w: w.tags.get("bridge", "no") != "no"
+    )
+    matches_df = match_bridge_ways(associations_df, original_ways, bridge_ways)
+    matched = matches_df["osm_id"].notna()
+    print(
+        f"{matched.sum()} bridges matched to a bridge way of {osm_snapshot_pbf}, "
+        f"{(~matched).sum()} skipped"
+    )
+    if (~matched).any():
+        print(f"Skipped bridges: {matches_df.loc[~matched, 'STRUCTURE_NUMBER_008'].tolist()}")
+
+    way_tags_df = join_to_ways(restrictions_df, matches_df)
+    way_tags_df.to_csv(restriction_tags_csv, index=False)
+    print(f"Output file: {restriction_tags_csv} has been created successfully!")
+
+    written, unchanged = write_osmchange(way_tags_df, bridge_ways, output_osc)
+    print(f"{written} ways modified, {len(unchanged)} already tagged")
+    print(f"Output file: {output_osc} has been created successfully!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def snapshot_key(file_path):
+    """
+    Function to derive a short cache key identifying a snapshot of an input file
+    """
+    stat = os.stat(file_path)
+    fingerprint = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+def snapshot_matches(snapshot_json, input_paths):
+    """
+    Function to check that the snapshot keys recorded next to an output, as
+    {name: key}, match the current input files given as {name: path}
+    """
+    if not os.path.exists(snapshot_json):
+        return False
+    with open(snapshot_json, "r") as f:
+        snapshot = json.load(f)
+    return all(
+        os.path.exists(path) and snapshot.get(name) == snapshot_key(path)
+        for name, path in input_paths.items()
+    )
+
+
+def extract_hstore_value(other_tags, key):
+    """
+    Function to extract a single key from the OSM 'other_tags' hstore column
+    """
+    return other_tags.fillna("").str.extract(rf'"{key}"=>"([^"]*)"', expand=False)
+
+
+# Highway classes of the ways checked for parallel carriageways
+parallel_highway_types = [
+    "motorway_link", "primary", "primary_link", "trunk", "motorway", "trunk_link"
+]
+
+# Bridge filters of the tagging step as column predicates over the bridge-way candidates
+# of 07-build-bridge-way-candidates.py: reason -> (radius in metres, predicate). They
+# match the buffer joins of the tagging step.
+candidate_filters = {
+    "bridge_tag": (80, lambda df: df["bridge"].notna() | (df["man_made"] == "bridge")),
+    "layer_tag": (30, lambda df: df["layer"] > 0),
+    "parallel": (
+        30,
+        lambda df: df["highway"].isin(parallel_highway_types)
+        & (df["oneway"] == "yes")
+        & df["bridge"].isna(),
+    ),
+}
+
+
+def candidate_exclusions(candidates, reason):
+    """
+    Function to find the bridges with a candidate way within the radius of a filter
+    matching its predicate
+    """
+    radius, matches = candidate_filters[reason]
+    selected = candidates[(candidates["distance_m"] <= radius) & matches(candidates)]
+    return set(selected["STRUCTURE_NUMBER_008"])
+
+
+# Node location index used by the PBF readers: "flex_mem", "sparse_mem_array",
+# "dense_file_array", or "auto" to choose from the size of the extract
+location_index = "auto"
+location_index_file = "output-data/cache/node-locations.dat"
+
+# Extract sizes up to which the in-memory indexes are chosen automatically
+sparse_index_max_bytes = 200 * 2**20
+memory_index_max_bytes = 4 * 2**30
+
+
+def choose_location_index(pbf_path):
+    """
+    Function to pick the pyosmium node location index for an extract, passed as
+    apply_file(..., locations=True, idx=choose_location_index(pbf_path))
+    """
+    if location_index != "auto":
+        index_type = location_index
+    else:
+        size = os.path.getsize(pbf_path)
+        if size <= sparse_index_max_bytes:
+            # Few nodes with scattered ids: store only the nodes that exist
+            index_type = "sparse_mem_array"
+        elif size <= memory_index_max_bytes:
+            # Switches itself from a sparse to a dense array as the extract grows
+            index_type = "flex_mem"
+        else:
+            # Continental extracts: a dense array in a memory-mapped file
+            index_type = "dense_file_array"
+
+    if index_type == "dense_file_array":
+        os.makedirs(os.path.dirname(location_index_file), exist_ok=True)
+        return f"{index_type},{location_index_file}"
+    return index_type
+
+
+def remove_location_index(index_type):
+    """
+    Function to delete the file of a dense_file_array index once the extract is read
+    """
+    if index_type.startswith("dense_file_array") and os.path.exists(location_index_file):
+        os.remove(location_index_file)
+
+
+class BackgroundWriter:
+    """
+    Write finished outputs on background threads so the next step can start. Only data
+    that no other thread touches may be handed over: a DataFrame, or a feature source
+    snapshot of a QGIS layer, never the layer itself.
+    """
+
+    def __init__(self, max_workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def submit(self, write_function, data, output_path, *args, **kwargs):
+        """
+        Queue write_function(data, output_path, *args, **kwargs)
+        """
+        future = self.executor.submit(
+            self._write, write_function, data, output_path, *args, **kwargs
+        )
+        with self.lock:
+            self.pending.append(future)
+        return future
+
+    @staticmethod
+    def _write(write_function, data, output_path, *args, **kwargs):
+        write_function(data, output_path, *args, **kwargs)
+        print(f"\nOutput file: {output_path} has been created successfully!")
+
+    def wait(self):
+        """
+        Block until every queued write is complete, re-raising the first failure
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+
+def load_profiler():
+    """
+    Function to import sampling-profiler.py when PROFILE_STAGES=1 or --profile is set,
+    returning None when profiling is off
+    """
+    if "--profile" in sys.argv[1:]:
+        # Also seen by the pool workers
+        os.environ["PROFILE_STAGES"] = "1"
+    if os.environ.get("PROFILE_STAGES", "0") != "1":
+        return None
+
+    profiler = sys.modules.get("sampling_profiler")
+    if profiler is None:
+        spec = importlib.util.spec_from_file_location(
+            "sampling_profiler",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "sampling-profiler.py"),
+        )
+        profiler = importlib.util.module_from_spec(spec)
+        sys.modules["sampling_profiler"] = profiler
+        spec.loader.exec_module(profiler)
+    return profiler
+
+
+def stage_profile(name, quiet=False):
+    """
+    Function to sample a stage with sampling-profiler.py when profiling is on
+    """
+    profiler = load_profiler()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile_stage(name, quiet)
+
+
+def start_process_profile(name):
+    """
+    Function to sample the calling process until it exits when profiling is on, for
+    pool workers that run many small tasks
+    """
+    profiler = load_profiler()
+    if profiler is not None:
+        profiler.profile_process(name)
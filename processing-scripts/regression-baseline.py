@@ -0,0 +1,400 @@
+import logging
+import math
+
+import pandas as pd
+import pyproj
+from shapely.geometry import LineString, Point
+from shapely.ops import nearest_points, transform
+
+# Frozen copies of the association and split stages as they were before any
+# optimization. run-regression-harness.py uses them as the independent references of
+# those stages, so they must not be changed along with the pipeline scripts.
+
+# Association stage: the pandas equivalent of the Dask join of 01-join-all-data.py,
+# then the row-wise haversine and determine_final_osm_id of 02-determine-final-osm-id.py
+# with the CSV writes removed.
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """
+    Function to calculate Haversine distance among two points
+    """
+    # Radius of the Earth in kilometers
+    R = 6371.0
+
+    # Convert latitude and longitude from degrees to radians
+    lon1 = math.radians(lon1)
+    lat1 = math.radians(lat1)
+    lon2 = math.radians(lon2)
+    lat2 = math.radians(lat2)
+
+    # Compute differences between the coordinates
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    # Haversine formula
+    a = (
+        math.sin(dlat / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    )
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    # Distance in kilometers
+    distance = R * c
+
+    return distance
+
+
+def extract_coordinates(wkt):
+    """
+    Function to extract latitude and longitude from WKT (Well-Known Text) format
+    """
+    if pd.isna(wkt):
+        return None, None
+    # Remove 'POINT (' and ')'
+    coords = wkt.replace("POINT (", "").replace(")", "")
+    # Split the coordinates
+    lon, lat = coords.split()
+    return float(lat), float(lon)
+
+
+def determine_final_osm_id(group):
+    """
+    Function to determine the final_osm_id, final_long, and final_lat for each group
+    """
+    true_stream = group[group["Is_Stream_Identical"]]
+    min_dist = group[group["Is_Min_Dist"]]
+    if group["combo-count"].iloc[0] == 1:
+        # If there is only one unique OSM id
+        osm_id = group["osm_id"].iloc[0]
+        if len(true_stream) == 1:
+            long, lat = true_stream[["Long_intersection", "Lat_intersection"]].iloc[0]
+        elif len(true_stream) > 1:
+            min_dist_match = true_stream[true_stream["Is_Min_Dist"]]
+            if not min_dist_match.empty:
+                long, lat = min_dist_match[
+                    ["Long_intersection", "Lat_intersection"]
+                ].iloc[0]
+            else:
+                long, lat = true_stream[["Long_intersection", "Lat_intersection"]].iloc[
+                    0
+                ]
+        else:
+            # If there are no rows with stream_check as TRUE, use MIN-DIST
+            if not min_dist.empty:
+                long, lat = min_dist[["Long_intersection", "Lat_intersection"]].iloc[0]
+            else:
+                long, lat = group[["Long_intersection", "Lat_intersection"]].iloc[0]
+    else:
+        if len(true_stream) == 1:
+            # If there is exactly one OSM id with stream_check as TRUE
+            osm_id, long, lat = true_stream[
+                ["osm_id", "Long_intersection", "Lat_intersection"]
+            ].iloc[0]
+        else:
+            # If there are multiple OSM ids with stream_check as TRUE, use 'MIN-DIST'
+            if not min_dist.empty:
+                osm_id, long, lat = min_dist[
+                    ["osm_id", "Long_intersection", "Lat_intersection"]
+                ].iloc[0]
+            else:
+                osm_id, long, lat = [pd.NA, pd.NA, pd.NA]
+    return pd.Series(
+        [osm_id, long, lat], index=["final_osm_id", "final_long", "final_lat"]
+    )
+
+
+def join_all_data(nbi_osm_nhd, nbi_nhd):
+    """
+    Function to left join the NBI-30-OSM-NHD and NBI-10-NHD tables on the bridge
+    """
+    return nbi_osm_nhd.merge(nbi_nhd, on="STRUCTURE_NUMBER_008", how="left")
+
+
+def merge_join_data_with_intersections(final_join_data, intersection_data):
+    """
+    Function to tag all data join result with intersections information.
+    """
+    intersection_data = intersection_data[["WKT", "osm_id", "permanent_identifier"]]
+
+    # Perform the left merge
+    df = pd.merge(
+        final_join_data,
+        intersection_data,
+        how="left",
+        left_on=["osm_id", "permanent_identifier_x"],
+        right_on=["osm_id", "permanent_identifier"],
+    )
+
+    return df
+
+
+def create_intermediate_association(df):
+    """
+    Function to create intermediate association among bridges and ways.
+    """
+    # Apply the function to the WKT column to create new columns
+    df[["Lat_intersection", "Long_intersection"]] = df["WKT"].apply(
+        lambda x: pd.Series(extract_coordinates(x))
+    )
+
+    # Calculate Haversine distance
+    df["Haversine_dist"] = df.apply(
+        lambda row: haversine(
+            row["LONGDD"],
+            row["LATDD"],
+            row["Long_intersection"],
+            row["Lat_intersection"],
+        ),
+        axis=1,
+    )
+
+    # Calculate minimum Haversine distance for each bridge
+    df["Min_Haversine_dist"] = df.groupby("STRUCTURE_NUMBER_008")[
+        "Haversine_dist"
+    ].transform("min")
+
+    # Flag rows with minimum distance
+    df["Is_Min_Dist"] = df["Min_Haversine_dist"] == df["Haversine_dist"]
+
+    # Check if stream identifiers match
+    df["Is_Stream_Identical"] = (
+        df["permanent_identifier_x"] == df["permanent_identifier_y"]
+    )
+
+    return df
+
+
+def create_final_associations(df):
+    """
+    Function to create final association among bridges and ways.
+    """
+    # Group by 'BRIDGE_ID' and calculate the number of unique 'osm_id's for each group
+    unique_osm_count = (
+        df.groupby("STRUCTURE_NUMBER_008")["osm_id"].nunique().reset_index()
+    )
+
+    # Rename the column to 'combo-count'
+    unique_osm_count.rename(columns={"osm_id": "combo-count"}, inplace=True)
+
+    # Merge the unique counts back to the original dataframe
+    df = df.merge(unique_osm_count, on="STRUCTURE_NUMBER_008", how="left")
+
+    # Apply the function to each group and create a new DataFrame with final_osm_id, final_long, and final_lat for each BRIDGE_ID
+    final_values_df = (
+        df.groupby("STRUCTURE_NUMBER_008").apply(determine_final_osm_id).reset_index()
+    )
+
+    # Merge the final values back to the original dataframe
+    return df.merge(final_values_df, on="STRUCTURE_NUMBER_008", how="left")
+
+
+def add_bridge_details(df, bridge_data_df):
+    """
+    Function to add bridge information to associated data.
+    """
+    # Merge the data on 'STRUCTURE_NUMBER_008'
+    merged_df = pd.merge(
+        df,
+        bridge_data_df[["STRUCTURE_NUMBER_008", "STRUCTURE_LEN_MT_049"]],
+        on="STRUCTURE_NUMBER_008",
+        how="left",
+    )
+
+    # Select the required columns and ensure the uniqueness
+    result_df = merged_df[
+        [
+            "STRUCTURE_NUMBER_008",
+            "final_osm_id",
+            "final_long",
+            "final_lat",
+            "STRUCTURE_LEN_MT_049",
+        ]
+    ].drop_duplicates()
+
+    # Rename 'STRUCTURE_LEN_MT_049' to 'bridge_length'
+    result_df.rename(columns={"STRUCTURE_LEN_MT_049": "bridge_length"}, inplace=True)
+
+    return result_df
+
+
+def baseline_associations(final_join_data, intersection_data, bridge_data_df):
+    """
+    Function to run the baseline association stage on the joined table read back from
+    All-Join-Result.csv
+    """
+    df = merge_join_data_with_intersections(final_join_data, intersection_data)
+    df = create_intermediate_association(df)
+    df = create_final_associations(df)
+    return add_bridge_details(df, bridge_data_df)
+
+
+# Split stage: 04-obtaining-bridge-coordinates/01-obtain-bridge-split-info.py over a
+# list of (projected LineString, way id) that every lookup scans, run in one process
+# with the CSV writes and progress prints removed. The original built the bridge point
+# from the (lat, long) bridge_coordinate, so no bridge was ever within 1 m of its way;
+# here it is built from (long, lat) as the pipeline does.
+
+# Define projection transformations
+wgs84 = pyproj.CRS("EPSG:4326")
+utm_zone = pyproj.CRS("EPSG:32616")  # UTM zone for your input coordinates
+project = pyproj.Transformer.from_crs(wgs84, utm_zone, always_xy=True).transform
+inverse_project = pyproj.Transformer.from_crs(utm_zone, wgs84, always_xy=True).transform
+
+
+def load_bridges(df):
+    """
+    Function to read the bridge records of the split stage from an association table,
+    skipping the bridges without a final OSM way the original load_csv could not parse
+    """
+    bridge_data = []
+    for row_number, row in enumerate(df.to_dict("records"), start=1):
+        if pd.isna(row["final_osm_id"]):
+            continue
+        bridge_data.append(
+            {
+                "index": row_number,
+                "osm_id": int(row["final_osm_id"]),
+                "bridge_id": str(row["STRUCTURE_NUMBER_008"]),
+                "bridge_length": float(row["bridge_length"]),
+                "bridge_coordinate": (float(row["final_lat"]), float(row["final_long"])),
+            }
+        )
+    return bridge_data
+
+
+def find_nearest_point_on_line(line, point):
+    nearest_geoms = nearest_points(line, point)
+    return nearest_geoms[0]
+
+
+def find_way_id_for_point(point, all_lines_with_ids):
+    for line, way_id in all_lines_with_ids:
+        if line.distance(point) < 1e-6:
+            return way_id
+    return None
+
+
+def calculate_points_on_way(line, nearest_point, half_distance, all_lines_with_ids):
+    nearest_distance = line.project(nearest_point)
+    forward_distance = nearest_distance + half_distance
+    backward_distance = nearest_distance - half_distance
+
+    forward_point = (
+        line.interpolate(forward_distance) if forward_distance <= line.length else None
+    )
+    backward_point = (
+        line.interpolate(backward_distance) if backward_distance >= 0 else None
+    )
+
+    forward_way_id = None
+    backward_way_id = None
+
+    if forward_point is None:
+        forward_point, forward_way_id = extend_along_connected_way(
+            line, forward_distance - line.length, all_lines_with_ids
+        )
+    else:
+        forward_way_id = find_way_id_for_point(forward_point, all_lines_with_ids)
+
+    if backward_point is None:
+        backward_point, backward_way_id = extend_along_connected_way(
+            line, -backward_distance, all_lines_with_ids, reverse=True
+        )
+    else:
+        backward_way_id = find_way_id_for_point(backward_point, all_lines_with_ids)
+
+    return forward_point, forward_way_id, backward_point, backward_way_id
+
+
+def extend_along_connected_way(
+    current_line, remaining_distance, all_lines_with_ids, reverse=False
+):
+    start_or_end = 0 if reverse else -1
+    connection_point = Point(current_line.coords[start_or_end])
+
+    for line, way_id in all_lines_with_ids:
+        if line.equals(current_line):
+            continue
+        if connection_point.equals(Point(line.coords[0])):
+            next_line = line
+            next_point = next_line.interpolate(remaining_distance)
+            return next_point, way_id
+        elif connection_point.equals(Point(line.coords[-1])):
+            next_line = LineString(line.coords[::-1])
+            next_point = next_line.interpolate(remaining_distance)
+            return next_point, way_id
+
+    return connection_point, None
+
+
+def process_single_bridge(bridge, lines_utm_with_ids):
+    try:
+        osm_id = bridge["osm_id"]
+        bridge_length = bridge["bridge_length"]
+        input_coordinate = bridge["bridge_coordinate"]
+        half_distance = bridge_length / 2
+
+        point = Point(input_coordinate[1], input_coordinate[0])
+        point_utm = transform(project, point)
+
+        for line_utm, way_id in lines_utm_with_ids:
+            if way_id != osm_id:
+                continue
+
+            nearest_point_utm = find_nearest_point_on_line(line_utm, point_utm)
+            if line_utm.distance(point_utm) < 1:
+                (
+                    forward_point_utm,
+                    forward_way_id,
+                    backward_point_utm,
+                    backward_way_id,
+                ) = calculate_points_on_way(
+                    line_utm, nearest_point_utm, half_distance, lines_utm_with_ids
+                )
+                forward_point = transform(inverse_project, forward_point_utm)
+                backward_point = transform(inverse_project, backward_point_utm)
+
+                return {
+                    "original_osm_id": osm_id,
+                    "bridge_length": bridge_length,
+                    "bridge_coordinate": input_coordinate,
+                    "forward_point": (forward_point.x, forward_point.y),
+                    "backward_point": (backward_point.x, backward_point.y),
+                    "forward_way_id": forward_way_id or osm_id,
+                    "backward_way_id": backward_way_id or osm_id,
+                }
+    except Exception as e:
+        logging.error(f"Error processing bridge {bridge['osm_id']}: {e}")
+    return None
+
+
+def baseline_split_points(bridges_df, lines_with_ids):
+    """
+    Function to run the baseline split stage on an association table and the ways as
+    {way id: LineString in EPSG:4326}, returning the rows of the split coordinates CSV
+    with the structure number in front
+    """
+    lines_utm_with_ids = [
+        (transform(project, line), way_id) for way_id, line in lines_with_ids.items()
+    ]
+    rows = []
+    for bridge in load_bridges(bridges_df):
+        result = process_single_bridge(bridge, lines_utm_with_ids)
+        if result is None:
+            continue
+        rows.append(
+            [
+                bridge["bridge_id"],
+                result["original_osm_id"],
+                result["bridge_coordinate"],
+                result["bridge_length"],
+                result["forward_point"][1],
+                result["forward_point"][0],
+                result["forward_way_id"],
+                result["backward_point"][1],
+                result["backward_point"][0],
+                result["backward_way_id"],
+            ]
+        )
+    return rows
@@ -0,0 +1,128 @@
+import importlib.util
+import multiprocessing
+import os
+import sys
+
+import pandas as pd
+
+# Folder holding the numbered stage folders
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Write the intermediate CSV files of every stage, as the stage scripts do
+checkpoint = os.environ.get("PIPELINE_CHECKPOINT", "0") == "1"
+
+
+def load_stage(name, relative_path):
+    """
+    Function to import a numbered stage script as a module
+    """
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(scripts_dir, relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that pool workers can unpickle the stage functions
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+join_stage = load_stage("join_all_data", "03-associating-data/01-join-all-data.py")
+determine_stage = load_stage(
+    "determine_final_osm_id", "03-associating-data/02-determine-final-osm-id.py"
+)
+split_stage = load_stage(
+    "obtain_bridge_split_info",
+    "04-obtaining-bridge-coordinates/01-obtain-bridge-split-info.py",
+)
+
+
+def read_inputs():
+    """
+    Function to read the tagging outputs and the NBI bridge details used by the pipeline
+    """
+    join_tables = join_stage.read_join_tables()
+    intersection_data = pd.read_csv(determine_stage.intersections_csv, low_memory=False)
+    bridge_data_df = pd.read_csv(determine_stage.ntad_bridges_csv, low_memory=False)
+    return join_tables, intersection_data, bridge_data_df
+
+
+def run_association(
+    join_tables,
+    intersection_data,
+    bridge_data_df,
+    checkpoint=False,
+    store=None,
+):
+    """
+    Function to chain the join and association stages on in-memory tables, returning the
+    bridge associations with their lengths. They are also upserted into the association
+    store when one is given.
+    """
+    with join_stage.stage_profile("join-all-data"):
+        all_join_df = join_stage.build_all_join(join_tables)
+    if checkpoint:
+        determine_stage.background_writer.submit(
+            determine_stage.df_to_csv, all_join_df, join_stage.all_join_csv, index=False
+        )
+
+    with determine_stage.stage_profile("determine-final-osm-id"):
+        return determine_stage.determine_final_associations(
+            all_join_df, intersection_data, bridge_data_df, checkpoint, store
+        )
+
+
+def run_pipeline(
+    join_tables,
+    intersection_data,
+    bridge_data_df,
+    checkpoint=False,
+    store=None,
+):
+    """
+    Function to chain the association and split stages on in-memory tables, starting from
+    the link tables or the wide join tables of the tagging step, and returning the
+    bridge associations with their lengths and the split coordinates. The associations
+    are also upserted into the association store when one is given.
+    """
+    associations_df = run_association(
+        join_tables, intersection_data, bridge_data_df, checkpoint, store
+    )
+    with split_stage.stage_profile("obtain-bridge-split-info"):
+        split_df = split_stage.compute_split_points(associations_df)
+
+    determine_stage.background_writer.wait()
+    return associations_df, split_df
+
+
+def main():
+    if not os.path.exists(os.path.join(split_stage.way_store_dir, "meta.json")):
+        print(
+            f"Way store {split_stage.way_store_dir} not found, run 05-build-way-geometry-store.py first"
+        )
+        return
+
+    # The stage modules are not importable by name, so pool workers are forked
+    if "fork" in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method("fork", force=True)
+    split_stage.setup_logging()
+
+    store = determine_stage.open_association_store()
+    try:
+        associations_df, split_df = run_pipeline(
+            *read_inputs(), checkpoint=checkpoint, store=store
+        )
+        determine_stage.remove_stale_bridges(
+            store, associations_df["STRUCTURE_NUMBER_008"]
+        )
+        determine_stage.upsert_split_points(
+            store, split_df, associations_df["STRUCTURE_NUMBER_008"].unique()
+        )
+    finally:
+        store.close()
+
+    split_df.to_csv(split_stage.split_coords_csv, index=False, encoding="utf-8-sig")
+    print(f"Output file: {split_stage.split_coords_csv} has been created successfully!")
+
+
+if __name__ == "__main__":
+    main()
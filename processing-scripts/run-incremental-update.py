@@ -0,0 +1,126 @@
+import importlib.util
+import multiprocessing
+import os
+import sys
+
+import pandas as pd
+
+# Folder holding the pipeline scripts
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Association tables exported from the association store
+associations_csv = "output-data/csv-files/bridge-osm-association-with-lengths.csv"
+
+# Bridges to replace, written by the tagging step in incremental mode
+incremental_bridges_csv = "output-data/csv-files/NBI-Incremental-Bridges.csv"
+
+
+def load_script(name, relative_path):
+    """
+    Function to import a pipeline script as a module
+    """
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(scripts_dir, relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+pipeline = load_script("association_pipeline", "run-association-pipeline.py")
+determine_stage = pipeline.determine_stage
+split_stage = pipeline.split_stage
+
+
+def read_previous_table(csv_path):
+    """
+    Function to read an association table of the previous run without altering its values
+    """
+    return pd.read_csv(
+        csv_path,
+        dtype={"STRUCTURE_NUMBER_008": str},
+        encoding="utf-8-sig",
+        float_precision="round_trip",
+    )
+
+
+def stored_associations(store, structure_numbers):
+    """
+    Function to read the final way, point and length of the given bridges back from the
+    association store, in the layout of bridge-osm-association-with-lengths.csv
+    """
+    bridges = [
+        determine_stage.bridge_state(store, bridge_id)[0]
+        for bridge_id in sorted(structure_numbers)
+    ]
+    if not bridges:
+        return pd.DataFrame(columns=determine_stage.association_columns)
+    df = pd.concat(bridges, ignore_index=True)
+    return df.rename(columns={"structure_number": "STRUCTURE_NUMBER_008"})[
+        determine_stage.association_columns
+    ]
+
+
+def main():
+    split_coords_csv = split_stage.split_coords_csv
+    for required_path in [incremental_bridges_csv, determine_stage.association_db]:
+        if not os.path.exists(required_path):
+            print(f"{required_path} not found, run the incremental tagging step after a full run")
+            return
+
+    # Bridges of the release diff and bridges whose exclusion changed; removed
+    # and newly excluded bridges are only deleted from the store
+    replaced_ids = set(
+        pd.read_csv(incremental_bridges_csv, dtype={"STRUCTURE_NUMBER_008": str})[
+            "STRUCTURE_NUMBER_008"
+        ]
+    )
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method("fork", force=True)
+    split_stage.setup_logging()
+
+    store = determine_stage.open_association_store()
+    try:
+        # Stores filled by the stage scripts have no split points yet
+        if store.execute("SELECT COUNT(*) FROM split_points").fetchone()[0] == 0:
+            if not os.path.exists(split_coords_csv):
+                print(f"{split_coords_csv} not found, run run-association-pipeline.py first")
+                return
+            previous_split_df = read_previous_table(split_coords_csv)
+            determine_stage.upsert_split_points(
+                store, previous_split_df, previous_split_df["STRUCTURE_NUMBER_008"].unique()
+            )
+
+        # The incremental tagging outputs only hold the affected bridges. Their rows
+        # in the store are upserted, and the rest of the replaced bridges are deleted.
+        associations_df = pipeline.run_association(*pipeline.read_inputs(), store=store)
+        determine_stage.background_writer.wait()
+        delta_ids = set(associations_df["STRUCTURE_NUMBER_008"].astype(str))
+        determine_stage.delete_bridges(store, replaced_ids - delta_ids)
+
+        # The split stage reads the re-associated bridges back from the store
+        split_df = pd.DataFrame(columns=split_stage.split_coords_header)
+        if delta_ids:
+            with split_stage.stage_profile("obtain-bridge-split-info"):
+                split_df = split_stage.compute_split_points(
+                    stored_associations(store, delta_ids)
+                )
+        determine_stage.upsert_split_points(store, split_df, delta_ids)
+        print(
+            f"{len(replaced_ids | delta_ids)} bridges re-associated, "
+            f"{len(split_df)} bridges split......!"
+        )
+
+        # Both tables are exported from the store, which holds every bridge of the previous run
+        determine_stage.export_associations(store, associations_csv)
+        print(f"Output file: {associations_csv} has been updated successfully!")
+        determine_stage.export_split_points(store, split_coords_csv)
+        print(f"Output file: {split_coords_csv} has been updated successfully!")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
+
+# Folder holding the numbered stage folders
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Address of the service; keep it on localhost, it has no authentication
+host = os.environ.get("QUERY_HOST", "127.0.0.1")
+port = int(os.environ.get("QUERY_PORT", 8765))
+
+# Threads answering queries, so a slow route search does not hold up other requests
+query_workers = int(os.environ.get("QUERY_WORKERS", 8))
+
+# Default radius of the nearby way lookups
+near_radius_m = 30.0
+
+
+def load_script(name, relative_path):
+    """
+    Function to import a pipeline script as a module
+    """
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(scripts_dir, relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+determine_stage = load_script(
+    "determine_final_osm_id", "03-associating-data/02-determine-final-osm-id.py"
+)
+diagnose_stage = load_script(
+    "diagnose_unassociated_bridges", "03-associating-data/03-diagnose-unassociated-bridges.py"
+)
+split_stage = load_script(
+    "obtain_bridge_split_info",
+    "04-obtaining-bridge-coordinates/01-obtain-bridge-split-info.py",
+)
+export_stage = load_script(
+    "export_multi_way_bridges", "05-split-ways-add-bridge-tag/04-export-multi-way-bridges.py"
+)
+shortest_route = export_stage.load_shortest_route_script()
+
+
+class QueryError(Exception):
+    """
+    A query that cannot be answered, with the HTTP status to reply with
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class QueryIndexes:
+    """
+    The way index, topology graph, NHD index and association store of one snapshot.
+    They are loaded once and shared by every request until the next reload; inputs
+    that do not exist yet are left out and their queries answer 503.
+    """
+
+    def __init__(self):
+        started = time.perf_counter()
+        self.loaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.missing = []
+        # The way geometry cache and the SQLite connection are not thread-safe
+        self.way_lock = threading.Lock()
+        self.store_lock = threading.Lock()
+
+        self.ways = self.load_ways()
+        self.graph, self.way_nodes = self.load_graph()
+        self.streams, self.stream_tree = self.load_streams()
+        self.store = self.load_store()
+        self.load_seconds = time.perf_counter() - started
+
+    def load_ways(self):
+        if not os.path.exists(os.path.join(split_stage.way_store_dir, "meta.json")):
+            self.missing.append(split_stage.way_store_dir)
+            return None
+        return split_stage.IndexedWays(
+            split_stage.WayStore(split_stage.way_store_dir),
+            split_stage.cache_budget_mb * 2**20,
+        )
+
+    def load_graph(self):
+        if not os.path.exists(export_stage.osm_file):
+            self.missing.append(export_stage.osm_file)
+            return None, None
+        handler = shortest_route.WayHandler()
+        handler.apply_file(export_stage.osm_file)
+        return shortest_route.build_graph(handler.ways), handler.ways
+
+    def load_streams(self):
+        nhd_path = diagnose_stage.nhd_gpkg
+        if os.path.exists(diagnose_stage.nhd_subset_gpkg):
+            nhd_path = diagnose_stage.nhd_subset_gpkg
+        if not os.path.exists(nhd_path):
+            self.missing.append(nhd_path)
+            return None, None
+        streams = diagnose_stage.load_streams()
+        return streams, shapely.STRtree(streams.geometry.values)
+
+    def load_store(self):
+        if not os.path.exists(determine_stage.association_db):
+            self.missing.append(determine_stage.association_db)
+            return None
+        return sqlite3.connect(
+            f"file:{determine_stage.association_db}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+
+    def require(self, name):
+        value = getattr(self, name)
+        if value is None:
+            raise QueryError(HTTPStatus.SERVICE_UNAVAILABLE, f"No {name} loaded: {self.missing}")
+        return value
+
+
+def records(df):
+    """
+    Function to turn DataFrame rows into JSON objects, with missing values as null
+    """
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def json_default(value):
+    """
+    Function to encode the numpy scalars left in query results
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def number_param(params, name, default=None, cast=float):
+    """
+    Function to read a numeric query parameter
+    """
+    if name not in params:
+        if default is None:
+            raise QueryError(HTTPStatus.BAD_REQUEST, f"Missing parameter {name}")
+        return default
+    try:
+        return cast(params[name])
+    except ValueError:
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"Invalid parameter {name}: {params[name]}")
+
+
+def ways_within(indexes, lat, lon, radius_m):
+    """
+    Function to list the ways within radius_m of a point, nearest first
+    """
+    ways = indexes.require("ways")
+    # Bounds are in degrees: widen the box by the radius at this latitude
+    lat_margin = radius_m / 111320
+    lon_margin = lat_margin / max(np.cos(np.radians(lat)), 1e-6)
+    box = shapely.box(lon - lon_margin, lat - lat_margin, lon + lon_margin, lat + lat_margin)
+    way_indexes = ways.way_indexes[ways.bounds_tree.query(box)]
+    point_utm = shapely.points(*split_stage.utm_transformer.transform(lon, lat))
+
+    with indexes.way_lock:
+        lines = [ways.line(index) for index in way_indexes.tolist()]
+    distances = shapely.distance(np.array(lines + [None], dtype=object)[:-1], point_utm)
+    near = np.flatnonzero(distances <= radius_m)
+    near = near[np.argsort(distances[near], kind="stable")]
+    return [
+        {
+            "osm_id": int(ways.store.way_ids[way_indexes[position]]),
+            "distance_m": round(float(distances[position]), 2),
+        }
+        for position in near
+    ]
+
+
+def split_points(indexes, bridge):
+    """
+    Function to compute the split points of one associated bridge from the way index
+    """
+    ways = indexes.require("ways")
+    bridge_data = split_stage.bridges_from_dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "STRUCTURE_NUMBER_008": bridge["structure_number"],
+                    "final_osm_id": bridge["final_osm_id"],
+                    "final_lat": bridge["final_lat"],
+                    "final_long": bridge["final_long"],
+                    "bridge_length": bridge["bridge_length"],
+                }
+            ]
+        )
+    )
+    if not bridge_data:
+        return None
+
+    with indexes.way_lock:
+        results, overflow_bridges = split_stage.process_bridge_batch(bridge_data, ways)
+        # A bridge running past the end of its way continues along a connected way
+        for overflow_bridge in overflow_bridges:
+            result = split_stage.process_single_bridge(overflow_bridge, ways)
+            if result is not None:
+                results.append(result)
+    if not results:
+        return None
+    return dict(zip(split_stage.split_coords_header, split_stage.result_rows(results)[0]))
+
+
+def bridge_details(indexes, structure_number, params):
+    """
+    Function to answer GET /bridge/<id>: the stored association of a bridge, its candidate
+    ways and stream links, the ways near its final point and its split points
+    """
+    store = indexes.require("store")
+    with indexes.store_lock:
+        bridge_df, links_df = determine_stage.bridge_state(store, unquote(structure_number))
+    if bridge_df.empty:
+        raise QueryError(HTTPStatus.NOT_FOUND, f"Bridge {unquote(structure_number)} not found")
+    bridge = records(bridge_df)[0]
+
+    nearby_ways = []
+    if indexes.ways is not None and bridge["final_lat"] is not None:
+        nearby_ways = ways_within(
+            indexes,
+            bridge["final_lat"],
+            bridge["final_long"],
+            number_param(params, "radius", near_radius_m),
+        )
+    return {
+        "bridge": bridge,
+        "candidate_links": records(links_df),
+        "nearby_ways": nearby_ways,
+        "split": split_points(indexes, bridge) if indexes.ways is not None else None,
+    }
+
+
+def bridge_streams(indexes, structure_number, params):
+    """
+    Function to answer GET /bridge/<id>/streams: the nearest NHD streams of a bridge
+    """
+    store = indexes.require("store")
+    streams = indexes.require("streams")
+    with indexes.store_lock:
+        bridge_df, _ = determine_stage.bridge_state(store, unquote(structure_number))
+    if bridge_df.empty:
+        raise QueryError(HTTPStatus.NOT_FOUND, f"Bridge {unquote(structure_number)} not found")
+    bridge = records(bridge_df)[0]
+
+    count = number_param(params, "k", diagnose_stage.nearest_count, int)
+    radius = number_param(params, "radius", diagnose_stage.search_radius_m)
+    point_utm = shapely.points(
+        *split_stage.utm_transformer.transform(bridge["long"], bridge["lat"])
+    )
+    stream_index = indexes.stream_tree.query(point_utm, predicate="dwithin", distance=radius)
+    distances = shapely.distance(streams.geometry.values[stream_index], point_utm)
+    order = np.argsort(distances, kind="stable")[:count]
+
+    nearest = (
+        streams.drop(columns="geometry")
+        .iloc[stream_index[order]]
+        .rename(columns={"feature_id": "permanent_identifier"})
+        .reset_index(drop=True)
+    )
+    nearest["distance_m"] = np.round(distances[order], 1)
+    return {"structure_number": bridge["structure_number"], "streams": records(nearest)}
+
+
+def way_bridges(indexes, osm_id, params):
+    """
+    Function to answer GET /way/<id>/bridges: the bridges whose final way is this way
+    """
+    store = indexes.require("store")
+    with indexes.store_lock:
+        bridges_df = determine_stage.bridges_on_way(store, int(osm_id))
+    return {"osm_id": int(osm_id), "bridges": records(bridges_df)}
+
+
+def ways_near(indexes, params):
+    """
+    Function to answer GET /ways/near?lat=&lon=&radius=: the ways near a point
+    """
+    lat = number_param(params, "lat")
+    lon = number_param(params, "lon")
+    radius = number_param(params, "radius", near_radius_m)
+    return {"ways": ways_within(indexes, lat, lon, radius)}
+
+
+def route_between_ways(indexes, params):
+    """
+    Function to answer GET /route?from=&to=: the ways between two ways on the topology graph
+    """
+    graph = indexes.require("graph")
+    from_way = number_param(params, "from", cast=int)
+    to_way = number_param(params, "to", cast=int)
+    try:
+        way_path = shortest_route.find_shortest_path(graph, from_way, to_way, indexes.way_nodes)
+    except (KeyError, nx.NetworkXNoPath, nx.NodeNotFound):
+        raise QueryError(HTTPStatus.NOT_FOUND, f"No route between ways {from_way} and {to_way}")
+    return {"from": from_way, "to": to_way, "ways": way_path}
+
+
+def service_status(indexes, params):
+    """
+    Function to answer GET /status: what is loaded, and how warm the way cache is
+    """
+    return {
+        "loaded_at": indexes.loaded_at,
+        "load_seconds": round(indexes.load_seconds, 1),
+        "missing": indexes.missing,
+        "ways": len(indexes.ways.store) if indexes.ways is not None else None,
+        "way_cache": indexes.ways.cache.stats() if indexes.ways is not None else None,
+        "graph_edges": indexes.graph.number_of_edges() if indexes.graph is not None else None,
+        "streams": len(indexes.streams) if indexes.streams is not None else None,
+    }
+
+
+# GET routes: path pattern -> handler(indexes, *path groups, params)
+routes = [
+    (re.compile(r"/status"), service_status),
+    (re.compile(r"/bridge/([^/]+)"), bridge_details),
+    (re.compile(r"/bridge/([^/]+)/streams"), bridge_streams),
+    (re.compile(r"/way/(-?\d+)/bridges"), way_bridges),
+    (re.compile(r"/ways/near"), ways_near),
+    (re.compile(r"/route"), route_between_ways),
+]
+
+
+class QueryService:
+    """
+    Minimal HTTP/1.1 server on asyncio streams. Queries run on a thread pool against
+    the current QueryIndexes; POST /reload loads a new snapshot in the background and
+    swaps it in, while requests already running finish on the previous one.
+    """
+
+    def __init__(self):
+        self.indexes = None
+        self.executor = ThreadPoolExecutor(max_workers=query_workers)
+        self.reload_lock = asyncio.Lock()
+
+    async def reload(self):
+        async with self.reload_lock:
+            loop = asyncio.get_running_loop()
+            indexes = await loop.run_in_executor(self.executor, QueryIndexes)
+            # The previous snapshot is freed once its last request is done
+            self.indexes = indexes
+        print(
+            f"Indexes loaded in {indexes.load_seconds:.1f}s"
+            + (f", missing: {indexes.missing}" if indexes.missing else "")
+        )
+        return service_status(indexes, {})
+
+    async def dispatch(self, method, target):
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == "/reload":
+            if method != "POST":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Use POST /reload"}
+            return HTTPStatus.OK, await self.reload()
+
+        for pattern, handler in routes:
+            match = pattern.fullmatch(url.path)
+            if match is None:
+                continue
+            if method != "GET":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"Use GET {url.path}"}
+            loop = asyncio.get_running_loop()
+            try:
+                payload = await loop.run_in_executor(
+                    self.executor, handler, self.indexes, *match.groups(), params
+                )
+            except QueryError as error:
+                return error.status, {"error": error.message}
+            except Exception as error:
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(error)}
+            return HTTPStatus.OK, payload
+
+        return HTTPStatus.NOT_FOUND, {"error": f"No route for {url.path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            # Keep-alive connections answer one request after another
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0)):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                status, payload = await self.dispatch(method, target)
+                body = json.dumps(payload, default=json_default).encode()
+                keep_alive = (
+                    version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(body)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    ).encode("latin-1")
+                    + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        await self.reload()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Query service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    try:
+        asyncio.run(QueryService().serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,892 @@
+import importlib.util
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Folder holding the pipeline scripts
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Helpers shared by the processing scripts
+sys.path.insert(0, scripts_dir)
+from pipeline_helpers import candidate_exclusions, candidate_filters
+
+# "synthetic" generates small inputs; "sample" uses the pipeline outputs in output-data
+harness_input = os.environ.get("HARNESS_INPUT", "synthetic")
+
+# Bridges of the sample inputs run through the split comparisons, since the
+# reference implementation scans every way for every bridge
+sample_bridge_count = int(os.environ.get("HARNESS_SAMPLE_BRIDGES", 500))
+
+# Largest distance between reference and optimized coordinates that still counts as equal
+tolerance_m = float(os.environ.get("HARNESS_TOLERANCE_M", 0.01))
+
+report_csv = "output-data/csv-files/Regression-Report.csv"
+
+# Registered comparisons: name -> (kind, reference function, optimized function)
+comparisons = {}
+
+def load_script(name, relative_path):
+    """
+    Function to import a pipeline script as a module
+    """
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(scripts_dir, relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+pipeline = load_script("association_pipeline", "run-association-pipeline.py")
+store_builder = load_script(
+    "build_way_geometry_store", "01-filtering-data/05-build-way-geometry-store.py"
+)
+candidates_stage = load_script(
+    "build_bridge_way_candidates", "01-filtering-data/07-build-bridge-way-candidates.py"
+)
+export_stage = load_script(
+    "export_multi_way_bridges", "05-split-ways-add-bridge-tag/04-export-multi-way-bridges.py"
+)
+baseline = load_script("regression_baseline", "regression-baseline.py")
+join_stage = pipeline.join_stage
+determine_stage = pipeline.determine_stage
+split_stage = pipeline.split_stage
+
+
+def register_comparison(name, kind, reference, optimized, requires=None):
+    """
+    Function to register a reference and an optimized implementation of a stage.
+    Both take the harness inputs and return an association table ("association"),
+    a split coordinate table ("split"), a table of bridge sides ("bridge-sides") or a
+    table of bridge filter flags ("filters"). The comparison is skipped when the input
+    named by requires is missing.
+    """
+    comparisons[name] = (kind, reference, optimized, requires)
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """
+    Function to calculate the Haversine distance in metres between arrays of points
+    """
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(value, dtype="float64")) for value in (lat1, lon1, lat2, lon2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * 6371000.0 * np.arcsin(np.sqrt(a))
+
+
+def synthetic_way_store(store_dir, seed=7):
+    """
+    Function to write a way store for a grid of connected east-west and north-south ways
+    """
+    rng = np.random.default_rng(seed)
+    way_ids, counts, x, y = [], [], [], []
+    way_id = 1000
+    for row in range(20):
+        lat = 37.0 + row * 0.01
+        for column in range(30):
+            # Consecutive ways share their end nodes
+            lons = [-85.0 + (column * 3 + k) * 0.001 for k in range(4)]
+            lats = [lat, lat + rng.uniform(-1e-5, 1e-5), lat + rng.uniform(-1e-5, 1e-5), lat]
+            way_ids.append(way_id)
+            counts.append(4)
+            x.extend(lons)
+            y.extend(lats)
+            way_id += 1
+    for column in range(15):
+        lon = -85.0 + column * 0.006
+        for row in range(40):
+            way_ids.append(way_id)
+            counts.append(3)
+            x.extend([lon] * 3)
+            y.extend(37.0 + (row * 2 + k) * 0.0025 for k in range(3))
+            way_id += 1
+
+    arrays = store_builder.pack_store_arrays(
+        np.array(way_ids, dtype="int64"),
+        np.array(counts, dtype="int64"),
+        np.array(x),
+        np.array(y),
+    )
+    store_builder.write_store(store_dir, arrays, "synthetic")
+
+
+def synthetic_split_bridges(store_dir, count=400, seed=7):
+    """
+    Function to place bridges of random lengths on random ways of a way store
+    """
+    rng = np.random.default_rng(seed)
+    store = split_stage.WayStore(store_dir)
+    rows = []
+    for number in range(count):
+        index = int(rng.integers(len(store)))
+        point = store.line(index).interpolate(rng.random(), normalized=True)
+        rows.append(
+            {
+                "STRUCTURE_NUMBER_008": f"B{number}",
+                "final_osm_id": float(store.way_ids[index]),
+                "final_long": point.x,
+                "final_lat": point.y,
+                "bridge_length": round(rng.uniform(5, 400), 1),
+            }
+        )
+    # A bridge left without a final OSM way is skipped by every implementation
+    rows.append(
+        {
+            "STRUCTURE_NUMBER_008": "unassociated",
+            "final_osm_id": np.nan,
+            "final_long": np.nan,
+            "final_lat": np.nan,
+            "bridge_length": 10.0,
+        }
+    )
+    return pd.DataFrame(rows)
+
+
+def synthetic_association_inputs(count=300, seed=1):
+    """
+    Function to generate tagging link tables with several candidate ways and streams per bridge
+    """
+    rng = np.random.default_rng(seed)
+    bridges, bridge_ways, bridge_streams, intersections, ntad = [], [], [], [], []
+    way_streams = {}
+    for number in range(count):
+        bridge_id = f"B{number:05d}"
+        lat, lon = 37 + rng.random(), -85 + rng.random()
+        bridges.append(
+            {
+                "OBJECTID": number,
+                "STATE_CODE_001": 21,
+                "STRUCTURE_NUMBER_008": bridge_id,
+                "LATDD": lat,
+                "LONGDD": lon,
+            }
+        )
+        ntad.append(
+            {
+                "STRUCTURE_NUMBER_008": bridge_id,
+                "STRUCTURE_LEN_MT_049": round(rng.uniform(5, 120), 1),
+            }
+        )
+        streams = sorted({int(rng.integers(400)) for _ in range(rng.integers(0, 3))})
+        for stream in streams:
+            bridge_streams.append({"OBJECTID": number, "OBJECTID_2": stream})
+        # About one bridge in ten has no way within 30m
+        way_count = rng.integers(1, 4) if rng.random() < 0.9 else 0
+        way_ids = {int(rng.integers(1, 600)) for _ in range(way_count)}
+        for osm_id in sorted(way_ids):
+            bridge_ways.append(
+                {"OBJECTID": number, "osm_id": osm_id, "distance": round(rng.uniform(0, 30), 2)}
+            )
+            for _ in range(rng.integers(0, 3)):
+                stream = (
+                    int(rng.choice(streams))
+                    if streams and rng.random() < 0.7
+                    else int(rng.integers(400))
+                )
+                if stream in way_streams.setdefault(osm_id, []):
+                    continue
+                way_streams[osm_id].append(stream)
+                for _ in range(rng.integers(0, 4)):
+                    intersections.append(
+                        {
+                            "WKT": f"POINT ({lon + rng.uniform(-0.01, 0.01)} {lat + rng.uniform(-0.01, 0.01)})",
+                            "osm_id": float(osm_id),
+                            "permanent_identifier": f"S{stream}",
+                        }
+                    )
+    link_tables = {
+        "bridges": pd.DataFrame(bridges),
+        "bridge_ways": pd.DataFrame(bridge_ways),
+        "ways": pd.DataFrame(
+            {"osm_id": range(1, 600), "name": "n", "highway": "primary"}
+        ),
+        "way_streams": pd.DataFrame(
+            [
+                {"osm_id": osm_id, "OBJECTID": stream}
+                for osm_id, streams in way_streams.items()
+                for stream in streams
+            ]
+        ),
+        "bridge_streams": pd.DataFrame(bridge_streams),
+        "streams": pd.DataFrame(
+            {"OBJECTID": range(400), "permanent_identifier": [f"S{k}" for k in range(400)]}
+        ),
+    }
+    return (
+        link_tables,
+        pd.DataFrame(intersections, columns=["WKT", "osm_id", "permanent_identifier"]),
+        pd.DataFrame(ntad),
+    )
+
+
+def wide_tables_from_links(link_tables):
+    """
+    Function to rebuild the wide NBI-30-OSM-NHD and NBI-10-NHD join tables written before
+    the link tables, with one row per bridge, way and stream combination
+    """
+    stream_ids = dict(
+        zip(link_tables["streams"]["OBJECTID"], link_tables["streams"]["permanent_identifier"])
+    )
+    way_rows = link_tables["ways"].set_index("osm_id")[["name", "highway"]].to_dict("index")
+    streams_of_way = link_tables["way_streams"].groupby("osm_id")["OBJECTID"].apply(list)
+    ways_of_bridge = link_tables["bridge_ways"].groupby("OBJECTID")["osm_id"].apply(list)
+    streams_of_bridge = link_tables["bridge_streams"].groupby("OBJECTID")["OBJECTID_2"].apply(list)
+
+    nbi_osm_nhd, nbi_nhd = [], []
+    for bridge in link_tables["bridges"].to_dict("records"):
+        # Bridges, ways and streams without a match keep one row, as the QGIS joins did
+        for osm_id in ways_of_bridge.get(bridge["OBJECTID"], [None]):
+            way = way_rows.get(osm_id, {"name": None, "highway": None})
+            for stream in streams_of_way.get(osm_id, [None]):
+                nbi_osm_nhd.append(
+                    {
+                        **bridge,
+                        "osm_id": osm_id,
+                        **way,
+                        "OBJECTID_2": stream,
+                        "permanent_identifier": stream_ids.get(stream),
+                    }
+                )
+        for stream in streams_of_bridge.get(bridge["OBJECTID"], [None]):
+            nbi_nhd.append(
+                {
+                    "STRUCTURE_NUMBER_008": bridge["STRUCTURE_NUMBER_008"],
+                    "permanent_identifier": stream_ids.get(stream),
+                }
+            )
+    return {
+        "nbi_osm_nhd": pd.DataFrame(nbi_osm_nhd).astype(
+            {"osm_id": "float64", "OBJECTID_2": "float64", "permanent_identifier": "object"}
+        ),
+        "nbi_nhd": pd.DataFrame(nbi_nhd).astype({"permanent_identifier": "object"}),
+    }
+
+
+def load_inputs(work_dir):
+    """
+    Function to build the inputs shared by every comparison
+    """
+    if harness_input == "sample":
+        join_tables, intersections, ntad = pipeline.read_inputs()
+        store_dir = split_stage.way_store_dir
+        split_bridges = pd.read_csv(
+            "output-data/csv-files/bridge-osm-association-with-lengths.csv",
+            dtype={"STRUCTURE_NUMBER_008": str},
+            float_precision="round_trip",
+        )
+        split_bridges = split_bridges.sample(
+            min(sample_bridge_count, len(split_bridges)), random_state=0
+        ).sort_index()
+    else:
+        join_tables, intersections, ntad = synthetic_association_inputs()
+        store_dir = os.path.join(work_dir, "way-store")
+        synthetic_way_store(store_dir)
+        split_bridges = synthetic_split_bridges(store_dir)
+
+    # Outputs of older tagging runs only have the wide tables
+    link_tables = join_tables if "bridge_ways" in join_tables else None
+    return {
+        "join_tables": join_tables,
+        "link_tables": link_tables,
+        "wide_tables": wide_tables_from_links(link_tables) if link_tables is not None else join_tables,
+        "intersections": intersections,
+        "ntad": ntad,
+        "store_dir": store_dir,
+        "split_bridges": split_bridges,
+        "work_dir": work_dir,
+    }
+
+
+def staged_associations(inputs):
+    """
+    Function to run the association stages with a CSV file between stages, as the stage scripts do
+    """
+    all_join_csv = os.path.join(inputs["work_dir"], "All-Join-Result.csv")
+    join_stage.build_all_join(inputs["join_tables"]).to_csv(all_join_csv, index=False)
+    associations_df = determine_stage.determine_final_associations(
+        pd.read_csv(all_join_csv), inputs["intersections"], inputs["ntad"]
+    )
+    associations_csv = os.path.join(inputs["work_dir"], "associations.csv")
+    associations_df.to_csv(associations_csv, index=False)
+    return pd.read_csv(associations_csv)
+
+
+def baseline_join(inputs):
+    """
+    Function to join the wide tables with the frozen baseline of regression-baseline.py,
+    passing the joined table through a CSV file as the baseline did
+    """
+    all_join_csv = os.path.join(inputs["work_dir"], "Baseline-All-Join-Result.csv")
+    baseline.join_all_data(
+        inputs["wide_tables"]["nbi_osm_nhd"], inputs["wide_tables"]["nbi_nhd"]
+    ).to_csv(all_join_csv, index=False)
+    return pd.read_csv(all_join_csv)
+
+
+def baseline_associations(inputs):
+    """
+    Function to run the frozen baseline association stage of regression-baseline.py on
+    the wide tables
+    """
+    return baseline.baseline_associations(
+        baseline_join(inputs), inputs["intersections"], inputs["ntad"]
+    )
+
+
+def nearest_crossing_associations(inputs):
+    """
+    Function to run the frozen baseline association stage with each candidate row keeping
+    only the crossing of its way and stream nearest to the bridge
+    """
+    final_join_data = baseline_join(inputs)
+    df = baseline.merge_join_data_with_intersections(
+        final_join_data.assign(join_row=np.arange(len(final_join_data))),
+        inputs["intersections"],
+    )
+    df = baseline.create_intermediate_association(df)
+    # Rows without a crossing sort last and are kept when they are alone
+    df = df.sort_values(["join_row", "Haversine_dist"], kind="stable").drop_duplicates(
+        "join_row"
+    )
+    df = baseline.create_final_associations(df.drop(columns="join_row"))
+    return baseline.add_bridge_details(df, inputs["ntad"])
+
+
+def associations_from(tables_key):
+    """
+    Function to build an implementation running the association stages in memory on
+    the join tables, the link tables or the wide tables of the inputs
+    """
+
+    def associate(inputs):
+        return determine_stage.determine_final_associations(
+            join_stage.build_all_join(inputs[tables_key]),
+            inputs["intersections"],
+            inputs["ntad"],
+        )
+
+    return associate
+
+
+def store_lines(store_dir):
+    """
+    Function to read the ways of a way store as {way id: LineString} in store order,
+    straight from its arrays
+    """
+    way_ids, offsets, x, y = (
+        np.load(os.path.join(store_dir, f"{name}.npy"))
+        for name in ["way_ids", "offsets", "x", "y"]
+    )
+    return {
+        int(way_id): shapely.LineString(np.column_stack([x[start:end], y[start:end]]))
+        for way_id, start, end in zip(way_ids, offsets[:-1], offsets[1:])
+    }
+
+
+def baseline_split_points(inputs):
+    """
+    Function to split every bridge with the frozen baseline split stage of
+    regression-baseline.py, scanning all ways for each lookup
+    """
+    return pd.DataFrame(
+        baseline.baseline_split_points(
+            inputs["split_bridges"], store_lines(inputs["store_dir"])
+        ),
+        columns=split_stage.split_coords_header,
+    )
+
+
+def split_points_with_mode(batched):
+    """
+    Function to build a split implementation running compute_split_points in one mode
+    """
+
+    def compute(inputs):
+        previous_mode = split_stage.batched_mode
+        split_stage.batched_mode = batched
+        try:
+            return split_stage.compute_split_points(
+                inputs["split_bridges"], inputs["store_dir"]
+            )
+        finally:
+            split_stage.batched_mode = previous_mode
+
+    return compute
+
+
+def streaming_split_points(inputs):
+    """
+    Function to split the bridges tile by tile through the streaming mode
+    """
+    output_csv = os.path.join(inputs["work_dir"], "streaming-split-coords.csv")
+    open(output_csv, "w").close()
+    bridge_data = split_stage.bridges_from_dataframe(inputs["split_bridges"])
+    split_stage.process_bridge_data_streaming(bridge_data, inputs["store_dir"], output_csv)
+    return pd.read_csv(
+        output_csv,
+        header=None,
+        names=split_stage.split_coords_header,
+        dtype={"STRUCTURE_NUMBER_008": str},
+        float_precision="round_trip",
+    )
+
+
+# Two-way bridges in every orientation of their ways: (first way nodes, second way nodes,
+# nodes of the ways between them, expected bridge side of the first and second split point).
+# Node n lies at longitude -85 + (n % 100) / 1000, and the split points lie halfway
+# between the two western nodes of the first way and the two eastern nodes of the second
+bridge_side_fixtures = {
+    "same-direction": ([1, 2, 3], [3, 4, 5], [], "after", "before"),
+    "second-reversed": ([101, 102, 103], [105, 104, 103], [], "after", "after"),
+    "first-reversed": ([203, 202, 201], [203, 204, 205], [], "before", "before"),
+    "both-reversed": ([303, 302, 301], [305, 304, 303], [], "before", "after"),
+    "additional-way": ([401, 402, 403], [404, 405, 406], [[403, 404]], "after", "before"),
+}
+
+
+def expected_bridge_sides(inputs):
+    """
+    Function to list the bridge sides expected for the bridge side fixtures
+    """
+    return pd.DataFrame(
+        [
+            {
+                "STRUCTURE_NUMBER_008": name,
+                "first_bridge_side": first_side,
+                "second_bridge_side": second_side,
+            }
+            for name, (_, _, _, first_side, second_side) in bridge_side_fixtures.items()
+        ]
+    )
+
+
+def exported_bridge_sides(inputs):
+    """
+    Function to export the bridge side fixtures through 04-export-multi-way-bridges.py
+    """
+    ways, bridges = {}, []
+    for number, (name, (first_nodes, second_nodes, between, _, _)) in enumerate(
+        bridge_side_fixtures.items()
+    ):
+        first_way_id, second_way_id = number * 10 + 1, number * 10 + 2
+        ways[first_way_id], ways[second_way_id] = first_nodes, second_nodes
+        for offset, nodes in enumerate(between):
+            ways[number * 10 + 3 + offset] = nodes
+        lat = 37.0 + number * 0.01
+        first_lon = -85.0 + sum(sorted(node % 100 for node in first_nodes)[:2]) / 2000
+        second_lon = -85.0 + sum(sorted(node % 100 for node in second_nodes)[-2:]) / 2000
+        bridges.append(
+            {
+                "STRUCTURE_NUMBER_008": name,
+                "osm_id_for_first_split_point": first_way_id,
+                "first_split_point_lat": lat,
+                "first_split_point_lon": first_lon,
+                "osm_id_for_second_split_point": second_way_id,
+                "second_split_point_lat": lat,
+                "second_split_point_lon": second_lon,
+            }
+        )
+    locations = {
+        way_id: [
+            (-85.0 + (node % 100) / 1000, 37.0 + (way_id // 10) * 0.01) for node in nodes
+        ]
+        for way_id, nodes in ways.items()
+    }
+    graph = export_stage.load_shortest_route_script().build_graph(ways)
+    coordinate_sets, _ = export_stage.build_coordinate_sets(
+        pd.DataFrame(bridges), graph, ways, locations
+    )
+    return pd.DataFrame(
+        [
+            {
+                "STRUCTURE_NUMBER_008": coordinate_set["bridgeId"],
+                "first_bridge_side": coordinate_set["points"][0]["bridgeSide"],
+                "second_bridge_side": coordinate_set["points"][1]["bridgeSide"],
+            }
+            for coordinate_set in coordinate_sets
+        ]
+    )
+
+
+# One bridge and one way per case, 1 km apart: (way highway, man_made column, other_tags,
+# distance in metres from the bridge to the way). No distance is within 2 m of a radius.
+filter_fixtures = {
+    "bridge-tag": ("primary", None, '"bridge"=>"yes","layer"=>"1"', 50),
+    "bridge-tag-far": ("primary", None, '"bridge"=>"yes"', 90),
+    "man-made-bridge": ("footway", "bridge", None, 70),
+    "layer": ("secondary", None, '"layer"=>"1"', 20),
+    "layer-far": ("secondary", None, '"layer"=>"2"', 40),
+    "layer-below": ("secondary", None, '"layer"=>"-1"', 5),
+    "parallel": ("trunk", None, '"oneway"=>"yes"', 25),
+    "parallel-far": ("motorway", None, '"oneway"=>"yes","lanes"=>"2"', 35),
+    "oneway-residential": ("residential", None, '"oneway"=>"yes"', 10),
+    "two-way-primary": ("primary", None, '"oneway"=>"no"', 10),
+    "oneway-bridge": ("primary", None, '"oneway"=>"yes","bridge"=>"viaduct"', 10),
+    "untagged": ("primary", None, None, 5),
+}
+
+
+def filter_fixture(inputs):
+    """
+    Function to write the ways of the filter fixtures to a GeoPackage laid out as the
+    ogr2ogr 'lines' layer, and return its path with the bridge points in the metric CRS
+    """
+    gpkg_path = os.path.join(inputs["work_dir"], "filter-fixture.gpkg")
+    bridges, ways = [], []
+    for number, (name, (highway, man_made, other_tags, distance)) in enumerate(
+        filter_fixtures.items()
+    ):
+        x, y = 600000.0 + number * 1000, 4100000.0
+        bridges.append(
+            {"OBJECTID": number, "STRUCTURE_NUMBER_008": name, "geometry": shapely.Point(x, y)}
+        )
+        ways.append(
+            {
+                "osm_id": str(number + 1),
+                "name": name,
+                "highway": highway,
+                "man_made": man_made,
+                "other_tags": other_tags,
+                "geometry": shapely.LineString(
+                    [(x - 200, y + distance), (x + 200, y + distance)]
+                ),
+            }
+        )
+    metric_crs = candidates_stage.metric_crs
+    gpd.GeoDataFrame(ways, crs=metric_crs).to_crs("EPSG:4326").to_file(
+        gpkg_path, layer="lines", driver="GPKG"
+    )
+    return gpkg_path, gpd.GeoDataFrame(bridges, crs=metric_crs)
+
+
+def filter_flags(bridges, excluded):
+    """
+    Function to list the filter flags of every bridge from the excluded bridges of each filter
+    """
+    flags = bridges[["STRUCTURE_NUMBER_008"]].copy()
+    for reason, bridge_ids in excluded.items():
+        flags[f"excluded_{reason}"] = flags["STRUCTURE_NUMBER_008"].isin(bridge_ids)
+    return flags
+
+
+def buffer_filter_flags(inputs):
+    """
+    Function to apply the bridge filters as the tagging step's buffer joins do: select the
+    ways with the filter expression on their fields, buffer them and find the bridges inside
+    """
+    gpkg_path, bridges = filter_fixture(inputs)
+    ways = gpd.read_file(gpkg_path, layer="lines").to_crs(bridges.crs)
+    tags = ways["other_tags"].fillna("").map(
+        lambda value: dict(re.findall(r'"([^"]+)"=>"([^"]*)"', value))
+    )
+    bridge_tag = tags.map(lambda way_tags: way_tags.get("bridge"))
+    oneway = tags.map(lambda way_tags: way_tags.get("oneway"))
+    layer = pd.to_numeric(tags.map(lambda way_tags: way_tags.get("layer")), errors="coerce")
+    expressions = {
+        # bridge is not null or man_made='bridge'
+        "bridge_tag": (80, bridge_tag.notna() | (ways["man_made"] == "bridge")),
+        # layer>0
+        "layer_tag": (30, layer > 0),
+        # highway IN (...) AND oneway = 'yes' AND bridge is null
+        "parallel": (
+            30,
+            ways["highway"].isin(
+                ["motorway_link", "primary", "primary_link", "trunk", "motorway", "trunk_link"]
+            )
+            & (oneway == "yes")
+            & bridge_tag.isna(),
+        ),
+    }
+    excluded = {}
+    for reason, (radius, selected) in expressions.items():
+        buffers = shapely.buffer(ways.geometry.values[selected.values], radius)
+        inside = shapely.STRtree(buffers).query(
+            bridges.geometry.values, predicate="intersects"
+        )[0]
+        excluded[reason] = set(bridges["STRUCTURE_NUMBER_008"].values[inside])
+    return filter_flags(bridges, excluded)
+
+
+def candidate_filter_flags(inputs):
+    """
+    Function to apply the bridge filters as column predicates over the bridge-way
+    candidates built by 07-build-bridge-way-candidates.py
+    """
+    gpkg_path, bridges = filter_fixture(inputs)
+    streams = gpd.GeoDataFrame(
+        {"OBJECTID": [0], "permanent_identifier": ["S0"]},
+        geometry=[shapely.LineString([(590000, 4090000), (590100, 4090000)])],
+        crs=bridges.crs,
+    )
+    candidates = candidates_stage.build_candidates(
+        bridges, candidates_stage.load_ways(gpkg_path, "lines"), streams
+    )
+    candidates["layer"] = pd.to_numeric(candidates["layer"], errors="coerce")
+    return filter_flags(
+        bridges,
+        {reason: candidate_exclusions(candidates, reason) for reason in candidate_filters},
+    )
+
+
+def keyed(df, key_columns):
+    """
+    Function to key rows by their columns and their occurrence, so duplicated bridges pair up in order
+    """
+    df = df.copy()
+    df["STRUCTURE_NUMBER_008"] = df["STRUCTURE_NUMBER_008"].astype(str)
+    df["occurrence"] = df.groupby(key_columns).cumcount()
+    return df
+
+
+def mismatch_rows(merged, issue, reference_column, optimized_column, distance=None):
+    """
+    Function to format the mismatching rows of one check for the report
+    """
+    return pd.DataFrame(
+        {
+            "STRUCTURE_NUMBER_008": merged["STRUCTURE_NUMBER_008"].values,
+            "issue": issue,
+            "reference": merged[reference_column].astype(str).values,
+            "optimized": merged[optimized_column].astype(str).values,
+            "distance_m": np.nan if distance is None else np.round(distance, 3),
+        }
+    )
+
+
+def compare_outputs(reference_df, optimized_df, id_columns, point_columns, label_columns):
+    """
+    Function to list the bridges missing from one output, with different way ids or
+    labels, or with points further apart than the tolerance
+    """
+    key_columns = ["STRUCTURE_NUMBER_008"]
+    merged = keyed(reference_df, key_columns).merge(
+        keyed(optimized_df, key_columns),
+        on=key_columns + ["occurrence"],
+        how="outer",
+        suffixes=("_reference", "_optimized"),
+        indicator=True,
+    )
+
+    problems = []
+    merged["present"], merged["missing"] = "present", "missing"
+    for side, issue, reference_column, optimized_column in [
+        ("left_only", "missing_optimized", "present", "missing"),
+        ("right_only", "missing_reference", "missing", "present"),
+    ]:
+        missing = merged[merged["_merge"] == side]
+        problems.append(mismatch_rows(missing, issue, reference_column, optimized_column))
+    merged = merged[merged["_merge"] == "both"]
+
+    for column in id_columns:
+        reference_ids = pd.to_numeric(merged[f"{column}_reference"], errors="coerce")
+        optimized_ids = pd.to_numeric(merged[f"{column}_optimized"], errors="coerce")
+        differs = (reference_ids != optimized_ids) & ~(
+            reference_ids.isna() & optimized_ids.isna()
+        )
+        problems.append(
+            mismatch_rows(
+                merged[differs.values],
+                f"{column}_differs",
+                f"{column}_reference",
+                f"{column}_optimized",
+            )
+        )
+
+    for column in label_columns:
+        differs = (
+            merged[f"{column}_reference"].astype(str) != merged[f"{column}_optimized"].astype(str)
+        )
+        problems.append(
+            mismatch_rows(
+                merged[differs.values],
+                f"{column}_differs",
+                f"{column}_reference",
+                f"{column}_optimized",
+            )
+        )
+
+    for lat_column, lon_column in point_columns:
+        values = {
+            f"{column}_{side}": pd.to_numeric(merged[f"{column}_{side}"], errors="coerce")
+            for column in (lat_column, lon_column)
+            for side in ("reference", "optimized")
+        }
+        distances = distance_m(
+            values[f"{lat_column}_reference"],
+            values[f"{lon_column}_reference"],
+            values[f"{lat_column}_optimized"],
+            values[f"{lon_column}_optimized"],
+        )
+        one_missing = (
+            values[f"{lat_column}_reference"].isna() != values[f"{lat_column}_optimized"].isna()
+        ).values
+        differs = (distances > tolerance_m) | one_missing
+        problems.append(
+            mismatch_rows(
+                merged[differs],
+                f"{lat_column.rsplit('_', 1)[0]}_moved",
+                f"{lat_column}_reference",
+                f"{lat_column}_optimized",
+                distances[differs],
+            )
+        )
+
+    return len(merged), pd.concat(problems, ignore_index=True)
+
+
+# Columns compared for each kind of output
+output_checks = {
+    "association": (["final_osm_id"], [("final_lat", "final_long")], []),
+    "split": (
+        ["osm_id_for_first_split_point", "osm_id_for_second_split_point"],
+        [
+            ("first_split_point_lat", "first_split_point_lon"),
+            ("second_split_point_lat", "second_split_point_lon"),
+        ],
+        [],
+    ),
+    "bridge-sides": ([], [], ["first_bridge_side", "second_bridge_side"]),
+    "filters": (
+        [],
+        [],
+        ["excluded_bridge_tag", "excluded_layer_tag", "excluded_parallel"],
+    ),
+}
+
+# Reasons of the intended differences of the association stage
+nearest_crossing_way = (
+    "a way crossing the same stream several times is one candidate, so a single "
+    "stream match is no longer sent through the minimum distance rule"
+)
+nearest_crossing_point = "the final point is the crossing nearest to the bridge, not the first one"
+
+
+def nearest_crossing_changes(inputs, reference_df):
+    """
+    Function to list the bridges whose baseline association changes when only the
+    nearest crossing of each way and stream is kept, with the reason of each
+    """
+    _, problems = compare_outputs(
+        reference_df, nearest_crossing_associations(inputs), *output_checks["association"]
+    )
+    reasons = {}
+    for bridge_id, issue in zip(problems["STRUCTURE_NUMBER_008"], problems["issue"]):
+        if issue == "final_osm_id_differs":
+            reasons[bridge_id] = nearest_crossing_way
+        else:
+            reasons.setdefault(bridge_id, nearest_crossing_point)
+    return reasons
+
+
+# Bridges whose results change on purpose, by comparison: a function of the inputs and
+# the reference output returning {bridge: reason}. They are reported with their reason
+# but do not fail the run.
+intended_differences = {"association-baseline": nearest_crossing_changes}
+
+register_comparison(
+    "association-in-process",
+    "association",
+    staged_associations,
+    associations_from("join_tables"),
+)
+register_comparison(
+    "association-baseline",
+    "association",
+    baseline_associations,
+    associations_from("join_tables"),
+)
+register_comparison(
+    "association-link-tables",
+    "association",
+    associations_from("wide_tables"),
+    associations_from("link_tables"),
+    requires="link_tables",
+)
+register_comparison(
+    "split-batched", "split", baseline_split_points, split_points_with_mode(batched=True)
+)
+register_comparison(
+    "split-pool", "split", baseline_split_points, split_points_with_mode(batched=False)
+)
+register_comparison(
+    "split-streaming", "split", baseline_split_points, streaming_split_points
+)
+register_comparison(
+    "multi-way-bridge-sides", "bridge-sides", expected_bridge_sides, exported_bridge_sides
+)
+register_comparison(
+    "candidate-filters", "filters", buffer_filter_flags, candidate_filter_flags
+)
+
+
+def main():
+    if "fork" in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method("fork", force=True)
+    split_stage.setup_logging()
+
+    selected = sys.argv[1:] or list(comparisons)
+    reports = []
+    summary = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        inputs = load_inputs(work_dir)
+        reference_outputs = {}
+        for name in selected:
+            kind, reference, optimized, requires = comparisons[name]
+            if requires and inputs[requires] is None:
+                print(f"Skipping {name}: the inputs have no {requires}")
+                continue
+            # Comparisons sharing a reference implementation run it once
+            if reference not in reference_outputs:
+                reference_outputs[reference] = reference(inputs)
+            compared, problems = compare_outputs(
+                reference_outputs[reference], optimized(inputs), *output_checks[kind]
+            )
+            problems.insert(0, "comparison", name)
+            intended = {}
+            if name in intended_differences:
+                intended = intended_differences[name](inputs, reference_outputs[reference])
+            problems["intended"] = problems["STRUCTURE_NUMBER_008"].map(intended)
+            reports.append(problems)
+            differing = set(problems["STRUCTURE_NUMBER_008"])
+            summary.append(
+                (
+                    name,
+                    compared,
+                    len(differing - set(intended)),
+                    len(differing & set(intended)),
+                    sorted(set(intended) - differing),
+                )
+            )
+
+    print(f"\nRegression harness on {harness_input} inputs (tolerance {tolerance_m} m):")
+    for name, compared, mismatched, intended, unchanged in summary:
+        print(
+            f"   {name}: {compared} rows compared, {mismatched} bridges differ, "
+            f"{intended} intended differences"
+        )
+        if unchanged:
+            print(f"      Allow-listed bridges that no longer differ: {unchanged}")
+
+    report = pd.concat(reports, ignore_index=True)
+    os.makedirs(os.path.dirname(report_csv), exist_ok=True)
+    report.to_csv(report_csv, index=False)
+    print(f"Output file: {report_csv} has been created successfully!")
+
+    if report["intended"].isna().any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
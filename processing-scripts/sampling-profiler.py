@@ -0,0 +1,227 @@
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from html import escape
+
+# Folder receiving the collapsed stacks, flame graphs and hotspot summaries
+profile_dir = os.environ.get("PROFILE_DIR", "output-data/profiles")
+
+# Time between two samples of every thread's stack
+sample_interval_s = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+
+# Also sample background threads (CSV writers, pool handlers), not only the profiled thread
+sample_all_threads = os.environ.get("PROFILE_ALL_THREADS", "0") == "1"
+
+# Number of functions listed in the hotspot summaries
+top_count = int(os.environ.get("PROFILE_TOP", 25))
+
+# Flame graph layout
+flame_width = 1200
+flame_row_height = 16
+
+# Samples of the stages profiled in this process, merged across repeated runs of a stage
+stage_samples = {}
+
+
+def frame_label(frame):
+    """
+    Function to name a stack frame by its function, file and first line
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the thread that started it, or of every thread, from a
+    background thread. The profiled code is not instrumented, so it runs at full
+    speed between samples.
+    """
+
+    def __init__(self, interval=sample_interval_s):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.thread.ident or (
+                not sample_all_threads and thread_id != self.target_ident
+            ):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, str(thread_id)))
+            self.samples[";".join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.target_ident = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+
+def hotspots(samples, count=top_count):
+    """
+    Function to rank functions by self samples (leaf of the stack) and total samples
+    (anywhere in the stack, counted once per stack)
+    """
+    self_samples = Counter()
+    total_samples = Counter()
+    for stack, sample_count in samples.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        self_samples[frames[-1]] += sample_count
+        for label in set(frames):
+            total_samples[label] += sample_count
+    return [
+        (label, self_count, total_samples[label])
+        for label, self_count in self_samples.most_common(count)
+    ]
+
+
+def write_collapsed(samples, path):
+    """
+    Function to write stacks in the collapsed format read by flamegraph.pl and speedscope
+    """
+    with open(path, "w") as f:
+        for stack, sample_count in sorted(samples.items()):
+            f.write(f"{stack} {sample_count}\n")
+
+
+def write_flame_graph(samples, path, title):
+    """
+    Function to draw the collapsed stacks as an SVG flame graph
+    """
+    # Tree of frames: label -> [samples, children]
+    root = [0, {}]
+    for stack, sample_count in samples.items():
+        node = root
+        node[0] += sample_count
+        for label in stack.split(";"):
+            node = node[1].setdefault(label, [0, {}])
+            node[0] += sample_count
+
+    rects = []
+    max_depth = 0
+
+    def layout(children, x, depth):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        for label, (sample_count, grandchildren) in sorted(children.items()):
+            width = sample_count / max(root[0], 1) * flame_width
+            if width >= 0.5:
+                rects.append((label, sample_count, x, depth, width))
+                layout(grandchildren, x, depth + 1)
+            x += width
+
+    layout(root[1], 0.0, 0)
+
+    height = (max_depth + 2) * flame_row_height + 10
+    lines = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{flame_width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="12">{escape(title)}: {root[0]} samples</text>',
+    ]
+    for label, sample_count, x, depth, width in rects:
+        y = height - (depth + 1) * flame_row_height
+        # Warm colours varying with the label, as in flamegraph.pl
+        hue = 10 + sum(label.encode()) % 40
+        text = escape(label[: max(int(width / 7) - 1, 0)])
+        lines.append(
+            f'<g><title>{escape(label)} ({sample_count} samples, '
+            f"{100 * sample_count / max(root[0], 1):.1f}%)</title>"
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{flame_row_height - 1}" '
+            f'fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + flame_row_height - 4}">{text}</text></g>'
+        )
+    lines.append("</svg>")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def write_hotspots(samples, path, title, elapsed):
+    """
+    Function to write the top functions by self and total samples
+    """
+    total = max(sum(samples.values()), 1)
+    lines = [
+        f"{title}: {total} samples over {elapsed:.1f}s",
+        f"{'self %':>7} {'total %':>8}  function",
+    ]
+    for label, self_count, total_count in hotspots(samples):
+        lines.append(
+            f"{100 * self_count / total:7.1f} {100 * total_count / total:8.1f}  {label}"
+        )
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return lines
+
+
+def finish_profile(profiler, name, quiet):
+    """
+    Function to stop a profiler, merge its samples into those of its stage and write
+    name.collapsed, name.svg and name-top.txt
+    """
+    profiler.stop()
+    samples, elapsed = stage_samples.get(name, (Counter(), 0.0))
+    samples.update(profiler.samples)
+    elapsed += profiler.elapsed
+    stage_samples[name] = (samples, elapsed)
+
+    os.makedirs(profile_dir, exist_ok=True)
+    base_path = os.path.join(profile_dir, name)
+    write_collapsed(samples, f"{base_path}.collapsed")
+    write_flame_graph(samples, f"{base_path}.svg", name)
+    summary = write_hotspots(samples, f"{base_path}-top.txt", name, elapsed)
+    if not quiet:
+        print("\n".join(summary[:12]))
+        print(f"Profile of {name} written to {base_path}.svg")
+
+
+@contextmanager
+def profile_stage(name, quiet=False):
+    """
+    Sample the code run inside the block and write name.collapsed, name.svg and
+    name-top.txt. Repeated blocks with the same name in one process are merged.
+    """
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        finish_profile(profiler, name, quiet)
+
+
+def profile_process(name):
+    """
+    Sample the calling thread until its process exits, then write the profile once.
+    Pool workers skip atexit handlers, but run multiprocessing finalizers when the
+    pool is closed and joined.
+    """
+    profiler = SamplingProfiler()
+    profiler.start()
+    multiprocessing.util.Finalize(
+        None, finish_profile, args=(profiler, name, True), exitpriority=10
+    )
+    return profiler